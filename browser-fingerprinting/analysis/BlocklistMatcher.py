@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Matches URLs against Adblock Plus filter lists (EasyList, EasyPrivacy) with
+ the verdicts of adblockparser's AdblockRules, without testing every rule of
+ the list. Rules are parsed by adblockparser and indexed by a token that every
+ URL they match must contain as a whole (a host label or a path component,
+ e.g. "doubleclick" for "||doubleclick.net^"), so only the few rules whose
+ token occurs in a URL are tested. Rules without such a token are tested for
+ every URL, as before.
+
+ Only the "third-party" option is supported at matching time; as in
+ AdblockRules, rules that require other options never apply without them.
+ The compiled rule set is cached next to the list, keyed by the list's hash,
+ and verdicts are cached per URL.
+"""
+
+import os
+import re
+import pickle
+import hashlib
+
+from adblockparser import AdblockRule
+
+# Bump when the cached rule set layout changes.
+CACHE_VERSION = 1
+
+# Options the matcher can be given at matching time.
+SUPPORTED_OPTIONS = frozenset(["third-party"])
+
+# Verdicts cached per matcher; the cache is cleared when it is full.
+MAX_CACHED_VERDICTS = 1000000
+
+TOKEN_RE = re.compile(r"[0-9a-z]+")
+RULE_TOKEN_RE = re.compile(r"[0-9A-Za-z]+")
+
+def is_boundary(char):
+    """Return True if a URL matched by a rule has a non-token character where the rule has `char`."""
+    # "^" matches a separator (a non-word character) or the end of the URL.
+    return char != "*" and char.isascii() and not char.isalnum()
+
+def get_rule_tokens(rule_text):
+    """Return the tokens that every URL matched by the given rule (without options) contains as a whole."""
+    if len(rule_text) > 1 and rule_text.startswith("/") and rule_text.endswith("/"):
+        # Regular expression rule
+        return []
+    start_anchored = rule_text.startswith("|")
+    body = rule_text.lstrip("|")
+    end_anchored = body.endswith("|")
+    body = body[:-1] if end_anchored else body
+    if "|" in body or len(rule_text) - len(body) - end_anchored > 2:
+        # adblockparser mangles the character after an inner "|".
+        return []
+    tokens = list()
+    for match in RULE_TOKEN_RE.finditer(body):
+        start, end = match.span()
+        left_bounded = is_boundary(body[start-1]) if start > 0 else start_anchored
+        right_bounded = is_boundary(body[end]) if end < len(body) else end_anchored
+        if left_bounded and right_bounded:
+            tokens.append(match.group().lower())
+    return tokens
+
+def get_url_tokens(url):
+    return set(TOKEN_RE.findall(url.lower()))
+
+def parse_rules(lines):
+    """Return the rules of AdblockRules(lines) that can apply with SUPPORTED_OPTIONS.
+
+    Each rule is a (rule_text, regex, ignore_case, third_party, is_exception)
+    tuple; `third_party` is the value the rule requires for "third-party"
+    (None if it does not require one).
+    """
+    all_options = dict([(option, True) for option in AdblockRule.BINARY_OPTIONS + ["domain"]])
+    rules = list()
+    for line in lines:
+        rule = AdblockRule(line)
+        if not (rule.regex or rule.options) or not rule.matching_supported(all_options):
+            continue
+        required = set(rule.options) - set(["match-case"])
+        if not required.issubset(SUPPORTED_OPTIONS):
+            # Requires an option (e.g. "domain" or "script") that is never given.
+            continue
+        # AdblockRules matches rules without options case-insensitively, all others as is.
+        rules.append((rule.rule_text, rule.regex, not rule.options, rule.options.get("third-party"), rule.is_exception))
+    return rules
+
+class BlocklistMatcher():
+    def __init__(self, lines):
+        """BlocklistMatcher compiles the filter list given as lines, as AdblockRules(lines) would."""
+        rules = parse_rules(lines)
+        candidates = [get_rule_tokens(rule[0]) for rule in rules]
+        frequency = dict()
+        for tokens in candidates:
+            for token in set(tokens):
+                frequency[token] = frequency.get(token, 0) + 1
+        # Rules by their rarest token
+        self.token_rules = dict()
+        # Rules without token; those without options are combined into one regex, as by AdblockRules.
+        self.generic_rules = list()
+        generic_regexes = {True: list(), False: list()}
+        for rule, tokens in zip(rules, candidates):
+            _, regex, ignore_case, third_party, is_exception = rule
+            rule = (regex, ignore_case, third_party, is_exception)
+            if tokens:
+                token = min(tokens, key=lambda token: (frequency[token], -len(token)))
+                self.token_rules.setdefault(token, list()).append(rule)
+            elif ignore_case:
+                if regex:
+                    generic_regexes[is_exception].append(regex)
+            else:
+                self.generic_rules.append(rule)
+        self.generic_regexes = dict([(is_exception, "|".join(regexes)) for is_exception, regexes in generic_regexes.items() if regexes])
+        self.rule_count = len(rules)
+        self._init_caches()
+
+    def _init_caches(self):
+        self.patterns = dict()
+        self.verdicts = dict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["patterns"]
+        del state["verdicts"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_caches()
+
+    def __len__(self):
+        return self.rule_count
+
+    def _search(self, regex, ignore_case, url):
+        key = (regex, ignore_case)
+        if not key in self.patterns:
+            self.patterns[key] = re.compile(regex, re.IGNORECASE if ignore_case else 0)
+        return self.patterns[key].search(url) is not None
+
+    def _matches(self, url, rules, third_party, is_exception):
+        if is_exception in self.generic_regexes and self._search(self.generic_regexes[is_exception], True, url):
+            return True
+        for regex, ignore_case, required, exception in rules:
+            if exception != is_exception:
+                continue
+            if required is not None and required != third_party:
+                continue
+            if self._search(regex, ignore_case, url):
+                return True
+        return False
+
+    def should_block(self, url, options=None):
+        """Return True if the list blocks the URL, given the options of the request."""
+        options = options or {}
+        for option in options:
+            if not option in SUPPORTED_OPTIONS:
+                raise ValueError("Unsupported option "+option)
+        third_party = options.get("third-party")
+        key = (url, third_party)
+        if key in self.verdicts:
+            return self.verdicts[key]
+
+        if url.isascii():
+            rules = list()
+            for token in get_url_tokens(url):
+                rules.extend(self.token_rules.get(token, ()))
+        else:
+            # Non-ASCII characters may match ASCII letters when ignoring case.
+            rules = [rule for token_rules in self.token_rules.values() for rule in token_rules]
+        rules.extend(self.generic_rules)
+        if "third-party" not in options:
+            # Rules that require the option do not apply without it.
+            rules = [rule for rule in rules if rule[2] is None]
+
+        verdict = False
+        if not self._matches(url, rules, third_party, True):
+            verdict = self._matches(url, rules, third_party, False)
+
+        if len(self.verdicts) >= MAX_CACHED_VERDICTS:
+            self.verdicts.clear()
+        self.verdicts[key] = verdict
+        return verdict
+
+def read_rules(file_name):
+    """Return the rule lines of a filter list, without comments."""
+    with open(file_name, "r") as f:
+        return set([l.strip() for l in f if len(l) != 0 and l[0] != '!'])
+
+def get_cache_file(file_name):
+    return os.path.splitext(file_name)[0]+".matcher.pickle"
+
+def load(file_name, cache_file=None):
+    """Return the BlocklistMatcher of the filter list in `file_name`, from the cache if the list is unchanged."""
+    cache_file = cache_file or get_cache_file(file_name)
+    with open(file_name, "rb") as f:
+        key = (CACHE_VERSION, hashlib.sha256(f.read()).hexdigest())
+    try:
+        with open(cache_file, "rb") as f:
+            cached_key, matcher = pickle.load(f)
+        if cached_key == key:
+            return matcher
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError, AttributeError, ImportError):
+        pass
+    matcher = BlocklistMatcher(read_rules(file_name))
+    try:
+        temp_file_name = cache_file+".tmp"
+        with open(temp_file_name, "wb") as f:
+            pickle.dump((key, matcher), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file_name, cache_file)
+    except OSError:
+        # The cache only speeds up the next start.
+        pass
+    return matcher
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Ownership lookups in DuckDuckGo's Tracker Radar entity map, which lists the
+ domains ("properties") of every entity. The map is inverted once into a
+ property -> entities index, so that "do these domains have the same owner?"
+ and "who owns this domain?" are answered with a dict lookup instead of a scan
+ of all entities. The index is cached next to the map and rebuilt whenever
+ the map changes.
+"""
+
+import os
+import json
+import pickle
+import hashlib
+
+# Bump when the cached index layout changes.
+CACHE_VERSION = 2
+
+class EntityIndex():
+    def __init__(self, entities):
+        """EntityIndex indexes an entity map of {entity: {"displayName", "properties"}}."""
+        # Entities of every property, in the order of the entity map.
+        self.property_entities = dict()
+        self.display_names = dict()
+        for entity in entities:
+            self.display_names[entity] = entities[entity].get("displayName", entity)
+            for property in entities[entity]["properties"]:
+                owners = self.property_entities.setdefault(property, list())
+                if not entity in owners:
+                    owners.append(entity)
+        self.property_entities = {property: tuple(owners) for property, owners in self.property_entities.items()}
+
+    def __len__(self):
+        return len(self.display_names)
+
+    def get_entities(self, domain):
+        """Return the entities that own the given domain."""
+        return self.property_entities.get(domain, ())
+
+    def get_display_name(self, domain, default="-"):
+        """Return the display name of the (first) entity that owns the given domain."""
+        owners = self.property_entities.get(domain)
+        if not owners:
+            return default
+        return self.display_names[owners[0]]
+
+    def same_owner(self, domain, other):
+        """Return True if some entity owns both domains."""
+        owners = self.property_entities.get(domain)
+        if not owners:
+            return False
+        other_owners = self.property_entities.get(other, ())
+        return any([owner in other_owners for owner in owners])
+
+def get_cache_file(file_name):
+    return os.path.splitext(file_name)[0]+".index.pickle"
+
+def load(file_name, cache_file=None):
+    """Return the EntityIndex of the entity map in `file_name`, from the cache if the map is unchanged."""
+    cache_file = cache_file or get_cache_file(file_name)
+    with open(file_name, "rb") as f:
+        content = f.read()
+    key = (CACHE_VERSION, hashlib.sha256(content).hexdigest())
+    try:
+        with open(cache_file, "rb") as f:
+            cached_key, index = pickle.load(f)
+        if cached_key == key:
+            return index
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError, AttributeError, ImportError):
+        pass
+    index = EntityIndex(json.loads(content))
+    try:
+        temp_file_name = cache_file+".tmp"
+        with open(temp_file_name, "wb") as f:
+            pickle.dump((key, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file_name, cache_file)
+    except OSError:
+        # The cache only speeds up the next start.
+        pass
+    return index
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Stores the fingerprinting findings (one document per website and script)
+ and answers the queries of the analysis. Two backends are available:
+
+   MongoResultStore   the fingerprinting_results collection of a MongoDB
+                      server (mongodb://host:port)
+   SQLiteResultStore  an SQLite file that needs no server; every finding is
+                      a JSON document, with its scalar fields in indexed
+                      columns and the elements of its list fields (e.g.
+                      blocklists) in an indexed table
+
+ Both take filters of the form {field: value}, where a list field matches if
+ it contains the value, as in MongoDB. Findings are buffered and written in
+ bulk, the indexes are created once up front and the URLs that were already
+ analysed are loaded with a single query.
+
+ The MongoDB dump of the results can be loaded into an SQLite store with:
+
+   python3 ResultStore.py import <SQLITE_FILE> <JSON_FILE>
+"""
+
+import sys
+import json
+import sqlite3
+
+try:
+    import pymongo
+    from pymongo.write_concern import WriteConcern
+except ImportError:
+    pymongo = None
+
+MONGO_URI = "mongodb://localhost:27017"
+DATABASE = "web3_privacy"
+COLLECTION = "fingerprinting_results"
+
+# Findings written per bulk insert
+BATCH_SIZE = 1000
+
+# Fields of the findings that are indexed
+INDEXES = [
+    "tranco_rank",
+    "url",
+    "url_domain",
+    "initiator",
+    "initiator_domain",
+    "script",
+    "script_domain",
+    "third_party",
+    "browser_fingerprinting",
+    "category",
+    "blocklists",
+    "detected_wallet_apis",
+    "fingerprinting_categories",
+    "evidence"
+]
+
+# Indexed fields that hold lists
+LIST_FIELDS = ["blocklists", "detected_wallet_apis", "fingerprinting_categories", "evidence"]
+SCALAR_FIELDS = [field for field in INDEXES if not field in LIST_FIELDS]
+
+def parse_write_concern(text):
+    """Parse the "w" of a write concern (e.g. 0, 1 or majority); usable as an argparse type."""
+    return int(text) if text.isdigit() else text
+
+def open_store(location, **kwargs):
+    """Return the MongoResultStore of a mongodb:// URI or else the SQLiteResultStore of a file."""
+    if location.startswith("mongodb://") or location.startswith("mongodb+srv://"):
+        return MongoResultStore(location, **kwargs)
+    return SQLiteResultStore(location, **kwargs)
+
+class MongoResultStore():
+    def __init__(self, uri=MONGO_URI, batch_size=BATCH_SIZE, write_concern=None):
+        """MongoResultStore keeps the findings in MongoDB, writing `batch_size` at a time.
+
+        `write_concern` is the "w" of the inserts (default: that of the
+        server); e.g. 0 speeds up bulk loads at the cost of unacknowledged writes.
+        """
+        if pymongo is None:
+            raise ImportError("pymongo is required to store the results in MongoDB")
+        self.connection = pymongo.MongoClient(uri, maxPoolSize=None)
+        self.collection = self.connection[DATABASE][COLLECTION]
+        if write_concern is not None:
+            self.collection = self.collection.with_options(write_concern=WriteConcern(w=write_concern))
+        self.batch_size = batch_size
+        self.buffer = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def create_indexes(self):
+        self.collection.create_indexes([pymongo.IndexModel(field) for field in INDEXES])
+
+    def load_analyzed_urls(self):
+        """Return the set of the URLs that have findings."""
+        return set([document["url"] for document in self.collection.find({}, {"url": 1, "_id": 0}) if "url" in document])
+
+    def add(self, finding):
+        self.buffer.append(finding)
+
+    def checkpoint(self):
+        """Write the buffered findings if a batch is full; call it between websites."""
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.collection.insert_many(self.buffer, ordered=False)
+            self.buffer = list()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def count(self, filter=None):
+        return self.collection.count_documents(filter or {})
+
+    def distinct(self, field, filter=None):
+        """Return the distinct values of the field (the elements, for lists)."""
+        return self.collection.distinct(field, filter or {})
+
+    def find(self, filter=None, sort=None, limit=None):
+        """Return the findings that match the filter, ascending by the field `sort` if given."""
+        cursor = self.collection.find(filter or {})
+        if sort is not None:
+            cursor = cursor.sort(sort)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return cursor
+
+    def count_by(self, field, filter=None):
+        """Return [{"_id": value, "count": findings}] for the values of the field, by descending count and value."""
+        return list(self.collection.aggregate([
+            {"$match": filter or {}},
+            {"$unwind": "$"+field},
+            {"$group": {"_id": "$"+field, "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": -1}}
+        ]))
+
+class SQLiteResultStore():
+    def __init__(self, file_name, batch_size=BATCH_SIZE, write_concern=None):
+        """SQLiteResultStore keeps the findings in an SQLite file, writing `batch_size` at a time.
+
+        `write_concern` is accepted for compatibility with MongoResultStore; 0
+        turns off the synchronous writes to disk.
+        """
+        self.db = sqlite3.connect(file_name)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        if write_concern == 0:
+            self.db.execute("PRAGMA synchronous=OFF")
+        # No column types, so that values keep their type (tranco_rank is a number or "").
+        self.db.execute("CREATE TABLE IF NOT EXISTS findings (id INTEGER PRIMARY KEY, document TEXT NOT NULL, "+", ".join(SCALAR_FIELDS)+")")
+        self.db.execute("CREATE TABLE IF NOT EXISTS finding_values (finding INTEGER NOT NULL, field TEXT NOT NULL, value)")
+        self.db.commit()
+        self.batch_size = batch_size
+        self.buffer = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def create_indexes(self):
+        for field in SCALAR_FIELDS:
+            self.db.execute("CREATE INDEX IF NOT EXISTS findings_"+field+" ON findings ("+field+")")
+        self.db.execute("CREATE INDEX IF NOT EXISTS finding_values_value ON finding_values (field, value, finding)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS finding_values_finding ON finding_values (finding)")
+        self.db.commit()
+
+    def load_analyzed_urls(self):
+        """Return the set of the URLs that have findings."""
+        return set([row[0] for row in self.db.execute("SELECT DISTINCT url FROM findings WHERE url IS NOT NULL")])
+
+    def add(self, finding):
+        self.buffer.append(finding)
+
+    def checkpoint(self):
+        """Write the buffered findings if a batch is full; call it between websites."""
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        with self.db:
+            for finding in self.buffer:
+                finding = dict([(key, value) for key, value in finding.items() if key != "_id"])
+                cursor = self.db.execute("INSERT INTO findings (document, "+", ".join(SCALAR_FIELDS)+") VALUES (?"+", ?"*len(SCALAR_FIELDS)+")",
+                    [json.dumps(finding)]+[finding.get(field) for field in SCALAR_FIELDS])
+                values = list()
+                for field in LIST_FIELDS:
+                    for value in finding.get(field) or []:
+                        values.append((cursor.lastrowid, field, value))
+                self.db.executemany("INSERT INTO finding_values VALUES (?, ?, ?)", values)
+        self.buffer = list()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def get_where(self, filter):
+        """Return the SQL condition and parameters of a filter."""
+        conditions = list()
+        parameters = list()
+        for field, value in (filter or {}).items():
+            if isinstance(value, dict):
+                raise ValueError("Unsupported filter on "+field+": only {field: value} filters are supported")
+            if field in LIST_FIELDS:
+                conditions.append("EXISTS (SELECT 1 FROM finding_values WHERE finding = findings.id AND field = ? AND value = ?)")
+                parameters.extend([field, value])
+            elif field in SCALAR_FIELDS:
+                conditions.append(field+" = ?")
+                parameters.append(value)
+            else:
+                conditions.append("json_extract(document, ?) = ?")
+                parameters.extend(["$."+field, value])
+        return (" WHERE "+" AND ".join(conditions) if conditions else ""), parameters
+
+    def get_values(self, field):
+        """Return the SQL expression of the values of the field (the elements, for lists) and the tables to select them from."""
+        if field in LIST_FIELDS:
+            return "finding_values.value", "findings JOIN finding_values ON finding_values.finding = findings.id AND finding_values.field = '"+field+"'"
+        if field in SCALAR_FIELDS:
+            return field, "findings"
+        return "json_extract(document, '$."+field+"')", "findings"
+
+    def count(self, filter=None):
+        where, parameters = self.get_where(filter)
+        return self.db.execute("SELECT COUNT(*) FROM findings"+where, parameters).fetchone()[0]
+
+    def distinct(self, field, filter=None):
+        """Return the distinct values of the field (the elements, for lists)."""
+        where, parameters = self.get_where(filter)
+        values, tables = self.get_values(field)
+        rows = self.db.execute("SELECT DISTINCT "+values+" FROM "+tables+where+" ORDER BY 1", parameters)
+        return [row[0] for row in rows if row[0] is not None]
+
+    def find(self, filter=None, sort=None, limit=None):
+        """Return the findings that match the filter, ascending by the field `sort` if given."""
+        where, parameters = self.get_where(filter)
+        query = "SELECT document FROM findings"+where
+        if sort is not None:
+            if sort in LIST_FIELDS:
+                raise ValueError("Cannot sort by the list field "+sort)
+            values, _ = self.get_values(sort)
+            query += " ORDER BY "+values+" IS NOT NULL, "+values+", id"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters = parameters + [limit]
+        return [json.loads(row[0]) for row in self.db.execute(query, parameters)]
+
+    def count_by(self, field, filter=None):
+        """Return [{"_id": value, "count": findings}] for the values of the field, by descending count and value."""
+        where, parameters = self.get_where(filter)
+        values, tables = self.get_values(field)
+        rows = self.db.execute("SELECT "+values+", COUNT(*) FROM "+tables+where+" GROUP BY 1 HAVING "+values+" IS NOT NULL ORDER BY 2 DESC, 1 DESC", parameters)
+        return [{"_id": value, "count": count} for value, count in rows]
+
+    def import_json(self, file_name):
+        """Add the findings of a MongoDB export (one document per line, or a JSON array); return their number."""
+        with open(file_name, "r") as f:
+            text = f.read()
+        if text.lstrip().startswith("["):
+            findings = json.loads(text)
+        else:
+            findings = [json.loads(line) for line in text.splitlines() if line.strip()]
+        for finding in findings:
+            self.add(finding)
+            self.checkpoint()
+        self.flush()
+        return len(findings)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "import":
+        print("Usage: {} import <SQLITE_FILE> <JSON_FILE>".format(sys.argv[0]), file=sys.stderr)
+        sys.exit(1)
+    with SQLiteResultStore(sys.argv[2]) as store:
+        store.create_indexes()
+        print("Imported", store.import_json(sys.argv[3]), "finding(s) into", sys.argv[2], file=sys.stderr)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Fetches the scripts found by the fingerprinting detection and stores their
+ bodies by content: every body is written once to objects/<sha256[:2]>/<sha256>
+ and a manifest maps every script URL to the hash of its body. Copies of the
+ same library served by thousands of sites are thus stored once, and scripts
+ with the same file name no longer overwrite each other.
+
+ Scripts are fetched concurrently: an asyncio event loop runs the requests
+ over a shared, pooled HTTP session, with a limit on the requests per host,
+ a timeout and retries with backoff for failed requests.
+
+ Bodies are searched as raw bytes; they are only beautified on demand, and
+ the beautified code is cached by the hash of the body, so that all analyses
+ share it.
+"""
+
+import os
+import re
+import sys
+import time
+import asyncio
+import sqlite3
+import hashlib
+import requests
+import jsbeautifier
+import concurrent.futures
+import urllib.parse
+
+# Requests running at the same time, in total and per host
+CONCURRENCY = 16
+CONCURRENCY_PER_HOST = 4
+TIMEOUT = 30
+RETRIES = 3
+# Seconds before the first retry; doubled for every further retry
+BACKOFF = 1.0
+# Responses with these status codes are retried
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+# Scripts stored between two commits of the manifest
+COMMIT_INTERVAL = 100
+# Errors that are not retried
+PERMANENT_ERRORS = (requests.exceptions.InvalidURL, requests.exceptions.InvalidSchema, requests.exceptions.MissingSchema, ValueError)
+
+# Encodings in which ASCII text is not stored as ASCII bytes
+NON_ASCII_ENCODINGS = ("utf-16", "utf_16", "utf-32", "utf_32", "utf16", "utf32")
+
+def get_hash(body):
+    return hashlib.sha256(body).hexdigest()
+
+def overlaps(term, other):
+    """Return True if one occurrence of `other` can hide one of `term` from a scan for both."""
+    if term in other or other in term:
+        return True
+    return any([term.endswith(other[:i]) or other.endswith(term[:i]) for i in range(1, min(len(term), len(other)))])
+
+class TermScanner():
+    def __init__(self, terms):
+        """TermScanner finds which of the given terms occur in a text, in one pass."""
+        self.terms = list(terms)
+        self.pattern = re.compile("|".join([re.escape(term) for term in self.terms]))
+        self.bytes_pattern = re.compile(b"|".join([re.escape(term.encode("utf-8")) for term in self.terms]))
+        # Terms that a scan for all terms can miss; they are checked on their own.
+        self.shadowed = [term for term in self.terms if any([overlaps(term, other) for other in self.terms if other != term])]
+
+    def scan(self, body):
+        """Return the terms that occur in `body` (str or bytes), in the order of the terms."""
+        if isinstance(body, bytes):
+            pattern = self.bytes_pattern
+            found = set([match.group().decode("utf-8") for match in pattern.finditer(body)])
+            found.update([term for term in self.shadowed if term.encode("utf-8") in body])
+        else:
+            found = set([match.group() for match in self.pattern.finditer(body)])
+            found.update([term for term in self.shadowed if term in body])
+        return [term for term in self.terms if term in found]
+
+class ScriptStore():
+    def __init__(self, directory, headers=None, concurrency=CONCURRENCY, concurrency_per_host=CONCURRENCY_PER_HOST,
+                 timeout=TIMEOUT, retries=RETRIES):
+        """ScriptStore keeps the fetched scripts in `directory`, requesting them with `headers`."""
+        self.directory = directory
+        self.headers = headers or dict()
+        self.concurrency = concurrency
+        self.concurrency_per_host = concurrency_per_host
+        self.timeout = timeout
+        self.retries = retries
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, "manifest.sqlite"))
+        self.db.execute("CREATE TABLE IF NOT EXISTS scripts (url TEXT PRIMARY KEY, hash TEXT NOT NULL, encoding TEXT, status INTEGER, fetched REAL NOT NULL)")
+        self.db.commit()
+        self.session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        self.db.close()
+
+    def __contains__(self, url):
+        return self.get_hash(url) is not None
+
+    def get_hash(self, url):
+        """Return the hash of the body of the script, or None if it was not fetched."""
+        row = self.db.execute("SELECT hash FROM scripts WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def get_path(self, hash):
+        return os.path.join(self.directory, "objects", hash[:2], hash)
+
+    def read(self, url):
+        """Return the body of the script as bytes, or None if it was not fetched."""
+        hash = self.get_hash(url)
+        if hash is None:
+            return None
+        with open(self.get_path(hash), "rb") as f:
+            return f.read()
+
+    def read_text(self, url):
+        """Return the body of the script decoded as it was served, or None if it was not fetched."""
+        row = self.db.execute("SELECT hash, encoding FROM scripts WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        with open(self.get_path(row[0]), "rb") as f:
+            return str(f.read(), row[1] or "utf-8", errors="replace")
+
+    def get_status(self, url):
+        """Return the HTTP status the script was served with, or None if it was not fetched."""
+        row = self.db.execute("SELECT status FROM scripts WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def search(self, url, scanner):
+        """Return the terms of the TermScanner that occur in the body of the script (none if it was not fetched)."""
+        row = self.db.execute("SELECT hash, encoding FROM scripts WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return []
+        with open(self.get_path(row[0]), "rb") as f:
+            body = f.read()
+        if row[1] and row[1].lower().startswith(NON_ASCII_ENCODINGS):
+            return scanner.scan(str(body, row[1], errors="replace"))
+        return scanner.scan(body)
+
+    def get_beautified(self, url):
+        """Return the beautified body of the script, or None if it was not fetched."""
+        hash = self.get_hash(url)
+        if hash is None:
+            return None
+        path = os.path.join(self.directory, "beautified", hash[:2], hash+".js")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8", errors="surrogatepass") as f:
+                return f.read()
+        code = jsbeautifier.beautify(self.read_text(url))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_file_name = path+".tmp"
+        with open(temp_file_name, "w", encoding="utf-8", errors="surrogatepass") as f:
+            f.write(code)
+        os.replace(temp_file_name, path)
+        return code
+
+    def put(self, url, body, encoding=None, status=None):
+        """Store the body of the script and return its hash."""
+        hash = get_hash(body)
+        path = self.get_path(hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_file_name = path+".tmp"
+            with open(temp_file_name, "wb") as f:
+                f.write(body)
+            os.replace(temp_file_name, path)
+        self.db.execute("INSERT OR REPLACE INTO scripts VALUES (?, ?, ?, ?, ?)", (url, hash, encoding, status, time.time()))
+        return hash
+
+    def fetch_all(self, urls):
+        """Fetch and store all scripts that were not fetched yet; return the number of scripts fetched."""
+        missing = list()
+        for url in dict.fromkeys(urls):
+            if not url in self:
+                missing.append(url)
+        if not missing:
+            return 0
+        try:
+            return asyncio.run(self._fetch_all(missing))
+        finally:
+            self.db.commit()
+
+    def _get_session(self):
+        if self.session is None:
+            self.session = requests.Session()
+            self.session.headers.update(self.headers)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency_per_host)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+        return self.session
+
+    def _fetch(self, url):
+        try:
+            return self._get_session().get(url, timeout=self.timeout)
+        except Exception as e:
+            return e
+
+    async def _fetch_all(self, urls):
+        """Fetch the scripts and store every one as soon as it arrives; return the number stored."""
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        host_semaphores = dict()
+        fetched = 0
+
+        def store(url, response):
+            nonlocal fetched
+            self.put(url, response.content, response.encoding or response.apparent_encoding, response.status_code)
+            response.close()
+            fetched += 1
+            if fetched % COMMIT_INTERVAL == 0:
+                self.db.commit()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            async def fetch(url):
+                host = urllib.parse.urlsplit(url).netloc
+                if not host in host_semaphores:
+                    host_semaphores[host] = asyncio.Semaphore(self.concurrency_per_host)
+                for attempt in range(self.retries + 1):
+                    if attempt > 0:
+                        await asyncio.sleep(BACKOFF * 2 ** (attempt - 1))
+                    async with host_semaphores[host], semaphore:
+                        response = await loop.run_in_executor(executor, self._fetch, url)
+                    if isinstance(response, requests.Response) and not response.status_code in RETRY_STATUSES:
+                        break
+                    if isinstance(response, PERMANENT_ERRORS):
+                        break
+                if isinstance(response, requests.Response):
+                    store(url, response)
+                else:
+                    print("Could not fetch "+url+": "+str(response), file=sys.stderr)
+            await asyncio.gather(*[fetch(url) for url in urls])
+        return fetched
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Categories of websites (e.g. "Finance"), as reported by SafeDNS. Categories
+ are kept in a persistent cache keyed by domain, so every site is looked up
+ only once across runs. Missing sites are looked up in batches: an asyncio
+ event loop issues the requests concurrently over a shared, pooled HTTP
+ session and spaces them out to respect a rate limit.
+
+ In offline mode, no request is made and the categories come from a local
+ category file (CSV rows of domain,category) and the cache. The same file
+ can be served as a stand-in for the SafeDNS API:
+
+   python3 SiteCategories.py serve <CATEGORY_FILE> [<PORT>]
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import asyncio
+import sqlite3
+import requests
+import concurrent.futures
+import http.server
+
+SAFEDNS_URL = "https://www.safedns.com/api/check-website"
+
+# Lookups running at the same time
+CONCURRENCY = 8
+# Requests per second
+RATE_LIMIT = 10.0
+# Sites looked up (and stored in the cache) at a time
+BATCH_SIZE = 100
+TIMEOUT = 30
+
+def get_category(categorization):
+    """Return the first category of a SafeDNS response, or "" if it has none."""
+    try:
+        return [categorization["domain_cats"][cat] for cat in categorization["domain_cats"]][0]
+    except:
+        return ""
+
+def read_category_file(file_name):
+    """Return the {domain: category} rows of a category file."""
+    categories = dict()
+    with open(file_name, "r") as f:
+        for row in csv.reader(f):
+            if len(row) >= 2:
+                categories[row[0]] = row[1]
+    return categories
+
+class RateLimiter():
+    def __init__(self, rate):
+        """RateLimiter spaces out the coroutines that wait for it to `rate` per second."""
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = 0.0
+
+    async def wait(self):
+        now = asyncio.get_running_loop().time()
+        delay = self.next_time - now
+        self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class SiteCategories():
+    def __init__(self, cache_file, url=SAFEDNS_URL, category_file=None, offline=False,
+                 concurrency=CONCURRENCY, rate=RATE_LIMIT, timeout=TIMEOUT):
+        """SiteCategories looks up site categories at `url`, caching them in `cache_file`.
+
+        The categories of `category_file` take precedence over the cache; with
+        `offline`, they and the cache are the only source.
+        """
+        self.url = url
+        self.offline = offline
+        self.concurrency = concurrency
+        self.rate = rate
+        self.timeout = timeout
+        self.local = read_category_file(category_file) if category_file else dict()
+        if offline and not category_file:
+            print("Offline site categorization without a category file: only cached categories are known.", file=sys.stderr)
+        self.db = sqlite3.connect(cache_file)
+        self.db.execute("CREATE TABLE IF NOT EXISTS categories (domain TEXT PRIMARY KEY, category TEXT NOT NULL, fetched REAL NOT NULL)")
+        self.db.commit()
+        self.categories = dict(self.db.execute("SELECT domain, category FROM categories"))
+        self.session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        self.db.close()
+
+    def __contains__(self, domain):
+        return domain in self.local or domain in self.categories
+
+    def get(self, domain):
+        """Return the category of the domain, looking it up if it is not known yet.
+
+        Return None if the lookup failed, and "" for domains without a
+        category or, offline, domains that are not known.
+        """
+        if domain in self.local:
+            return self.local[domain]
+        if not domain in self.categories:
+            if self.offline:
+                return ""
+            self.prefetch([domain])
+        return self.categories.get(domain)
+
+    def prefetch(self, domains):
+        """Look up the categories of all domains that are not known yet."""
+        if self.offline:
+            return
+        missing = list()
+        for domain in domains:
+            if not domain in self and not domain in missing:
+                missing.append(domain)
+        for i in range(0, len(missing), BATCH_SIZE):
+            batch = missing[i:i+BATCH_SIZE]
+            results = asyncio.run(self._fetch_all(batch))
+            fetched = time.time()
+            rows = [(domain, category, fetched) for domain, category in zip(batch, results) if category is not None]
+            self.db.executemany("INSERT OR REPLACE INTO categories VALUES (?, ?, ?)", rows)
+            self.db.commit()
+            for domain, category, _ in rows:
+                self.categories[domain] = category
+
+    def _get_session(self):
+        if self.session is None:
+            self.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+        return self.session
+
+    def _fetch(self, domain):
+        """Return the category of the domain, or None if the lookup failed (it is then not cached)."""
+        try:
+            response = self._get_session().post(self.url, json={"domain": domain}, timeout=self.timeout)
+            response.raise_for_status()
+            return get_category(response.json())
+        except (requests.RequestException, ValueError) as e:
+            print("Could not categorize "+domain+": "+str(e), file=sys.stderr)
+            return None
+
+    async def _fetch_all(self, domains):
+        loop = asyncio.get_running_loop()
+        limiter = RateLimiter(self.rate)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            async def fetch(domain):
+                async with semaphore:
+                    await limiter.wait()
+                    return await loop.run_in_executor(executor, self._fetch, domain)
+            return await asyncio.gather(*[fetch(domain) for domain in domains])
+
+def make_server(category_file, port=8053):
+    """Return an HTTP server that answers like the SafeDNS API with the categories of a category file.
+
+    With port 0, the server listens on a free port (see `server_address`).
+    The domains looked up are recorded in its `lookups` list.
+    """
+    categories = read_category_file(category_file)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or "{}")
+            domain = request.get("domain", "")
+            self.server.lookups.append(domain)
+            body = json.dumps({"domain": domain, "domain_cats": {"0": categories[domain]} if domain in categories else {}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("localhost", port), Handler)
+    server.categories = categories
+    server.lookups = list()
+    return server
+
+def serve(category_file, port=8053):
+    """Serve the categories of a category file like the SafeDNS API does, at http://localhost:<port>/."""
+    server = make_server(category_file, port)
+    print("Serving", len(server.categories), "categories at http://localhost:"+str(server.server_address[1])+"/", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "serve":
+        print("Usage: {} serve <CATEGORY_FILE> [<PORT>]".format(sys.argv[0]), file=sys.stderr)
+        sys.exit(1)
+    serve(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 8053)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Tracker domain lists (Whotracks.me, DuckDuckGo) in one prebuilt artifact.
+ Building the lists is slow (the Whotracks.me tracker database comes as an SQL
+ dump), so they are extracted once into a versioned pickle that is rebuilt
+ whenever the content of one of the source files changes.
+
+ A URL is matched against the lists by walking from its host up to its
+ registrable domain (e.g. a.b.tracker.com, b.tracker.com, tracker.com), so
+ that list entries for subdomains match as well. Every domain maps to a
+ bitmask of the lists it is on, which answers all lists in one walk.
+"""
+
+import os
+import sys
+import json
+import pickle
+import hashlib
+import sqlite3
+import tldextract
+
+# Bump when the artifact layout or the extraction of the lists changes.
+ARTIFACT_VERSION = 1
+
+WHOTRACKSME_QUERY = """
+  SELECT categories.name, tracker, domain FROM tracker_domains
+  INNER JOIN trackers ON trackers.id = tracker_domains.tracker
+  INNER JOIN categories ON categories.id = trackers.category_id;
+"""
+
+def read_whotracksme(file_name):
+    """Return the tracker domains of the Whotracks.me tracker database dump."""
+    con = sqlite3.connect(":memory:")
+    with open(file_name, "r") as f:
+        con.executescript(f.read())
+    domains = set()
+    for (category, tracker, domain) in con.execute(WHOTRACKSME_QUERY):
+        domains.add(domain)
+    con.close()
+    return domains
+
+def read_duckduckgo(file_name):
+    """Return the domains of the trackers that DuckDuckGo's tracker data set blocks by default."""
+    with open(file_name, "r") as f:
+        duckduckgo_tds = json.load(f)
+    domains = set()
+    for tracker in duckduckgo_tds["trackers"]:
+        if duckduckgo_tds["trackers"][tracker]["default"] == "block":
+            domains.add(duckduckgo_tds["trackers"][tracker]["domain"])
+    return domains
+
+# List name -> reader of its source file
+READERS = {
+    "Whotracks.me": read_whotracksme,
+    "DuckDuckGo": read_duckduckgo
+}
+
+def get_domains(url):
+    """Return the host of the URL and its parents down to the registrable domain, most specific first."""
+    extracted = tldextract.extract(url)
+    registrable = extracted.domain + "." + extracted.suffix
+    domains = list()
+    if extracted.subdomain:
+        labels = extracted.subdomain.split(".")
+        for i in range(len(labels)):
+            domains.append(".".join(labels[i:]) + "." + registrable)
+    domains.append(registrable)
+    return domains
+
+def get_masks(lists):
+    """Return the bitmask of the lists ({name: domains}) that every domain is on."""
+    masks = dict()
+    for bit, name in enumerate(lists):
+        for domain in lists[name]:
+            masks[domain] = masks.get(domain, 0) | (1 << bit)
+    return masks
+
+class TrackerDomains():
+    def __init__(self, names, masks):
+        """TrackerDomains holds the domains of the lists `names`, as {domain: bitmask of lists}."""
+        self.names = names
+        self.masks = masks
+
+    def __len__(self):
+        return len(self.masks)
+
+    def get_mask(self, url):
+        mask = 0
+        for domain in get_domains(url):
+            mask |= self.masks.get(domain, 0)
+        return mask
+
+    def get_lists(self, *urls):
+        """Return the names of the lists that contain (a parent of) the host of any of the URLs."""
+        mask = 0
+        for url in urls:
+            mask |= self.get_mask(url)
+        return [name for bit, name in enumerate(self.names) if mask & (1 << bit)]
+
+def get_source_key(sources):
+    """Return the key of the artifact built from `sources`: the version and the hashes of the source files."""
+    key = list()
+    for name, file_name in sources.items():
+        with open(file_name, "rb") as f:
+            key.append((name, hashlib.sha256(f.read()).hexdigest()))
+    return (ARTIFACT_VERSION, tuple(key))
+
+def build(artifact_file, sources):
+    """Build the lists from `sources` ({name: file name}) and write them to `artifact_file`."""
+    key = get_source_key(sources)
+    lists = dict([(name, READERS[name](file_name)) for name, file_name in sources.items()])
+    names, masks = list(lists), get_masks(lists)
+    temp_file_name = artifact_file+".tmp"
+    with open(temp_file_name, "wb") as f:
+        # Plain data only, so that the artifact does not depend on how this module was loaded.
+        pickle.dump((key, names, masks), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_file_name, artifact_file)
+    return TrackerDomains(names, masks)
+
+def load(artifact_file, sources):
+    """Return the TrackerDomains of `artifact_file`, rebuilding it if it is missing or any of the `sources` changed."""
+    key = get_source_key(sources)
+    try:
+        with open(artifact_file, "rb") as f:
+            artifact_key, names, masks = pickle.load(f)
+        if artifact_key == key:
+            return TrackerDomains(names, masks)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+    return build(artifact_file, sources)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("Usage: {} <ARTIFACT> <WHOTRACKSME_SQL> <DUCKDUCKGO_TDS>".format(sys.argv[0]), file=sys.stderr)
+        sys.exit(1)
+    tracker_domains = build(sys.argv[1], {"Whotracks.me": sys.argv[2], "DuckDuckGo": sys.argv[3]})
+    print("Wrote", len(tracker_domains), "domain(s) of", ", ".join(tracker_domains.names), "to", sys.argv[1], file=sys.stderr)
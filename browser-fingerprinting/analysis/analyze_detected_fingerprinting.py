@@ -3,47 +3,51 @@
 
 import os
 import json
+import argparse
 import math
 import numpy
 import hashlib
-import pymongo
-import requests
 import operator
 import matplotlib
 import tldextract
-import jsbeautifier
 
 import matplotlib.pyplot as plt
 
-from bson.son import SON
+import EntityIndex
+import ScriptStore
+import ResultStore
 
-MONGO_HOST = "localhost"
-MONGO_PORT = 27017
+TRACKER_RADAR_ENTITY_MAP = "../datasets/tracker_radar_entity_map.json"
+
+EVIDENCE_FOLDER = "../results/evidence"
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:106.0) Gecko/20100101 Firefox/106.0'
+}
 
 def get_fqdn(url):
     _, dn, tld = tldextract.extract(url)
     return dn + "." + tld
 
-def main():
-    mongo_connection = pymongo.MongoClient("mongodb://"+MONGO_HOST+":"+str(MONGO_PORT), maxPoolSize=None)
-    collection = mongo_connection["web3_privacy"]["fingerprinting_results"]
+def main(args):
+    results = ResultStore.open_store(args.results)
 
     print("----------------------------------------------------------")
     print("  Wallet API Calls")
     print("----------------------------------------------------------")
     print()
 
-    print("Total number of JavaScript calls:", collection.count_documents({}))
-    websites = collection.distinct("url")
+    print("Total number of JavaScript calls:", results.count())
+    websites = results.distinct("url")
     print("Websites calling wallet APIs:", len(websites))
-    scripts = collection.distinct("script")
+    scripts = results.distinct("script")
     print("Scripts calling wallet APIs:", len(scripts))
     print()
 
     print("\\toprule")
     print("\\textbf{Rank} & \\textbf{Website} & \\textbf{Script Domain} & \\textbf{Wallet API} \\\\")
     print("\\midrule")
-    cursor = collection.find({}).sort("tranco_rank").limit(10)
+    cursor = results.find(sort="tranco_rank", limit=10)
     for document in cursor:
         wallet_apis = ""
         if len(document["detected_wallet_apis"]) == 4:
@@ -63,7 +67,7 @@ def main():
     implicit_scripts_with_evidence = set()
     implicit_scripts_without_evidence = set()
     combinations = dict()
-    cursor = collection.find({})
+    cursor = results.find()
     for document in cursor:
         if len(document["detected_wallet_apis"]) == 4:
             if len(document["evidence"]) == 0:
@@ -105,7 +109,7 @@ def main():
     fingerprinting_explicit = set()
     fingerprinting_implicit = set()
     fingerprinting_categories = list()
-    cursor = collection.find({"browser_fingerprinting": True})
+    cursor = results.find({"browser_fingerprinting": True})
     for document in cursor:
         fingerprinting_scripts.add(document["script"])
         fingerprinting_websites.add(document["url"])
@@ -131,37 +135,23 @@ def main():
     print("\\toprule")
     print("\\textbf{Category} & \\textbf{Websites} & \\textbf{Third-Party Calls} & \\textbf{Top Website (Rank)} & \\textbf{Top Third-Party (Websites)} \\\\")
     print("\\midrule")
-    documents = list(collection.aggregate([
-        {"$unwind": "$category"},
-        {"$group": {"_id": "$category", "count": {"$sum": 1}}},
-        {"$sort": SON([("count", -1), ("_id", -1)])}
-    ]))
+    documents = results.count_by("category")
     for document in documents[1:11]:
-        third_party_calls = collection.count_documents({"category": document["_id"], "third_party": True})
-        top_third_party = list(collection.aggregate([
-            {"$match": {"category": document["_id"], "third_party": True}},
-            {"$unwind": "$script_domain"},
-            {"$group": {"_id": "$script_domain", "count": {"$sum": 1}}},
-            {"$sort": SON([("count", -1), ("_id", -1)])}
-        ]))
-        top_website_domain = list(collection.find({"category": document["_id"]}).sort("tranco_rank"))[0]["url_domain"]
-        top_website_rank = list(collection.find({"category": document["_id"]}).sort("tranco_rank"))[0]["tranco_rank"]
+        third_party_calls = results.count({"category": document["_id"], "third_party": True})
+        top_third_party = results.count_by("script_domain", {"category": document["_id"], "third_party": True})
+        top_website_domain = list(results.find({"category": document["_id"]}, sort="tranco_rank", limit=1))[0]["url_domain"]
+        top_website_rank = list(results.find({"category": document["_id"]}, sort="tranco_rank", limit=1))[0]["tranco_rank"]
         if len(top_third_party) == 0:
             top_third_party.append({"_id": "-", "count": 0})
         print(document["_id"].replace("&", "\&"), " & ", document["count"], " & ", str(third_party_calls)+" ("+"{:.0f}".format(third_party_calls/document["count"]*100.0)+"\%)", " & ", top_website_domain, "("+str(top_website_rank)+")", " & ", top_third_party[0]["_id"], "("+str(top_third_party[0]["count"])+")", "\\\\")
     print("...", " & ", "...", " & ", "...", " & ", "...", "\\\\")
     for document in documents[len(documents)-10:]:
-        top_third_party = list(collection.aggregate([
-            {"$match": {"category": document["_id"], "third_party": True}},
-            {"$unwind": "$script_domain"},
-            {"$group": {"_id": "$script_domain", "count": {"$sum": 1}}},
-            {"$sort": SON([("count", -1), ("_id", -1)])}
-        ]))
-        top_website_domain = list(collection.find({"category": document["_id"]}).sort("tranco_rank"))[0]["url_domain"]
-        top_website_rank = list(collection.find({"category": document["_id"]}).sort("tranco_rank"))[0]["tranco_rank"]
+        top_third_party = results.count_by("script_domain", {"category": document["_id"], "third_party": True})
+        top_website_domain = list(results.find({"category": document["_id"]}, sort="tranco_rank", limit=1))[0]["url_domain"]
+        top_website_rank = list(results.find({"category": document["_id"]}, sort="tranco_rank", limit=1))[0]["tranco_rank"]
         if len(top_third_party) == 0:
             top_third_party.append({"_id": "-", "count": 0})
-        third_party_calls = collection.count_documents({"category": document["_id"], "third_party": True})
+        third_party_calls = results.count({"category": document["_id"], "third_party": True})
         print(document["_id"].replace("&", "\&"), " & ", document["count"], " & ", str(third_party_calls)+" ("+"{:.2f}".format(third_party_calls/document["count"]*100.0)+"\%)", " & ", top_website_domain, "("+str(top_website_rank)+")", " & ", top_third_party[0]["_id"], "("+str(top_third_party[0]["count"])+")", "\\\\")
     print("\\bottomrule")
     print()
@@ -171,11 +161,11 @@ def main():
     print("----------------------------------------------------------")
     print()
 
-    third_party_calls = collection.count_documents({"third_party": True})
-    print("Calls made by third-parties:", third_party_calls, "("+str(third_party_calls/collection.count_documents({})*100.0)+"%)")
+    third_party_calls = results.count({"third_party": True})
+    print("Calls made by third-parties:", third_party_calls, "("+str(third_party_calls/results.count()*100.0)+"%)")
     print()
 
-    cursor = collection.find({"third_party": True})
+    cursor = results.find({"third_party": True})
     websites_with_third_parties = set()
     third_party_scripts = set()
     third_party_domains = set()
@@ -202,31 +192,21 @@ def main():
     print("\\toprule")
     print("\\textbf{Third-Party Name} & \\textbf{Third-Party Domain} & \\textbf{Third-Party Script} & \\textbf{API Call Type} & \\textbf{Websites} & \\textbf{Min. Rank} \\\\")
     print("\\midrule")
-    documents = list(collection.aggregate([
-        {"$match": {"third_party": True}},
-        {"$unwind": "$script_domain"},
-        {"$group": {"_id": "$script_domain", "count": {"$sum": 1}}},
-        {"$sort": SON([("count", -1), ("_id", -1)])}
-    ]))
-    with open("../datasets/tracker_radar_entity_map.json", "r") as f:
-        entities = json.load(f)
+    documents = results.count_by("script_domain", {"third_party": True})
+    entity_index = EntityIndex.load(TRACKER_RADAR_ENTITY_MAP)
     top = 10
     counter = 0
     for document in documents:
         type = "Explicit"
-        api_calls = list(collection.find({"script_domain": document["_id"]}).distinct("detected_wallet_apis"))
+        api_calls = list(results.distinct("detected_wallet_apis", {"script_domain": document["_id"]}))
         if len(api_calls) == 4:
             type = "Implicit"
             continue
-        entity = "-"
-        for e in entities:
-            if document["_id"] in entities[e]["properties"]:
-                entity = entities[e]["displayName"]
-                break
-        scripts = set(list(collection.find({"script_domain": document["_id"]}).distinct("script")))
-        min_rank = list(collection.find({"script_domain": document["_id"]}).sort("tranco_rank"))[0]["tranco_rank"]
+        entity = entity_index.get_display_name(document["_id"])
+        scripts = set(list(results.distinct("script", {"script_domain": document["_id"]})))
+        min_rank = list(results.find({"script_domain": document["_id"]}, sort="tranco_rank", limit=1))[0]["tranco_rank"]
         fingerprinting = ""
-        if list(collection.find({"script": list(scripts)[-1]}))[0]["browser_fingerprinting"]:
+        if list(results.find({"script": list(scripts)[-1]}))[0]["browser_fingerprinting"]:
             fingerprinting = "\\textbf{(F)}"
         counter += 1
         print(entity, " & ", "\\textbf{"+document["_id"]+"}", " & ", list(scripts)[-1]+" "+fingerprinting, " & ", type, " & ", document["count"], " & ", min_rank, "\\\\")
@@ -241,20 +221,16 @@ def main():
     counter = 0
     for document in documents:
         type = "Explicit"
-        api_calls = list(collection.find({"script_domain": document["_id"]}).distinct("detected_wallet_apis"))
+        api_calls = list(results.distinct("detected_wallet_apis", {"script_domain": document["_id"]}))
         if len(api_calls) == 4:
             type = "Implicit"
         else:
             continue
-        entity = "-"
-        for e in entities:
-            if document["_id"] in entities[e]["properties"]:
-                entity = entities[e]["displayName"]
-                break
-        scripts = set(list(collection.find({"script_domain": document["_id"]}).distinct("script")))
-        min_rank = list(collection.find({"script_domain": document["_id"]}).sort("tranco_rank"))[0]["tranco_rank"]
+        entity = entity_index.get_display_name(document["_id"])
+        scripts = set(list(results.distinct("script", {"script_domain": document["_id"]})))
+        min_rank = list(results.find({"script_domain": document["_id"]}, sort="tranco_rank", limit=1))[0]["tranco_rank"]
         fingerprinting = ""
-        if list(collection.find({"script": list(scripts)[-1]}))[0]["browser_fingerprinting"]:
+        if list(results.find({"script": list(scripts)[-1]}))[0]["browser_fingerprinting"]:
             fingerprinting = "\\textbf{(F)}"
         counter += 1
         print(entity, " & ", "\\textbf{"+document["_id"]+"}", " & ", list(scripts)[-1]+" "+fingerprinting, " & ", type, " & ", document["count"], " & ", min_rank, "\\\\")
@@ -269,7 +245,7 @@ def main():
     print("----------------------------------------------------------")
     print()
 
-    third_party_scripts = list(collection.find({"third_party": True}).distinct("script"))
+    third_party_scripts = list(results.distinct("script", {"third_party": True}))
     print("Third-party scripts to analyze:", len(third_party_scripts))
     cloud_flare_challenges = list()
     non_cloud_flare_challenges = list()
@@ -284,21 +260,18 @@ def main():
     if not os.path.exists("similarities.json"):
         similarities = dict()
         script_hashes = dict()
+        script_store = ScriptStore.ScriptStore(EVIDENCE_FOLDER, headers=HEADERS)
+        script_store.fetch_all(non_cloud_flare_challenges)
         for script in non_cloud_flare_challenges:
-            response = None
-            try:
-                response = requests.get(script, headers={
-                    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:106.0) Gecko/20100101 Firefox/106.0'
-                })
-            except:
-                continue
-            if response:
-                code = jsbeautifier.beautify(response.text)
+            status = script_store.get_status(script)
+            if status is not None and status < 400:
+                code = script_store.get_beautified(script)
                 hash = hashlib.sha256(code.encode('utf-8')).hexdigest()
                 script_hashes[script] = hash
                 if not hash in similarities:
                     similarities[hash] = set()
                 similarities[hash].add(get_fqdn(script))
+        script_store.close()
         output = dict()
         for hash in similarities:
             if len(similarities[hash]) > 1:
@@ -327,19 +300,19 @@ def main():
     print("----------------------------------------------------------")
     print()
 
-    blocklists = list(collection.find({}).distinct("blocklists"))
+    blocklists = list(results.distinct("blocklists"))
     if None in blocklists:
         blocklists.remove(None)
     values = dict()
-    total = len(list(collection.find({"third_party": True}).distinct("script_domain")))
+    total = len(list(results.distinct("script_domain", {"third_party": True})))
     total = total - len(benign_third_parties)
     print("Third-Parties:", total)
     print()
     for blocklist in blocklists:
-        blocked_third_parties = len(list(collection.find({"blocklists": blocklist, "third_party": True}).distinct("script_domain")))
+        blocked_third_parties = len(list(results.distinct("script_domain", {"blocklists": blocklist, "third_party": True})))
         values[blocklist] = [blocked_third_parties, total-blocked_third_parties]
         print(blocklist, blocked_third_parties)
-    cursor = collection.find({"third_party": True})
+    cursor = results.find({"third_party": True})
     blocked_script_domain = set()
     for document in cursor:
         if len(document["blocklists"]) > 0:
@@ -381,4 +354,6 @@ def main():
     plt.savefig("blocklists.pdf", dpi=1000, bbox_inches="tight")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Analyze the detected Web3-based browser fingerprinting.")
+    parser.add_argument("--results", default=ResultStore.MONGO_URI, help="MongoDB URI or SQLite file of the fingerprinting results (default: %(default)s).")
+    main(parser.parse_args())
@@ -4,17 +4,21 @@
 import os
 import sys
 import csv
-import json
-import copy
-import sqlite3
-import pymongo
-import requests
+import argparse
 import tldextract
-import jsbeautifier
 
-from adblockparser import AdblockRules
 from trackingprotection_tools import DisconnectParser
 
+# CrawlStore is shared with the wallet address leakage study.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "wallet-address-leakage", "analysis"))
+import CrawlStore
+import EntityIndex
+import BlocklistMatcher
+import TrackerDomains
+import SiteCategories
+import ScriptStore
+import ResultStore
+
 class colors:
     INFO = '\033[94m'
     OK = '\033[92m'
@@ -25,20 +29,35 @@ HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:106.0) Gecko/20100101 Firefox/106.0'
 }
 
-MONGO_HOST = "localhost"
-MONGO_PORT = 27017
-
 RESULTS_FOLDER = "../results/crawl"
 
+CRAWL_STORE = "../results/crawl_store.sqlite"
+
 TRANCO_FILE = "../datasets/tranco/tranco_6JXYX_november_2022.csv"
 
+SITE_CATEGORIES_CACHE = "../results/site_categories.sqlite"
+
+EVIDENCE_FOLDER = "../results/evidence"
+
+TRACKER_RADAR_ENTITY_MAP = "../datasets/tracker_radar_entity_map.json"
+
+WHOTRACKSME_TRACKERDB = "../datasets/blocklists/whotracksme_trackerdb.sql"
+DUCKDUCKGO_TDS = "../datasets/blocklists/duckduckgo_tds.json"
+# Prebuilt from the two lists above; rebuilt when they change.
+TRACKER_DOMAINS_FILE = "../datasets/blocklists/tracker_domains.pickle"
+
 WEB3_APIS = ["window.ethereum", "window.cardano", "window.solana", "window.BinanceChain"]
+# Evidence of a wallet API in the code of a script
+EVIDENCE_SCANNER = ScriptStore.TermScanner([api.replace("window.", "") for api in WEB3_APIS])
 
 BROWSER_FINGERPRINTING_THRESHOLD = 10
 EXPLICIT_BROWSER_FINGERPRINTING_CATEGORIES = ["RTC", "WebGL", "Canvas", "Battery", "Plugins", "Device", "Audio", "SpeechSynthesis"]
 
 ADBLOCK_OPTIONS = {"third-party": True}
 
+# Maximum number of initiator traces reconstructed per script.
+MAX_TRACES = 1000
+
 def get_fingerprinting_category(api):
     category = ""
     if api in WEB3_APIS:
@@ -90,72 +109,166 @@ def get_fingerprinting_category(api):
     return ""
 
 def get_fqdn(url):
-    _, dn, tld = tldextract.extract(url)
-    return dn + "." + tld
+    extracted = tldextract.extract(url)
+    return extracted.domain + "." + extracted.suffix
+
+def get_legacy_evidence_file(url, script):
+    """Return the file that earlier versions stored the beautified script loaded by `url` in."""
+    script_file_name = script.split("/")[-1].split("?")[0]
+    return os.path.join(EVIDENCE_FOLDER, get_fqdn(url), script_file_name+".js" if script_file_name else "index.js")
+
+def import_legacy_evidence(script_store, findings, urls):
+    """Store the scripts that earlier versions saved as evidence files, so that they are not fetched again.
+
+    Return the number of scripts stored.
+    """
+    imported = 0
+    for url in urls:
+        for script in findings[url]:
+            file_name = get_legacy_evidence_file(url, script)
+            if not script in script_store and os.path.isfile(file_name):
+                with open(file_name, "rb") as f:
+                    script_store.put(script, f.read(), "utf-8")
+                imported += 1
+    script_store.db.commit()
+    return imported
+
+class InitiatorIndex():
+    def __init__(self, requests, max_traces=MAX_TRACES):
+        """InitiatorIndex maps the URLs of a page's requests to their initiators.
 
-def trace_back_initiator(script, initialUrl, requests, trace, traces):
-    if not script in trace:
-        trace.append(script)
+        Every request is an entry (loaded by the page itself, initiators),
+        without duplicate entries per URL. A script's traces are the paths
+        from the script along its initiators to a request without
+        initiators that do not visit a URL twice.
+        """
+        self.max_traces = max_traces
+        self.entries = dict()
         for request in requests:
-            if request["url"] == script:
-                if len(request["initiators"]) > 0:
-                    for initiator in request["initiators"]:
-                        if not initiator in trace:
-                            trace_back_initiator(initiator, initialUrl, requests, copy.copy(trace), traces)
-                else:
-                    if not trace in traces:
-                        traces.append(copy.copy(trace))
-    return traces
-
-def main():
+            initiators = tuple(dict.fromkeys([initiator for initiator in request["initiators"] if initiator != request["url"]]))
+            self.entries.setdefault(request["url"], dict())[(len(request["initiators"]) == 0, initiators)] = None
+        self.entries = {url: list(entries) for url, entries in self.entries.items()}
+        self.acyclic = self._find_acyclic()
+        # The traces of a URL that reaches no cycle do not depend on the path that led
+        # to it, and are therefore only reconstructed once.
+        self._traces = dict()
+
+    def _find_acyclic(self):
+        """Return the URLs from which no cycle of initiators can be reached (iterative Tarjan)."""
+        acyclic = set()
+        index = dict()
+        lowlink = dict()
+        stack = list()
+        on_stack = set()
+        for root in self.entries:
+            if root in index:
+                continue
+            work = [(root, 0)]
+            while work:
+                url, i = work.pop()
+                if i == 0:
+                    index[url] = lowlink[url] = len(index)
+                    stack.append(url)
+                    on_stack.add(url)
+                children = self.get_children(url)
+                if i < len(children):
+                    work.append((url, i + 1))
+                    if not children[i] in index:
+                        work.append((children[i], 0))
+                    continue
+                for child in children:
+                    if child in on_stack:
+                        lowlink[url] = min(lowlink[url], lowlink[child])
+                if lowlink[url] == index[url]:
+                    component = list()
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == url:
+                            break
+                    if len(component) == 1 and all([child in acyclic for child in children]):
+                        acyclic.add(url)
+        return acyclic
+
+    def get_children(self, url):
+        children = list()
+        for _, initiators in self.entries.get(url, []):
+            children.extend(initiators)
+        return children
+
+    def _trace_back(self, url, on_path):
+        if url in self._traces:
+            return self._traces[url]
+        traces = list()
+        seen = set()
+        on_path.add(url)
+        for root, initiators in self.entries.get(url, []):
+            if len(traces) >= self.max_traces:
+                break
+            if root:
+                if not (url,) in seen:
+                    seen.add((url,))
+                    traces.append((url,))
+                continue
+            for initiator in initiators:
+                if initiator in on_path:
+                    continue
+                for trace in self._trace_back(initiator, on_path):
+                    trace = (url,) + trace
+                    if not trace in seen:
+                        seen.add(trace)
+                        traces.append(trace)
+                        if len(traces) >= self.max_traces:
+                            break
+                if len(traces) >= self.max_traces:
+                    break
+        on_path.discard(url)
+        if url in self.acyclic:
+            self._traces[url] = traces
+        return traces
+
+    def trace_back(self, script):
+        """Return the initiator traces of the script, each starting with the script itself."""
+        return [list(trace) for trace in self._trace_back(script, set())]
+
+def main(args):
     print("Loading EasyList rules...")
-    easylist_rules = AdblockRules(set([l.strip() for l in open("../datasets/blocklists/easylist.txt") if len(l) != 0 and l[0] != '!']))
+    easylist_rules = BlocklistMatcher.load("../datasets/blocklists/easylist.txt")
     print("Loading EasyPrivacy rules...")
-    easyprivacy_rules = AdblockRules(set([l.strip() for l in open("../datasets/blocklists/easyprivacy.txt") if len(l) != 0 and l[0] != '!']))
+    easyprivacy_rules = BlocklistMatcher.load("../datasets/blocklists/easyprivacy.txt")
     print("Loading Disconnect rules...")
     disconnect_rules = DisconnectParser(blocklist="../datasets/blocklists/disconnect.json")
-    print("Loading Whotracks.me rules...")
-    sql_query = """
-      SELECT categories.name, tracker, domain FROM tracker_domains
-      INNER JOIN trackers ON trackers.id = tracker_domains.tracker
-      INNER JOIN categories ON categories.id = trackers.category_id;
-    """
-    con = sqlite3.connect(":memory:")
-    sql_script = ""
-    with open("../datasets/blocklists/whotracksme_trackerdb.sql", "r") as f:
-        sql_script = f.read()
-    con.executescript(sql_script)
-    cur = con.cursor()
-    whotracksme_rules = set()
-    for (category, tracker, domain) in cur.execute(sql_query):
-        whotracksme_rules.add(domain)
-    con.close()
-    print("Loading DuckDuckGo rules...")
-    duckduckgo_rules = set()
-    with open("../datasets/blocklists/duckduckgo_tds.json", "r") as f:
-        duckduckgo_tds = json.load(f)
-        for tracker in duckduckgo_tds["trackers"]:
-            if duckduckgo_tds["trackers"][tracker]["default"] == "block":
-                duckduckgo_rules.add(duckduckgo_tds["trackers"][tracker]["domain"])
-
-    mongo_connection = pymongo.MongoClient("mongodb://"+MONGO_HOST+":"+str(MONGO_PORT), maxPoolSize=None)
-    collection = mongo_connection["web3_privacy"]["fingerprinting_results"]
+    print("Loading Whotracks.me and DuckDuckGo rules...")
+    tracker_domains = TrackerDomains.load(TRACKER_DOMAINS_FILE, {"Whotracks.me": WHOTRACKSME_TRACKERDB, "DuckDuckGo": DUCKDUCKGO_TDS})
+
+    results = ResultStore.open_store(args.results, batch_size=args.batch_size, write_concern=args.write_concern)
+    results.create_indexes()
+    analyzed_urls = results.load_analyzed_urls()
 
+    store = CrawlStore.CrawlStore(CRAWL_STORE)
     findings = dict()
     for path, subdirs, files in os.walk(RESULTS_FOLDER):
-        for name in files:
-            if name.endswith(".json") and name != "metadata.json":
-                with open(os.path.join(path, name), "r") as f:
-                    result = json.load(f)
-                    call_stats = result["data"]["apis"]["callStats"]
-                    for script in call_stats:
-                        if any([True for api in WEB3_APIS if api in call_stats[script]]):
-                            trace = trace_back_initiator(script, result["initialUrl"], result["data"]["requests"], list(), list())
-                            if not result["initialUrl"] in findings:
-                                findings[result["initialUrl"]] = dict()
-                            if not script in findings[result["initialUrl"]]:
-                                findings[result["initialUrl"]][script] = dict()
-                            findings[result["initialUrl"]][script] = (call_stats[script], trace)
+        for entry in store.read_ahead(path):
+            if os.path.basename(entry.name) != "metadata.json":
+                file_name = entry.name
+                # Only the files in which Web3 APIs are called are decoded in full.
+                call_stats = store.peek_call_stats(entry)
+                if not any([True for script in call_stats for api in WEB3_APIS if api in call_stats[script]]):
+                    continue
+                if entry.data is not None or entry.json_data is not None:
+                    store.load_entry(entry)
+                initial_url = store.load_url(file_name)
+                initiators = InitiatorIndex(store.load_initiators(file_name))
+                for script in call_stats:
+                    if any([True for api in WEB3_APIS if api in call_stats[script]]):
+                        trace = initiators.trace_back(script)
+                        if not initial_url in findings:
+                            findings[initial_url] = dict()
+                        if not script in findings[initial_url]:
+                            findings[initial_url][script] = dict()
+                        findings[initial_url][script] = (call_stats[script], trace)
+    store.close()
 
     ranks = dict()
     with open(TRANCO_FILE, "r") as f:
@@ -163,9 +276,17 @@ def main():
         for row in reader:
             ranks[row[1]] = row[0]
 
-    tracker_radar_entity_map = dict()
-    with open("../datasets/tracker_radar_entity_map.json", "r") as f:
-        tracker_radar_entity_map = json.load(f)
+    entity_index = EntityIndex.load(TRACKER_RADAR_ENTITY_MAP)
+
+    print("Categorizing websites...")
+    site_categories = SiteCategories.SiteCategories(args.categories_cache, url=args.categorization_url, category_file=args.category_file, offline=args.offline)
+    pending_urls = [url for url in findings if not url in analyzed_urls]
+    site_categories.prefetch([get_fqdn(url) for url in pending_urls])
+
+    print("Fetching scripts...")
+    script_store = ScriptStore.ScriptStore(EVIDENCE_FOLDER, headers=HEADERS)
+    print("Imported", import_legacy_evidence(script_store, findings, pending_urls), "script(s) from earlier evidence files.")
+    print("Fetched", script_store.fetch_all([script for url in pending_urls for script in findings[url]]), "new script(s).")
 
     print()
     print("Found"+colors.INFO, len(findings), colors.END+"website(s) accessing web3 JavaScript object.")
@@ -177,13 +298,19 @@ def main():
                 print(" ", script)
             print("")
 
+    uncategorized = list()
     for url in findings:
         print()
         print(url)
-        exists = mongo_connection["web3_privacy"]["fingerprinting_results"].find_one({"url": url})
-        if exists:
+        if url in analyzed_urls:
             print("URL "+url+" already analyzed!")
             continue
+        category = site_categories.get(get_fqdn(url))
+        if category is None:
+            # Without findings, the website is analysed again in the next run.
+            print(colors.FAIL+"Skipping "+url+": could not categorize "+get_fqdn(url)+colors.END)
+            uncategorized.append(url)
+            continue
         for script in findings[url]:
             initiator = ""
             party = "First-Party"
@@ -198,13 +325,7 @@ def main():
                     if initiator == "":
                         initiator = call
                     elif initiator != get_fqdn(call) and get_fqdn(call) != get_fqdn(url):
-                        entity_mapping_found = False
-                        for company in tracker_radar_entity_map:
-                            for property in tracker_radar_entity_map[company]["properties"]:
-                                if get_fqdn(call) == property:
-                                    if get_fqdn(url) in tracker_radar_entity_map[company]["properties"]:
-                                        entity_mapping_found = True
-                        if not entity_mapping_found:
+                        if not entity_index.same_owner(get_fqdn(call), get_fqdn(url)):
                             initiator = call
                     elif get_fqdn(call) == get_fqdn(url):
                         break
@@ -219,56 +340,20 @@ def main():
             if initiator == "":
                 initiator = url
             if get_fqdn(url).split(".")[0] != get_fqdn(initiator).split(".")[0]:
-                entity_mapping_found = False
-                for company in tracker_radar_entity_map:
-                    for property in tracker_radar_entity_map[company]["properties"]:
-                        if get_fqdn(initiator) == property:
-                            if get_fqdn(url) in tracker_radar_entity_map[company]["properties"]:
-                                entity_mapping_found = True
-                if not entity_mapping_found:
+                if not entity_index.same_owner(get_fqdn(initiator), get_fqdn(url)):
                     party = "Third-Party"
             if party == "First-Party":
                 print(" - ", colors.INFO+script+colors.END, colors.OK+"("+party+": "+get_fqdn(initiator)+")"+colors.END)
             else:
                 print(" - ", colors.INFO+script+colors.END, colors.FAIL+"("+party+": "+get_fqdn(initiator)+")"+colors.END)
-            categorization = requests.post("https://www.safedns.com/api/check-website", json={"domain": get_fqdn(url)}).json()
-            category = ""
-            try:
-                category = [categorization["domain_cats"][cat] for cat in categorization["domain_cats"]][0]
-            except:
-                pass
             rank = ""
-            beautified_js = ""
             evidence = list()
             if get_fqdn(url) in ranks:
                 rank = int(ranks[get_fqdn(url)])
-            print(os.path.join("../results/evidence", get_fqdn(url), script.split("/")[-1].split("?")[0])+".js")
-            if not os.path.exists(os.path.join("../results/evidence", get_fqdn(url), script.split("/")[-1].split("?")[0])+".js"):
-                try:
-                    response = requests.get(script, headers=HEADERS)
-                    if not os.path.exists("../results/evidence"):
-                        os.mkdir("../results/evidence")
-                    if not os.path.exists(os.path.join("../results/evidence", get_fqdn(url))):
-                        os.mkdir(os.path.join("../results/evidence", get_fqdn(url)))
-                    script_file_name = script.split("/")[-1].split("?")[0]
-                    if script_file_name == "":
-                        script_file_name = "index.js"
-                    else:
-                        script_file_name = script_file_name + ".js"
-                    beautified_js = jsbeautifier.beautify(response.text)
-                    if beautified_js:
-                        open(os.path.join("../results/evidence", get_fqdn(url), script_file_name), "w").write(beautified_js)
-                        for api in WEB3_APIS:
-                            if api.replace("window.", "") in beautified_js:
-                                evidence.append(api.replace("window.", ""))
-                except:
-                    pass
-            else:
-                with open(os.path.join("../results/evidence", get_fqdn(url), script.split("/")[-1].split("?")[0])+".js", "r") as f:
-                    beautified_js = f.read()
-                    for api in WEB3_APIS:
-                        if api.replace("window.", "") in beautified_js:
-                            evidence.append(api.replace("window.", ""))
+            script_hash = script_store.get_hash(script)
+            if script_hash is not None:
+                print(script_store.get_path(script_hash))
+                evidence = script_store.search(script, EVIDENCE_SCANNER)
             fingerprinting_categories = set()
             detected_wallet_apis = list()
             for api in findings[url][script][0]:
@@ -296,10 +381,7 @@ def main():
                 blocked.append("EasyPrivacy")
             if disconnect_rules.should_block(initiator) or disconnect_rules.should_block(script):
                 blocked.append("Disconnect")
-            if get_fqdn(initiator) in whotracksme_rules or get_fqdn(script) in whotracksme_rules:
-                blocked.append("Whotracks.me")
-            if get_fqdn(initiator) in duckduckgo_rules or get_fqdn(script) in duckduckgo_rules:
-                blocked.append("DuckDuckGo")
+            blocked.extend(tracker_domains.get_lists(initiator, script))
 
             finding = {
                 "traces": call_traces,
@@ -319,23 +401,24 @@ def main():
                 "evidence": evidence
             }
 
-            collection.insert_one(finding)
-            # Indexing...
-            if 'url' not in collection.index_information():
-                collection.create_index('tranco_rank')
-                collection.create_index('url')
-                collection.create_index('url_domain')
-                collection.create_index('initiator')
-                collection.create_index('initiator_domain')
-                collection.create_index('script')
-                collection.create_index('script_domain')
-                collection.create_index('third_party')
-                collection.create_index('browser_fingerprinting')
-                collection.create_index('category')
-                collection.create_index('blocklists')
-                collection.create_index('detected_wallet_apis')
-                collection.create_index('fingerprinting_categories')
-                collection.create_index('evidence')
+            results.add(finding)
+        # The findings of a website are written together.
+        results.checkpoint()
+
+    results.close()
+    if uncategorized:
+        print()
+        print("Skipped"+colors.FAIL, len(uncategorized), colors.END+"website(s) that could not be categorized; run again to retry them.")
+    site_categories.close()
+    script_store.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Detect Web3-based browser fingerprinting in the crawl results.")
+    parser.add_argument("--categories-cache", default=SITE_CATEGORIES_CACHE, help="Cache of the website categories (default: %(default)s).")
+    parser.add_argument("--category-file", help="CSV file of domain,category rows that take precedence over SafeDNS.")
+    parser.add_argument("--offline", action="store_true", help="Do not query SafeDNS; categorize websites from the category file and the cache only.")
+    parser.add_argument("--categorization-url", default=SiteCategories.SAFEDNS_URL, help="Categorization API, e.g. a local stand-in (default: %(default)s).")
+    parser.add_argument("--results", default=ResultStore.MONGO_URI, help="MongoDB URI or SQLite file to store the findings in (default: %(default)s).")
+    parser.add_argument("--batch-size", type=int, default=ResultStore.BATCH_SIZE, help="Findings written per bulk insert (default: %(default)s).")
+    parser.add_argument("--write-concern", type=ResultStore.parse_write_concern, help="Write concern \"w\" of the inserts, e.g. 0 for unacknowledged bulk loads (default: that of the server).")
+    main(parser.parse_args())
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+ANALYSIS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analysis")
+
+sys.path.insert(0, ANALYSIS_FOLDER)
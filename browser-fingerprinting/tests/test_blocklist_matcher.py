@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import random
+import BlocklistMatcher
+
+from adblockparser import AdblockRules
+
+HOSTS = ["doubleclick.net", "ads.example.com", "cdn.example.com", "tracker.io", "stats.tracker.io", "example.org", "pixel.ad-network.com", "xn--bcher-kva.de"]
+PATHS = ["ads", "ad", "banner", "track", "pixel.gif", "js/analytics.js", "beacon", "v1", "collect", "ADS"]
+OPTIONS = ["", "$third-party", "$~third-party", "$script", "$match-case", "$third-party,match-case", "$domain=example.org", "$image,third-party"]
+
+def random_rule(rng):
+    host = rng.choice(HOSTS)
+    path = rng.choice(PATHS)
+    pattern = rng.choice([
+        "||"+host+"^",
+        "||"+host+"/"+path,
+        "|https://"+host+"/",
+        "/"+path+"/",
+        "/"+path+"^",
+        "*"+path+"*",
+        "-"+path+".",
+        path+"|",
+        host+"/*/"+path,
+        "/"+path+"[0-9]/",
+        "/\\/"+path+"\\d?\\//",
+        "||"+host+"^|",
+        "a|b"+path,
+        path
+    ])
+    return rng.choice(["", "", "", "@@"])+pattern+rng.choice(OPTIONS)
+
+def random_url(rng):
+    url = rng.choice(["http://", "https://"])+rng.choice(["", "www.", "sub."])+rng.choice(HOSTS)
+    for _ in range(rng.randint(0, 3)):
+        url += "/"+rng.choice(PATHS+["index.html", "x"+str(rng.randint(0, 9))])
+    if rng.random() < 0.3:
+        url += "?"+rng.choice(PATHS)+"="+str(rng.randint(0, 99))
+    if rng.random() < 0.1:
+        url = url.upper()
+    if rng.random() < 0.05:
+        url += "/İ"+rng.choice(PATHS)
+    return url
+
+def test_verdicts_equal_adblockrules():
+    rng = random.Random(0)
+    mismatches = list()
+    for _ in range(20):
+        lines = [random_rule(rng) for _ in range(rng.randint(5, 60))]
+        rules = AdblockRules(lines)
+        matcher = BlocklistMatcher.BlocklistMatcher(lines)
+        for _ in range(100):
+            url = random_url(rng)
+            for options in [None, {"third-party": True}, {"third-party": False}]:
+                expected = rules.should_block(url, options)
+                if matcher.should_block(url, options) != expected:
+                    mismatches.append((lines, url, options, expected))
+    assert mismatches == []
+
+def test_cached_rule_set(tmp_path):
+    file_name = str(tmp_path / "easylist.txt")
+    with open(file_name, "w") as f:
+        f.write("! comment\n||tracker.io^$third-party\n@@||tracker.io/ok^\n/banner/\n")
+    matcher = BlocklistMatcher.load(file_name)
+    assert (tmp_path / "easylist.matcher.pickle").exists()
+    cached = BlocklistMatcher.load(file_name)
+    for url, options in [("https://tracker.io/x.js", {"third-party": True}), ("https://tracker.io/x.js", {"third-party": False}),
+                         ("https://tracker.io/ok/x.js", {"third-party": True}), ("https://example.org/banner/1.png", None)]:
+        assert cached.should_block(url, options) == matcher.should_block(url, options)
+    assert cached.should_block("https://tracker.io/x.js", {"third-party": True})
+    assert not cached.should_block("https://tracker.io/ok/x.js", {"third-party": True})
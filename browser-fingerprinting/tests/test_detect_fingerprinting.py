@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import os
+import copy
+import random
+import pytest
+import ScriptStore
+import detect_fingerprinting
+
+def test_import_legacy_evidence(tmp_path, monkeypatch):
+    monkeypatch.setattr(detect_fingerprinting, "EVIDENCE_FOLDER", str(tmp_path))
+    os.makedirs(tmp_path / "example.com")
+    (tmp_path / "example.com" / "wallet.js.js").write_text("window.ethereum.request()")
+    (tmp_path / "example.com" / "index.js").write_text("window.solana.connect()")
+    findings = {
+        "https://www.example.com/": {
+            "https://cdn.example.net/js/wallet.js?v=2": ({}, []),
+            "https://cdn.example.net/": ({}, []),
+            "https://cdn.example.net/js/missing.js": ({}, []),
+        }
+    }
+    with ScriptStore.ScriptStore(str(tmp_path)) as store:
+        assert detect_fingerprinting.import_legacy_evidence(store, findings, list(findings)) == 2
+        assert store.read_text("https://cdn.example.net/js/wallet.js?v=2") == "window.ethereum.request()"
+        assert store.search("https://cdn.example.net/", detect_fingerprinting.EVIDENCE_SCANNER) == ["solana"]
+        assert not "https://cdn.example.net/js/missing.js" in store
+        # Scripts already in the store are left as they are.
+        assert detect_fingerprinting.import_legacy_evidence(store, findings, list(findings)) == 0
+
+def trace_back_initiator(script, initialUrl, requests, trace, traces):
+    """The reconstruction of the initiator traces that InitiatorIndex replaced, kept as the reference."""
+    if not script in trace:
+        trace.append(script)
+        for request in requests:
+            if request["url"] == script:
+                if len(request["initiators"]) > 0:
+                    for initiator in request["initiators"]:
+                        if not initiator in trace:
+                            trace_back_initiator(initiator, initialUrl, requests, copy.copy(trace), traces)
+                else:
+                    if not trace in traces:
+                        traces.append(copy.copy(trace))
+    return traces
+
+def make_requests(seed, urls=8, requests=14):
+    """Return random requests; initiators may form cycles, repeat or include the request itself."""
+    rng = random.Random(seed)
+    urls = ["https://example.com/"+str(i)+".js" for i in range(urls)]
+    return [{"url": rng.choice(urls), "initiators": [rng.choice(urls) for _ in range(rng.choice([0, 0, 1, 1, 2, 3]))]} for _ in range(requests)]
+
+def reference_traces(requests, script):
+    return trace_back_initiator(script, "https://example.com/", requests, list(), list())
+
+@pytest.mark.parametrize("seed", range(200))
+def test_initiator_index_matches_reference(seed):
+    requests = make_requests(seed)
+    index = detect_fingerprinting.InitiatorIndex(requests)
+    for script in dict.fromkeys([request["url"] for request in requests]):
+        assert index.trace_back(script) == reference_traces(requests, script)
+
+def test_initiator_index_cycles():
+    requests = [
+        {"url": "a.js", "initiators": ["b.js"]},
+        {"url": "b.js", "initiators": ["c.js", "a.js"]},
+        {"url": "c.js", "initiators": ["a.js", "b.js"]},
+        {"url": "c.js", "initiators": []},
+        {"url": "b.js", "initiators": []},
+        {"url": "d.js", "initiators": ["d.js"]},
+    ]
+    index = detect_fingerprinting.InitiatorIndex(requests)
+    assert index.trace_back("a.js") == [["a.js", "b.js", "c.js"], ["a.js", "b.js"]] == reference_traces(requests, "a.js")
+    assert index.trace_back("c.js") == [["c.js", "a.js", "b.js"], ["c.js", "b.js"], ["c.js"]] == reference_traces(requests, "c.js")
+    assert index.trace_back("d.js") == [] == reference_traces(requests, "d.js")
+    assert index.trace_back("missing.js") == [] == reference_traces(requests, "missing.js")
+
+@pytest.mark.parametrize("max_traces", [1, 2, 5, 17])
+def test_initiator_index_max_traces(max_traces):
+    # Every script is loaded by each of the two scripts of the layer before, so
+    # the traces double with every layer and repeat below the shared scripts.
+    requests = [{"url": "0a.js", "initiators": []}, {"url": "0b.js", "initiators": []}]
+    for layer in range(1, 7):
+        for name in "ab":
+            requests.append({"url": str(layer)+name+".js", "initiators": [str(layer-1)+"a.js", str(layer-1)+"b.js"]})
+    requests.append({"url": "0a.js", "initiators": ["6a.js"]})
+    index = detect_fingerprinting.InitiatorIndex(requests, max_traces=max_traces)
+    for script in ["6a.js", "3b.js", "0a.js"]:
+        reference = reference_traces(requests, script)
+        assert index.trace_back(script) == reference[:max_traces]
+        assert len(index.trace_back(script)) == min(max_traces, len(reference))
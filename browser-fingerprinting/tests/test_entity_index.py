@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import EntityIndex
+
+ENTITIES = {
+    "Tracker Inc.": {"displayName": "Tracker", "properties": ["tracker.com", "tracker-cdn.net"]},
+    "Shop LLC": {"displayName": "Shop", "properties": ["shop.com"]}
+}
+
+def write_map(file_name, entities):
+    with open(file_name, "w") as f:
+        json.dump(entities, f)
+
+def test_lookups(tmp_path):
+    file_name = str(tmp_path / "entities.json")
+    write_map(file_name, ENTITIES)
+    index = EntityIndex.load(file_name)
+    assert index.same_owner("tracker.com", "tracker-cdn.net")
+    assert not index.same_owner("tracker.com", "shop.com")
+    assert index.get_display_name("shop.com") == "Shop"
+    assert index.get_display_name("unknown.org") == "-"
+
+def test_cache_follows_content(tmp_path):
+    file_name = str(tmp_path / "entities.json")
+    write_map(file_name, ENTITIES)
+    EntityIndex.load(file_name)
+    stat = os.stat(file_name)
+    # Rewritten in place with the same size and modification time, as by git checkout or rsync -t.
+    write_map(file_name, {"Tracker Inc.": {"displayName": "Tracked", "properties": ["tracker.com", "tracker-cdn.net"]}, "Shop LLC": ENTITIES["Shop LLC"]})
+    assert os.path.getsize(file_name) == stat.st_size
+    os.utime(file_name, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert EntityIndex.load(file_name).get_display_name("tracker.com") == "Tracked"
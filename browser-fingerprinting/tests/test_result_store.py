@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pytest
+import ResultStore
+
+FINDINGS = [
+    {"url": "https://a.example/", "url_domain": "a.example", "script": "https://cdn.example/a.js", "script_domain": "cdn.example",
+     "tranco_rank": 20, "third_party": True, "category": "Finance", "blocklists": ["easylist", "easyprivacy"], "evidence": ["ethereum"]},
+    {"url": "https://b.example/", "url_domain": "b.example", "script": "https://cdn.example/b.js", "script_domain": "cdn.example",
+     "tranco_rank": 5, "third_party": True, "category": "Finance", "blocklists": ["easyprivacy"], "evidence": []},
+    {"url": "https://c.example/", "url_domain": "c.example", "script": "https://c.example/c.js", "script_domain": "c.example",
+     "tranco_rank": "", "third_party": False, "category": "Games", "blocklists": [], "evidence": ["solana"]},
+    {"url": "https://d.example/", "url_domain": "d.example", "script": "https://tracker.example/d.js", "script_domain": "tracker.example",
+     "third_party": True, "category": None, "blocklists": ["easylist"], "evidence": ["ethereum", "solana"], "note": "unranked"},
+    {"url": "https://e.example/", "url_domain": "e.example", "script": "https://tracker.example/e.js", "script_domain": "tracker.example",
+     "tranco_rank": 100, "third_party": True, "category": "Games", "blocklists": ["easylist"], "evidence": ["ethereum"]},
+]
+
+@pytest.fixture
+def store(tmp_path):
+    with ResultStore.SQLiteResultStore(str(tmp_path / "results.sqlite")) as store:
+        store.create_indexes()
+        for finding in FINDINGS:
+            store.add(finding)
+        store.flush()
+        yield store
+
+def urls(findings):
+    return [finding["url_domain"] for finding in findings]
+
+def test_filter_on_list_fields(store):
+    assert urls(store.find({"blocklists": "easylist"})) == ["a.example", "d.example", "e.example"]
+    assert urls(store.find({"blocklists": "easyprivacy", "evidence": "ethereum"})) == ["a.example"]
+    assert urls(store.find({"blocklists": "easylist", "category": "Games"})) == ["e.example"]
+    assert urls(store.find({"note": "unranked"})) == ["d.example"]
+    assert store.count({"evidence": "solana"}) == 2
+    assert store.count({"blocklists": "adguard"}) == 0
+    with pytest.raises(ValueError):
+        store.find({"tranco_rank": {"$gt": 10}})
+
+def test_find_sorts_as_mongodb(store):
+    # Missing values first, then numbers by value, then strings.
+    assert urls(store.find(sort="tranco_rank")) == ["d.example", "b.example", "a.example", "e.example", "c.example"]
+    assert urls(store.find({"third_party": True}, sort="tranco_rank", limit=2)) == ["d.example", "b.example"]
+    assert urls(store.find({"category": "Games"}, sort="tranco_rank", limit=1)) == ["e.example"]
+    with pytest.raises(ValueError):
+        store.find(sort="blocklists")
+
+def test_count_by(store):
+    # By descending count, then descending value; findings without a value are left out.
+    assert store.count_by("category") == [{"_id": "Games", "count": 2}, {"_id": "Finance", "count": 2}]
+    assert store.count_by("script_domain", {"third_party": True}) == [{"_id": "tracker.example", "count": 2}, {"_id": "cdn.example", "count": 2}]
+    assert store.count_by("evidence") == [{"_id": "ethereum", "count": 3}, {"_id": "solana", "count": 2}]
+    assert store.count_by("blocklists", {"category": "Finance"}) == [{"_id": "easyprivacy", "count": 2}, {"_id": "easylist", "count": 1}]
+
+def test_distinct(store):
+    assert store.distinct("category") == ["Finance", "Games"]
+    assert store.distinct("evidence", {"third_party": True}) == ["ethereum", "solana"]
+    assert store.distinct("script", {"script_domain": "tracker.example"}) == ["https://tracker.example/d.js", "https://tracker.example/e.js"]
+    assert store.distinct("note") == ["unranked"]
+
+def test_load_analyzed_urls(store):
+    assert store.load_analyzed_urls() == set([finding["url"] for finding in FINDINGS])
+
+@pytest.mark.parametrize("export", ["lines", "array"])
+def test_import_json(tmp_path, export):
+    documents = [dict(finding, _id={"$oid": str(i)}) for i, finding in enumerate(FINDINGS)]
+    export_file = tmp_path / "export.json"
+    if export == "lines":
+        export_file.write_text("\n".join([json.dumps(document) for document in documents])+"\n")
+    else:
+        export_file.write_text(json.dumps(documents, indent=2))
+    with ResultStore.SQLiteResultStore(str(tmp_path / "results.sqlite"), batch_size=2) as store:
+        assert store.import_json(str(export_file)) == len(FINDINGS)
+        assert store.find() == FINDINGS
+        assert store.count({"blocklists": "easylist"}) == 3
+
+def add_site(store, url, scripts):
+    for i in range(scripts):
+        store.add({"url": url, "script": url+str(i)+".js", "blocklists": ["easylist"]})
+    store.checkpoint()
+
+def test_checkpoint_writes_whole_sites(tmp_path):
+    file_name = str(tmp_path / "results.sqlite")
+    store = ResultStore.SQLiteResultStore(file_name, batch_size=2)
+    reader = ResultStore.SQLiteResultStore(file_name)
+    store.add({"url": "https://a.example/", "script": "https://a.example/0.js"})
+    store.add({"url": "https://a.example/", "script": "https://a.example/1.js"})
+    # Nothing is written before the website is done, even with a full batch.
+    assert reader.count() == 0
+    store.add({"url": "https://a.example/", "script": "https://a.example/2.js"})
+    store.checkpoint()
+    assert reader.count({"url": "https://a.example/"}) == 3
+    add_site(store, "https://b.example/", 1)
+    assert reader.load_analyzed_urls() == set(["https://a.example/"])
+    add_site(store, "https://c.example/", 2)
+    assert reader.load_analyzed_urls() == set(["https://a.example/", "https://b.example/", "https://c.example/"])
+    assert reader.count({"blocklists": "easylist"}) == 3
+    add_site(store, "https://d.example/", 1)
+    assert reader.count() == 6
+    # The rest of the buffer is written on close.
+    store.close()
+    assert reader.count() == 7
+    assert reader.distinct("url") == ["https://a.example/", "https://b.example/", "https://c.example/", "https://d.example/"]
+    reader.close()
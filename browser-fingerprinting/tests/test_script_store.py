@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import threading
+import http.server
+import pytest
+import ScriptStore
+
+# Scripts served by the test server; "lib" is the same library on every site.
+LIBRARY = b"function track(){return navigator.userAgent}"
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path.startswith("/flaky") and self.server.requests.count(self.path) == 1:
+            self.send_response(503)
+            body = b""
+        elif self.path.startswith("/missing"):
+            self.send_response(404)
+            body = b"not found"
+        elif self.path.startswith("/lib"):
+            self.send_response(200)
+            body = LIBRARY
+        else:
+            self.send_response(200)
+            body = ("var page = "+repr(self.path)+";").encode()
+        self.send_header("Content-Type", "application/javascript; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("localhost", 0), Handler)
+    server.requests = list()
+    server.url = "http://localhost:"+str(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ScriptStore, "BACKOFF", 0.0)
+
+def count_manifest(directory):
+    db = sqlite3.connect(os.path.join(directory, "manifest.sqlite"))
+    count = db.execute("SELECT COUNT(*) FROM scripts").fetchone()[0]
+    db.close()
+    return count
+
+def test_fetch_all(server, tmp_path):
+    urls = [server.url+"/lib.js?site="+str(i) for i in range(5)] + [server.url+"/app.js", server.url+"/flaky.js", server.url+"/missing.js"]
+    with ScriptStore.ScriptStore(str(tmp_path)) as store:
+        assert store.fetch_all(urls + urls) == len(urls)
+        assert store.read(urls[0]) == LIBRARY
+        assert store.get_hash(urls[0]) == store.get_hash(urls[4])
+        assert store.get_status(server.url+"/flaky.js") == 200
+        assert store.get_status(server.url+"/missing.js") == 404
+        assert store.search(server.url+"/lib.js?site=1", ScriptStore.TermScanner(["userAgent", "platform"])) == ["userAgent"]
+        # Fetched scripts are not requested again.
+        requests = len(server.requests)
+        assert store.fetch_all(urls) == 0
+        assert len(server.requests) == requests
+    objects = [name for _, _, names in os.walk(tmp_path / "objects") for name in names]
+    assert len(objects) == 4
+
+def test_scripts_are_stored_as_they_arrive(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(ScriptStore, "COMMIT_INTERVAL", 5)
+    urls = [server.url+"/page"+str(i)+".js" for i in range(30)]
+    store = ScriptStore.ScriptStore(str(tmp_path), concurrency=2, concurrency_per_host=2)
+    put = store.put
+    def failing_put(url, *args):
+        if url == urls[20]:
+            raise OSError("disk full")
+        return put(url, *args)
+    store.put = failing_put
+    with pytest.raises(OSError):
+        store.fetch_all(urls)
+    # The scripts stored before the failure are in the manifest.
+    assert count_manifest(str(tmp_path)) >= 15
+    store.close()
+
+@pytest.mark.parametrize("terms, body, found", [
+    (["ab", "abc"], "abc", ["ab", "abc"]),
+    (["abc", "ab"], "abc", ["abc", "ab"]),
+    (["canvas", "toDataURL"], "x.toDataURL()", ["toDataURL"]),
+    (["abc", "cde"], "abcde", ["abc", "cde"]),
+    (["cde", "abc"], "abcde", ["cde", "abc"]),
+    (["getContext", "Context2D"], "getContext2D", ["getContext", "Context2D"]),
+])
+def test_term_scanner_finds_overlapping_terms(terms, body, found):
+    scanner = ScriptStore.TermScanner(terms)
+    assert scanner.scan(body) == found
+    assert scanner.scan(body.encode("utf-8")) == found
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import threading
+import pytest
+import SiteCategories
+
+CATEGORIES = {"uniswap.org": "Finance", "opensea.io": "Shopping", "news.com": "News"}
+
+def write_category_file(file_name, categories):
+    with open(file_name, "w") as f:
+        for domain, category in categories.items():
+            f.write(domain+","+category+"\n")
+
+@pytest.fixture
+def stub(tmp_path):
+    """The stub of the SafeDNS API, on a free port."""
+    category_file = str(tmp_path / "stub_categories.csv")
+    write_category_file(category_file, CATEGORIES)
+    server = SiteCategories.make_server(category_file, 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = "http://localhost:"+str(server.server_address[1])+"/"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def get_cached_domains(cache_file):
+    db = sqlite3.connect(cache_file)
+    domains = set([row[0] for row in db.execute("SELECT domain FROM categories")])
+    db.close()
+    return domains
+
+def test_cached_lookups_are_not_repeated(stub, tmp_path):
+    cache_file = str(tmp_path / "categories.sqlite")
+    domains = ["uniswap.org", "opensea.io", "unknown.org", "uniswap.org"]
+    with SiteCategories.SiteCategories(cache_file, url=stub.url, rate=0) as categories:
+        categories.prefetch(domains)
+        assert [categories.get(domain) for domain in domains] == ["Finance", "Shopping", "", "Finance"]
+    assert sorted(stub.lookups) == ["opensea.io", "uniswap.org", "unknown.org"]
+    # A later run answers from the cache.
+    with SiteCategories.SiteCategories(cache_file, url=stub.url, rate=0) as categories:
+        categories.prefetch(domains)
+        assert categories.get("opensea.io") == "Shopping"
+        assert categories.get("unknown.org") == ""
+        assert categories.get("news.com") == "News"
+    assert sorted(stub.lookups) == ["news.com", "opensea.io", "uniswap.org", "unknown.org"]
+
+def test_failed_lookups_are_not_cached(stub, tmp_path):
+    cache_file = str(tmp_path / "categories.sqlite")
+    # Nothing listens on the port of a closed server.
+    closed = SiteCategories.make_server(str(tmp_path / "stub_categories.csv"), 0)
+    closed_url = "http://localhost:"+str(closed.server_address[1])+"/"
+    closed.server_close()
+    with SiteCategories.SiteCategories(cache_file, url=closed_url, rate=0, timeout=5) as categories:
+        categories.prefetch(["uniswap.org", "unknown.org"])
+        # A failed lookup is told apart from a domain without a category.
+        assert categories.get("uniswap.org") is None
+        assert categories.get("unknown.org") is None
+    assert get_cached_domains(cache_file) == set()
+    with SiteCategories.SiteCategories(cache_file, url=stub.url, rate=0) as categories:
+        assert categories.get("uniswap.org") == "Finance"
+    assert get_cached_domains(cache_file) == set(["uniswap.org"])
+
+def test_offline_never_looks_up(stub, tmp_path):
+    cache_file = str(tmp_path / "categories.sqlite")
+    category_file = str(tmp_path / "categories.csv")
+    write_category_file(category_file, {"uniswap.org": "Cryptocurrency"})
+    with SiteCategories.SiteCategories(cache_file, url=stub.url, category_file=category_file, offline=True) as categories:
+        categories.prefetch(["uniswap.org", "opensea.io"])
+        assert categories.get("uniswap.org") == "Cryptocurrency"
+        assert categories.get("opensea.io") == ""
+    with SiteCategories.SiteCategories(cache_file, url=stub.url, category_file=category_file) as categories:
+        # The category file takes precedence over lookups.
+        assert categories.get("uniswap.org") == "Cryptocurrency"
+    assert stub.lookups == list()
@@ -1,5 +1,6 @@
 const chromeLoggerLib = require('./logging.js')
 const chromePuppeteerLib = require('./puppeteer.js')
+const chromeLeakServiceLib = require('./leak-service.js')
 const { createTimer } = require('./timer');
 const { importMetaMaskWallet, connectMetaMaskWallet } = require('./helper');
 const NATIVE_CLICK = 'native';
@@ -30,7 +31,7 @@ function normalizeHeaders(headers) {
     return normalized;
 }
 
-const onRequest = async (options, requestLog, request) => {
+const onRequest = async (options, requestLog, leakService, request) => {
   let requestContext = []
 
   const frame = request.frame()
@@ -70,6 +71,9 @@ const onRequest = async (options, requestLog, request) => {
   })
 
   const numRequests = requestLog.requests.length
+  if (leakService) {
+    leakService.send(Object.assign({ event: 'request' }, requestLog.requests[numRequests - 1]))
+  }
   const logger = chromeLoggerLib.getLoggerForLevel(options.debugLevel)
   logger.debug('Request '+numRequests+': \033[94m'+requestUrl.split('?', 1).toString().split(';', 1)+'\033[0m')
 }
@@ -98,7 +102,7 @@ const handleWebSocketCreated = async (options, requestLog, webSockets, request)
   webSockets.push(request)
 }
 
-const handleWebSocketFrameSent = async (options, requestLog, webSockets, request) => {
+const handleWebSocketFrameSent = async (options, requestLog, webSockets, leakService, request) => {
   for (let i = 0; i < webSockets.length; i++) {
     if (webSockets[i].requestId === request.requestId) {
       requestUrl = webSockets[i].url
@@ -115,6 +119,9 @@ const handleWebSocketFrameSent = async (options, requestLog, webSockets, request
         responseHeaders: {}
       })
       const numRequests = requestLog.requests.length
+      if (leakService) {
+        leakService.send(Object.assign({ event: 'request' }, requestLog.requests[numRequests - 1]))
+      }
       const logger = chromeLoggerLib.getLoggerForLevel(options.debugLevel)
       logger.debug('Request '+numRequests+': \033[94m'+requestUrl.split('?', 1).toString().split(';', 1)+'\033[0m')
       break
@@ -122,20 +129,26 @@ const handleWebSocketFrameSent = async (options, requestLog, webSockets, request
   }
 }
 
-const handleResponse = async (options, requestLog, request) => {
+const handleResponse = async (options, requestLog, leakService, request) => {
   for (let i = 0; i < requestLog.requests.length; i++) {
     if (requestLog.requests[i].id === request.requestId) {
       requestLog.requests[i].status = request.response.status
       requestLog.requests[i].responseHeaders = normalizeHeaders(request.response.headers)
+      if (leakService) {
+        leakService.send({ event: 'response', id: request.requestId, responseHeaders: requestLog.requests[i].responseHeaders })
+      }
       break
     }
   }
 }
 
-const handleResponseExtraInfo = async (options, requestLog, response) => {
+const handleResponseExtraInfo = async (options, requestLog, leakService, response) => {
   for (let i = 0; i < requestLog.requests.length; i++) {
     if (requestLog.requests[i].id === response.requestId) {
       requestLog.requests[i].responseHeaders = normalizeHeaders(response.headers)
+      if (leakService) {
+        leakService.send({ event: 'response', id: response.requestId, responseHeaders: requestLog.requests[i].responseHeaders })
+      }
       break
     }
   }
@@ -145,21 +158,21 @@ const onClose = async (options, page) => {
   console.log('Page closed: \033[94m'+page.url()+'\033[0m')
 }
 
-const onTargetCreated = async (options, requestLog, webSockets, cdpClients, target) => {
+const onTargetCreated = async (options, requestLog, webSockets, cdpClients, leakService, target) => {
   if (target.type() !== 'page') {
     return
   }
   const page = await target.page()
-  page.on('request', onRequest.bind(undefined, options, requestLog))
+  page.on('request', onRequest.bind(undefined, options, requestLog, leakService))
   page.on('close', onClose.bind(undefined, options, page))
 
   const cdpClient = await page.target().createCDPSession()
   await cdpClient.send('Network.enable')
   await cdpClient.send('Page.enable')
   cdpClient.on('Network.webSocketCreated', handleWebSocketCreated.bind(undefined, options, requestLog, webSockets))
-  cdpClient.on('Network.webSocketFrameSent', handleWebSocketFrameSent.bind(undefined, options, requestLog, webSockets))
-  cdpClient.on('Network.responseReceived', handleResponse.bind(undefined, options, requestLog))
-  cdpClient.on('Network.responseReceivedExtraInfo', handleResponseExtraInfo.bind(undefined, options, requestLog))
+  cdpClient.on('Network.webSocketFrameSent', handleWebSocketFrameSent.bind(undefined, options, requestLog, webSockets, leakService))
+  cdpClient.on('Network.responseReceived', handleResponse.bind(undefined, options, requestLog, leakService))
+  cdpClient.on('Network.responseReceivedExtraInfo', handleResponseExtraInfo.bind(undefined, options, requestLog, leakService))
   cdpClients.push(cdpClient)
 
   const logger = chromeLoggerLib.getLoggerForLevel(options.debugLevel)
@@ -180,11 +193,21 @@ const crawl = async args => {
   let cdpClients = []
   let webSockets = []
 
+  // Stream requests to the live leak detection service, if one is given.
+  let leakService
+  if (args.leakService !== undefined && args.url !== undefined) {
+    try {
+      leakService = await chromeLeakServiceLib.connect(args, args.url)
+    } catch (error) {
+      logger.debug('\033[91mCould not connect to leak service: '+error.toString()+'\033[0m')
+    }
+  }
+
   let browser
 
   try {
     browser = await chromePuppeteerLib.launch(args)
-    browser.on('targetcreated', onTargetCreated.bind(undefined, args, log, webSockets, cdpClients))
+    browser.on('targetcreated', onTargetCreated.bind(undefined, args, log, webSockets, cdpClients, leakService))
 
     if (args.url == undefined) {
       let pages = await browser.pages()
@@ -363,12 +386,17 @@ const crawl = async args => {
         // Wait a certain time and do nothing
         const waitTimeMs = args.secs * 1000
         logger.debug(`Waiting for ${waitTimeMs}ms`)
-        await page.waitForTimeout(waitTimeMs)
+        if (leakService) {
+          // Stop waiting once the leak service has confirmed enough leaks.
+          await Promise.race([page.waitForTimeout(waitTimeMs), leakService.stopped])
+        } else {
+          await page.waitForTimeout(waitTimeMs)
+        }
       } else {
         // Interact with DApp
         let counter = 0;
         let hrefs = await page.$$eval('a', as => as.map(a => a.href));
-        while (counter < args.links) {
+        while (counter < args.links && !(leakService && leakService.stop)) {
           counter += 1;
           let new_hrefs = await page.$$eval('a', as => as.map(a => a.href));
           hrefs = hrefs.concat(new_hrefs);
@@ -418,6 +446,10 @@ const crawl = async args => {
         } catch {}
       }
 
+      if (leakService) {
+        leakService.send({ event: 'cookies', cookies: log.cookies })
+      }
+
       try {
         await page.close()
       } catch  {}
@@ -435,6 +467,13 @@ const crawl = async args => {
     logger.debug('\033[91mError when shutting down: '+e.toString()+'\033[0m')
   }
 
+  if (leakService) {
+    await leakService.close()
+    log.leaky = leakService.leaky
+    log.liveLeaks = leakService.leaks.length
+    log.stoppedEarly = leakService.stop
+  }
+
   log.timestamps.end = Date.now()
   return log
 }
@@ -0,0 +1,75 @@
+const net = require('net')
+const chromeLoggerLib = require('./logging.js')
+
+// Streams request events to the live leak detection service
+// (wallet-address-leakage/analysis/detect-leaks-live.py) over a Unix socket
+// and collects its verdicts.
+const connect = async (options, url) => {
+  const logger = chromeLoggerLib.getLoggerForLevel(options.debugLevel)
+  const socket = net.createConnection(options.leakService)
+  await new Promise((resolve, reject) => {
+    socket.once('connect', resolve)
+    socket.once('error', reject)
+  })
+
+  const service = {
+    leaks: [],
+    leaky: false,
+    stop: false,
+    summary: undefined
+  }
+  let onStop
+  service.stopped = new Promise(resolve => { onStop = resolve })
+  let onSummary
+  const summary = new Promise(resolve => { onSummary = resolve })
+
+  let buffer = ''
+  socket.setEncoding('utf8')
+  socket.on('data', data => {
+    buffer += data
+    let newline
+    while ((newline = buffer.indexOf('\n')) !== -1) {
+      const message = JSON.parse(buffer.slice(0, newline))
+      buffer = buffer.slice(newline + 1)
+      if (message.event === 'verdict') {
+        service.leaks = service.leaks.concat(message.leaks)
+        service.leaky = true
+        for (const leak of message.leaks) {
+          logger.debug('Leak ('+leak.channel+'): \033[92m'+leak.third_party+'\033[0m')
+        }
+        if (message.stop && !service.stop) {
+          service.stop = true
+          onStop()
+        }
+      } else if (message.event === 'summary') {
+        service.summary = message
+        onSummary()
+      } else if (message.event === 'error') {
+        logger.debug('\033[91mLeak service: '+message.message+'\033[0m')
+      }
+    }
+  })
+  socket.on('error', error => {
+    logger.debug('\033[91mLeak service: '+error.toString()+'\033[0m')
+    onSummary()
+  })
+  socket.on('close', onSummary)
+
+  service.send = event => {
+    if (!socket.destroyed) {
+      socket.write(JSON.stringify(event)+'\n')
+    }
+  }
+  service.close = async () => {
+    service.send({ event: 'end' })
+    await summary
+    socket.end()
+  }
+
+  service.send({ event: 'site', url })
+  return service
+}
+
+module.exports = {
+  connect
+}
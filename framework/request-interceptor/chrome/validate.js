@@ -51,6 +51,7 @@ const validate = rawArgs => {
     walletPath: rawArgs.wallet,
     destination: destination,
     force: rawArgs.force,
+    leakService: rawArgs.leak_service,
     executablePath
   }
   return [true, Object.freeze(validatedArgs)]
@@ -60,6 +60,10 @@ parser.add_argument('-f', '--force', {
   help: 'Force override if results file already exists.',
   action: 'store_true'
 })
+parser.add_argument('--leak-service', {
+  help: 'Path to the Unix socket of a running leak detection service (detect-leaks-live.py) to stream requests to.',
+  required: false
+})
 
 const rawArgs = parser.parse_args()
 const [isValid, errorOrArgs] = chromeValidateLib.validate(rawArgs)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Structured logging for the leak analyses. Callers only enqueue log records;
+ a background thread writes them to stderr (rate limited per message) and,
+ optionally, appends every record as one JSON object per line to an event
+ stream. Per-request tracing is logged at DEBUG level and skipped entirely
+ unless tracing is enabled.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+import multiprocessing.util
+
+LOGGER_NAME = "analysis"
+
+# Maximum number of console lines per message template and interval.
+RATE_LIMIT = 20
+RATE_INTERVAL = 1.0
+
+# Number of events buffered before they are written to the event stream.
+EVENT_BUFFER = 1000
+
+LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR
+}
+
+class colors:
+    INFO = '\033[94m'
+    OK = '\033[92m'
+    FAIL = '\033[91m'
+    END = '\033[0m'
+
+logger = logging.getLogger(LOGGER_NAME)
+logger.propagate = False
+
+_config = None
+_listener = None
+_pid = None
+# Whether DEBUG records are logged, as of the last `setup`
+_tracing = None
+# Process that registered the exit handler of its worker processes
+_finalizer_pid = None
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record):
+        message = record.getMessage()
+        color = getattr(record, "color", None)
+        if color is None and record.levelno >= logging.WARNING:
+            color = colors.FAIL
+        if color:
+            message = color+message+colors.END
+        if getattr(record, "suppressed", 0):
+            message += " ("+str(record.suppressed)+" similar messages suppressed)"
+        return "[+] " + message
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, limit=RATE_LIMIT, interval=RATE_INTERVAL):
+        """RateLimitFilter drops console records once a message template was
+        emitted `limit` times within `interval` seconds. The number of dropped
+        records is reported with the next record that passes.
+
+        Records are told apart by the `template` passed by `log`, as the
+        queue has already merged their arguments into the message.
+        """
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.windows = dict()
+        self.last_cleanup = time.monotonic()
+
+    def cleanup(self, now):
+        """Drop the expired windows that have no suppressed records to report."""
+        self.windows = {template: window for template, window in self.windows.items() if now - window[0] < self.interval or window[2]}
+        self.last_cleanup = now
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        if now - self.last_cleanup >= self.interval:
+            self.cleanup(now)
+        template = getattr(record, "template", record.msg)
+        start, emitted, suppressed = self.windows.get(template, (now, 0, 0))
+        if now - start >= self.interval:
+            start, emitted = now, 0
+        if emitted >= self.limit:
+            self.windows[template] = (start, emitted, suppressed + 1)
+            return False
+        record.suppressed = suppressed
+        self.windows[template] = (start, emitted + 1, 0)
+        return True
+
+class EventStreamHandler(logging.handlers.BufferingHandler):
+    def __init__(self, file_name, capacity=EVENT_BUFFER):
+        """EventStreamHandler appends records as JSON lines to `file_name`.
+
+        Records are buffered and every batch is written with a single append
+        so that several processes can share the same event stream.
+        """
+        super().__init__(capacity)
+        self.fd = os.open(file_name, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def to_event(self, record):
+        event = {
+            "time": record.created,
+            "level": record.levelname.lower(),
+            "process": record.process,
+            "event": getattr(record, "event", None),
+            "message": record.getMessage()
+        }
+        event.update(getattr(record, "fields", {}))
+        return event
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer:
+                lines = "".join([json.dumps(self.to_event(record), default=str)+"\n" for record in self.buffer])
+                os.write(self.fd, lines.encode("utf-8"))
+                self.buffer = list()
+        finally:
+            self.release()
+
+    def close(self):
+        try:
+            self.flush()
+            os.close(self.fd)
+        finally:
+            super().close()
+
+def setup(level=logging.INFO, events_file=None):
+    """Route the analysis logger through a background thread.
+
+    Safe to call again, e.g. in a freshly started worker process, in which
+    case the previous configuration of this process is replaced.
+    """
+    global _config, _listener, _pid, _tracing, _finalizer_pid
+    shutdown()
+    _config = (level, events_file)
+    _pid = os.getpid()
+    handlers = list()
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(ConsoleFormatter())
+    console.addFilter(RateLimitFilter())
+    handlers.append(console)
+    if events_file:
+        handlers.append(EventStreamHandler(events_file))
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    records = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.setLevel(level)
+    _tracing = logger.isEnabledFor(logging.DEBUG)
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    # Worker processes of multiprocessing exit without running atexit handlers.
+    if _finalizer_pid != _pid:
+        multiprocessing.util.Finalize(None, shutdown, exitpriority=100)
+        _finalizer_pid = _pid
+
+def get_config():
+    """Return the arguments of the last `setup` call, e.g. to pass to worker processes."""
+    return _config or (logging.INFO, None)
+
+def shutdown():
+    """Write out all queued records and stop the background thread."""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    if _pid != os.getpid():
+        # Inherited from the parent by fork(); its records are the parent's to write.
+        for handler in listener.handlers:
+            if isinstance(handler, EventStreamHandler):
+                handler.buffer = list()
+                os.close(handler.fd)
+        return
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+atexit.register(shutdown)
+
+def _ensure_setup():
+    # Covers modules used without `setup` and processes forked after it.
+    if _listener is None or _pid != os.getpid():
+        setup(*get_config())
+
+def is_tracing():
+    """Return True if per-request DEBUG records are logged."""
+    if _tracing is None:
+        _ensure_setup()
+    return _tracing
+
+def log(msg, *args, level=logging.INFO, event=None, color=None, **fields):
+    """Log `msg % args` and attach the keyword arguments as event fields."""
+    _ensure_setup()
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, *args, extra={"template": msg, "event": event, "color": color, "fields": fields})
+
+def trace(msg, *args, event=None, color=None, **fields):
+    log(msg, *args, level=logging.DEBUG, event=event, color=color, **fields)
+
+def warning(msg, *args, event=None, **fields):
+    log(msg, *args, level=logging.WARNING, event=event, **fields)
+
+def add_arguments(parser, debug=False):
+    """Add the --log-level and --events options to an argparse parser."""
+    parser.add_argument("--log-level", choices=list(LEVELS), default="debug" if debug else "info", help="Minimum level of the logged messages; 'debug' traces every leak.")
+    parser.add_argument("--events", metavar="FILE", help="Append all log records as JSON lines to FILE.")
+
+def setup_from_arguments(args):
+    setup(LEVELS[args.log_level], args.events)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Runs the analysis of several crawl categories (e.g. the DApp categories of
+ DAppRadar.com) as concurrent jobs that share a fixed budget of worker
+ processes, and reports per-category throughput, ETA and slowest files while
+ the jobs are running.
+"""
+
+import os
+import json
+import time
+import queue
+import heapq
+import logging
+import threading
+import multiprocessing
+import AnalysisLog
+import CrawlArchive
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+REPORT_INTERVAL = 10.0
+SLOWEST_FILES = 3
+
+colors = AnalysisLog.colors
+log = AnalysisLog.log
+
+def load_manifest(file_name):
+    """Load a manifest: a JSON list of {"category", "name", "directory"} entries."""
+    with open(file_name, "r") as f:
+        manifest = json.load(f)
+    for job in manifest:
+        if not "category" in job or not "directory" in job:
+            raise ValueError("Manifest entries need a 'category' and a 'directory': "+str(job))
+        job.setdefault("name", job["category"].lower().replace(" ", "_"))
+    return manifest
+
+def count_files(directory, shard=None):
+    """Return the number of crawl files in the given directory (and shard), not counting archive members."""
+    if not os.path.isdir(directory):
+        return 0
+    return len([name for name in os.listdir(directory) if CrawlArchive.is_crawl_file(name) and (shard is None or name in shard)])
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "{}h{:02d}m".format(hours, minutes)
+    if minutes:
+        return "{}m{:02d}s".format(minutes, seconds)
+    return "{}s".format(seconds)
+
+class CategoryProgress():
+    def __init__(self, category, total_files):
+        self.category = category
+        self.total_files = total_files
+        self.files = 0
+        self.requests = 0
+        self.started = None
+        self.finished = None
+        self.slowest = list()
+
+    def update(self, file_name, requests, seconds):
+        if self.started is None:
+            self.started = time.time() - seconds
+        self.files += 1
+        self.requests += requests
+        heapq.heappush(self.slowest, (seconds, file_name))
+        if len(self.slowest) > SLOWEST_FILES:
+            heapq.heappop(self.slowest)
+
+    def report(self):
+        """Return a single status line for this category."""
+        if self.started is None:
+            return self.category+": waiting ("+str(self.total_files)+" files)"
+        elapsed = max((self.finished or time.time()) - self.started, 1e-6)
+        files_per_second = self.files / elapsed
+        line = self.category+": "+str(self.files)+"/"+str(self.total_files)+" files"
+        line += " ({:.1f} files/s, {:.0f} requests/s".format(files_per_second, self.requests / elapsed)
+        if self.finished:
+            line += ", done in "+format_duration(elapsed)+")"
+        elif files_per_second > 0:
+            line += ", ETA "+format_duration(max(self.total_files - self.files, 0) / files_per_second)+")"
+        else:
+            line += ")"
+        if self.slowest:
+            line += " slowest: "+", ".join(["{} ({:.1f}s)".format(os.path.basename(file_name), seconds) for seconds, file_name in sorted(self.slowest, reverse=True)])
+        return line
+
+def _run_job(worker, job, events):
+    """Run `worker(job, progress)` in a worker process, forwarding progress events."""
+    def progress(file_name, requests, seconds):
+        events.put((job["name"], file_name, requests, seconds))
+    return worker(job, progress)
+
+class CategoryRunner():
+    def __init__(self, jobs, worker, workers=None, on_result=None, report_interval=REPORT_INTERVAL):
+        """CategoryRunner schedules one job per manifest entry on a process pool.
+
+        `worker(job, progress)` is called in a worker process for every job
+        and must be a module level function. It reports each analysed file
+        through `progress(file_name, requests, seconds)`. `on_result(job,
+        result)` is called in the parent process as soon as a job finishes,
+        so that its results can be written out right away.
+        """
+        self.jobs = jobs
+        self.worker = worker
+        self.workers = workers or os.cpu_count()
+        self.on_result = on_result
+        self.report_interval = report_interval
+        self.progress = {job["name"]: CategoryProgress(job["category"], count_files(job["directory"], job.get("shard"))) for job in jobs}
+
+    def _consume(self, events, stop):
+        last_report = time.time()
+        while not stop.is_set() or not events.empty():
+            try:
+                name, file_name, requests, seconds = events.get(timeout=0.5)
+                self.progress[name].update(file_name, requests, seconds)
+            except queue.Empty:
+                pass
+            if time.time() - last_report >= self.report_interval:
+                self.report()
+                last_report = time.time()
+
+    def report(self):
+        for progress in self.progress.values():
+            log("%s", progress.report(), event="progress", color=colors.INFO, category=progress.category, files=progress.files, total_files=progress.total_files, requests=progress.requests)
+
+    def run(self):
+        """Run all jobs and return {job name: result} in manifest order.
+
+        A failing job does not stop the others: their results are still
+        passed to `on_result`, and a RuntimeError naming the failed
+        categories is raised once all jobs are done.
+        """
+        results = dict()
+        failed = list()
+        manager = multiprocessing.Manager()
+        events = manager.Queue()
+        stop = threading.Event()
+        consumer = threading.Thread(target=self._consume, args=(events, stop), daemon=True)
+        consumer.start()
+        try:
+            with ProcessPoolExecutor(max_workers=min(self.workers, max(len(self.jobs), 1)), initializer=AnalysisLog.setup, initargs=AnalysisLog.get_config()) as executor:
+                futures = {executor.submit(_run_job, self.worker, job, events): job for job in self.jobs}
+                for future in as_completed(futures):
+                    job = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        log("Failed %s: %s", job["category"], repr(e), level=logging.ERROR, event="failed", color=colors.FAIL, category=job["category"], error=repr(e))
+                        failed.append((job, e))
+                        continue
+                    self.progress[job["name"]].finished = time.time()
+                    log("Finished %s", self.progress[job["name"]].report(), event="finished", color=colors.OK, category=job["category"])
+                    if self.on_result:
+                        self.on_result(job, result)
+                    results[job["name"]] = result
+        finally:
+            stop.set()
+            consumer.join()
+            manager.shutdown()
+        self.report()
+        if failed:
+            raise RuntimeError("Failed categories: "+", ".join([job["category"] for job, _ in failed])) from failed[0][1]
+        return {job["name"]: results[job["name"]] for job in self.jobs if job["name"] in results}
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Periodic, atomic checkpoints of long running analyses. A checkpoint holds
+ the names of the files processed so far and the partial aggregates computed
+ from them, so that a resumed run skips those files and continues from the
+ saved state instead of starting from zero.
+"""
+
+import os
+import json
+import time
+
+# Seconds between two checkpoints.
+CHECKPOINT_INTERVAL = 60.0
+
+def write_json_atomically(file_name, obj):
+    """Write `obj` as JSON so that `file_name` always holds either the old or the new content."""
+    temp_file_name = file_name+".tmp"
+    with open(temp_file_name, "w") as f:
+        json.dump(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file_name, file_name)
+
+class Checkpoint():
+    def __init__(self, file_name, resume=False, interval=CHECKPOINT_INTERVAL):
+        """Checkpoint saves the progress of an analysis to `file_name`.
+
+        With `resume`, a checkpoint left by an earlier run is loaded: `done`
+        holds the files it processed and `state` its partial aggregates.
+        Otherwise any earlier checkpoint is discarded.
+        """
+        self.file_name = file_name
+        self.interval = interval
+        self.done = set()
+        self.state = None
+        self.last_save = time.time()
+        if resume and os.path.exists(file_name):
+            with open(file_name, "r") as f:
+                checkpoint = json.load(f)
+            self.done = set(checkpoint["done"])
+            self.state = checkpoint["state"]
+        elif os.path.exists(file_name):
+            os.remove(file_name)
+
+    def is_done(self, file_name):
+        return file_name in self.done
+
+    def add(self, file_name):
+        """Mark the given file as processed."""
+        self.done.add(file_name)
+
+    def is_due(self):
+        return time.time() - self.last_save >= self.interval
+
+    def save(self, state):
+        """Write the processed files and the given (JSON serializable) state."""
+        write_json_atomically(self.file_name, {"done": sorted(self.done), "state": state})
+        self.last_save = time.time()
+
+    def remove(self):
+        """Drop the checkpoint once the analysis has finished."""
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Reads crawl files as they are distributed: plain .json files, .json.gz,
+ .json.xz and .json.zst files, and members of .zip and .tar archives (with or
+ without compression). Files are decompressed as streams without expanding
+ them to disk, and `read_ahead` moves reading and decompression to a
+ background thread that runs ahead of the analysis.
+
+ A member of an archive is named by appending its path within the archive to
+ the path of the archive, e.g. ../results/dapps/crawl.tar.gz/defi/uniswap.json.
+"""
+
+import os
+import gzip
+import lzma
+import queue
+import tarfile
+import zipfile
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = [".gz", ".xz", ".zst"]
+
+CRAWL_SUFFIXES = [".json"] + [".json"+compression for compression in COMPRESSIONS]
+
+ZIP_SUFFIXES = [".zip"]
+TAR_SUFFIXES = [".tar", ".tar.gz", ".tgz", ".tar.xz", ".txz", ".tar.bz2", ".tbz2", ".tar.zst"]
+
+# Number of files that are read and decompressed ahead of the analysis.
+READ_AHEAD = 8
+
+CHUNK_SIZE = 1 << 20
+
+def is_crawl_file(name):
+    return name.lower().endswith(tuple(CRAWL_SUFFIXES))
+
+def is_archive(name):
+    return name.lower().endswith(tuple(ZIP_SUFFIXES + TAR_SUFFIXES))
+
+def decompress(fileobj, name):
+    """Wrap the binary file object `fileobj` into a decompressing stream according to `name`."""
+    name = name.lower()
+    if name.endswith((".gz", ".tgz")):
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    if name.endswith((".xz", ".txz")):
+        return lzma.LZMAFile(fileobj, mode="rb")
+    if name.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("Reading "+name+" requires the zstandard package (pip install zstandard).")
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, read_size=CHUNK_SIZE, closefd=True)
+    return fileobj
+
+def read_stream(fileobj, name):
+    """Read and decompress the binary file object `fileobj` and close it."""
+    chunks = list()
+    with fileobj, decompress(fileobj, name) as stream:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+def member_name(name):
+    return name[2:] if name.startswith("./") else name
+
+def split_archive_path(name):
+    """Return (archive, member) if `name` points into an archive, else (name, None)."""
+    path = name
+    while path and not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    if path != name and os.path.isfile(path) and is_archive(path):
+        return path, os.path.relpath(name, path).replace(os.sep, "/")
+    return name, None
+
+def get_stamp(name):
+    """Return the modification time and size used to detect changed files.
+
+    Members of an archive carry the stamp of the archive itself.
+    """
+    stat = os.stat(split_archive_path(name)[0])
+    return stat.st_mtime_ns, stat.st_size
+
+def open_tar(path):
+    """Open a tar archive as a sequential stream."""
+    if path.lower().endswith(".tar.zst"):
+        return tarfile.open(fileobj=decompress(open(path, "rb"), path), mode="r|")
+    return tarfile.open(path, mode="r|*")
+
+def read_crawl_file(name):
+    """Return the decompressed content of the crawl file (or archive member) `name`."""
+    archive, member = split_archive_path(name)
+    if member is None:
+        return read_stream(open(name, "rb"), name)
+    if archive.lower().endswith(tuple(ZIP_SUFFIXES)):
+        with zipfile.ZipFile(archive) as zf:
+            return read_stream(zf.open(member), member)
+    with open_tar(archive) as tf:
+        for info in tf:
+            if member_name(info.name) == member:
+                return read_stream(tf.extractfile(info), member)
+    raise FileNotFoundError(name)
+
+class CrawlEntry():
+    def __init__(self, name, stamp, opener):
+        """CrawlEntry is a crawl file found by `iter_entries`.
+
+        `read()` returns the decompressed content. Entries of tar archives can
+        only be read while `iter_entries` has not moved past them; `data` and
+        `error` hold the outcome of reading the entry ahead of time, and
+        `json_data` its decoded content if it was already decoded.
+        """
+        self.name = name
+        self.stamp = stamp
+        self.opener = opener
+        self.data = None
+        self.error = None
+        self.json_data = None
+
+    def read(self):
+        return read_stream(self.opener(), self.name)
+
+def _iter_zip(path, stamp):
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            if not info.is_dir() and is_crawl_file(info.filename):
+                yield CrawlEntry(os.path.join(path, info.filename), stamp, lambda info=info: zf.open(info))
+
+def _iter_tar(path, stamp):
+    with open_tar(path) as tf:
+        for info in tf:
+            if info.isfile() and is_crawl_file(info.name):
+                yield CrawlEntry(os.path.join(path, member_name(info.name)), stamp, lambda info=info: tf.extractfile(info))
+
+def iter_entries(directory):
+    """Yield a CrawlEntry for every crawl file in `directory` and in the archives it contains."""
+    # Sorted, so that every run (and every shard) analyses the files in the same order.
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            continue
+        if is_crawl_file(name):
+            yield CrawlEntry(path, get_stamp(path), lambda path=path: open(path, "rb"))
+        elif name.lower().endswith(tuple(ZIP_SUFFIXES)):
+            yield from _iter_zip(path, get_stamp(path))
+        elif name.lower().endswith(tuple(TAR_SUFFIXES)):
+            yield from _iter_tar(path, get_stamp(path))
+
+def read_ahead(entries, wanted=None, depth=READ_AHEAD):
+    """Yield the given entries after reading them on a background thread.
+
+    The thread stays up to `depth` entries ahead of the consumer. Entries for
+    which `wanted(entry)` returns False are passed on without being read.
+    Errors while reading an entry are stored in its `error` attribute; errors
+    while listing the entries are raised in the consumer.
+    """
+    entries_queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                entries_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for entry in entries:
+                if wanted is None or wanted(entry):
+                    try:
+                        entry.data = entry.read()
+                    except (OSError, EOFError, ValueError, zipfile.BadZipFile, tarfile.TarError, ImportError) as e:
+                        entry.error = e
+                if not put(entry):
+                    return
+        except Exception as e:
+            put(e)
+        put(done)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = entries_queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
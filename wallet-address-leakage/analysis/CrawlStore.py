@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Local SQLite store for the JSON files written by the request interceptor and
+ by the tracker radar collector. Each crawl file is decoded once and converted
+ into indexed tables (pages, requests, headers, cookies, API call stats and
+ initiators). Later analysis runs load pages back from the store instead of
+ decoding the raw JSON again.
+
+ Crawl files may be compressed or packed into archives (see CrawlArchive).
+ The `callStats` of a collector file can be read on its own, without decoding
+ the rest of it, to pick out the files worth decoding in full.
+
+ Usage: python3 CrawlStore.py <STORE> <DIRECTORY> [<DIRECTORY> ...]
+"""
+
+import os
+import re
+import sys
+import json
+import sqlite3
+import publicsuffix2
+import CrawlArchive
+import CrawlWatcher
+
+from urllib.parse import urlparse
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    source TEXT UNIQUE NOT NULL,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    url TEXT,
+    etld1 TEXT,
+    has_cookies INTEGER NOT NULL,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY,
+    page_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    external_id TEXT,
+    url TEXT,
+    etld1 TEXT,
+    type TEXT,
+    method TEXT,
+    status INTEGER,
+    post_data TEXT,
+    request_context TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS headers (
+    request_id INTEGER NOT NULL,
+    direction TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS cookies (
+    page_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    name TEXT,
+    value TEXT,
+    domain TEXT,
+    etld1 TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS api_calls (
+    page_id INTEGER NOT NULL,
+    script TEXT NOT NULL,
+    api TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS initiators (
+    request_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    initiator TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_etld1 ON pages (etld1);
+CREATE INDEX IF NOT EXISTS requests_page ON requests (page_id, seq);
+CREATE INDEX IF NOT EXISTS requests_etld1 ON requests (etld1);
+CREATE INDEX IF NOT EXISTS requests_type ON requests (type);
+CREATE INDEX IF NOT EXISTS headers_request ON headers (request_id);
+CREATE INDEX IF NOT EXISTS cookies_page ON cookies (page_id, seq);
+CREATE INDEX IF NOT EXISTS cookies_etld1 ON cookies (etld1);
+CREATE INDEX IF NOT EXISTS api_calls_page ON api_calls (page_id);
+CREATE INDEX IF NOT EXISTS api_calls_api ON api_calls (api);
+CREATE INDEX IF NOT EXISTS initiators_request ON initiators (request_id);
+"""
+
+INTERCEPTOR_REQUEST_KEYS = ["requestContext", "id", "url", "type", "method", "status", "postData", "headers", "responseHeaders"]
+COLLECTOR_REQUEST_KEYS = ["url", "type", "method", "status", "initiators", "responseHeaders"]
+COOKIE_KEYS = ["name", "value", "domain"]
+
+# Separator for request contexts (frame URLs never contain a raw newline).
+CONTEXT_SEPARATOR = "\n"
+
+def get_etld1(url):
+    """Return the given URL's eTLD+1."""
+    try:
+        fqdn = urlparse(url).netloc
+    except ValueError:
+        return None
+    fqdn = fqdn.split(":")[0]
+    return publicsuffix2.get_sld(fqdn)
+
+def get_cookie_etld1(domain):
+    """Return the eTLD+1 of a cookie domain such as '.example.com'."""
+    if not domain:
+        return None
+    return publicsuffix2.get_sld(domain.lstrip("."))
+
+def dump_extra(obj, keys):
+    """Return the fields of `obj` not in `keys` as JSON, or None if there are none."""
+    extra = {key: value for key, value in obj.items() if key not in keys}
+    if not extra:
+        return None
+    return json.dumps(extra)
+
+def load_extra(obj, extra):
+    """Merge the JSON encoded `extra` fields back into `obj`."""
+    if extra:
+        obj.update(json.loads(extra))
+    return obj
+
+def drop_missing(obj, keys):
+    """Remove the optional `keys` that were absent from the original JSON."""
+    for key in keys:
+        if obj[key] is None:
+            del obj[key]
+    return obj
+
+def get_file_stamp(file_name):
+    """Return the modification time and size used to detect changed files."""
+    return CrawlArchive.get_stamp(file_name)
+
+# The key of the `callStats` object; JSON strings cannot contain the unescaped quotes.
+CALL_STATS_RE = re.compile(rb'"callStats"\s*:\s*')
+
+def extract_call_stats(data):
+    """Return the `callStats` in the raw content of a tracker radar collector file, or None if it has none.
+
+    Only the `callStats` object is decoded, not the requests and calls around it.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    match = CALL_STATS_RE.search(data)
+    if match is None:
+        return None
+    try:
+        call_stats, _ = json.JSONDecoder().raw_decode(data[match.end():].decode("utf-8"))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return call_stats
+
+def is_collector_output(json_data):
+    """Return True if the JSON data was written by the tracker radar collector."""
+    return "data" in json_data and "initialUrl" in json_data
+
+class CrawlStore():
+    def __init__(self, path):
+        """CrawlStore keeps decoded crawl files in a SQLite database at `path`."""
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _get_page(self, file_name, stamp=None, connection=None):
+        """Return (id, format) of the stored page if it is up to date with the file."""
+        source = os.path.realpath(file_name)
+        mtime, size = stamp or get_file_stamp(file_name)
+        row = (connection or self._connection).execute("SELECT id, format, mtime, size FROM pages WHERE source = ?", (source,)).fetchone()
+        if row is None or row[2] != mtime or row[3] != size:
+            return None
+        return row[0], row[1]
+
+    def is_ingested(self, file_name):
+        """Return True if the store holds an up to date copy of the given file."""
+        return self._get_page(file_name) is not None
+
+    def ingest(self, file_name, json_data=None, data=None):
+        """Store the given crawl file, decoding it first unless `json_data` is given.
+
+        `data` may hold the already decompressed content of the file.
+        """
+        if json_data is None:
+            json_data = json.loads(data if data is not None else CrawlArchive.read_crawl_file(file_name))
+        source = os.path.realpath(file_name)
+        mtime, size = get_file_stamp(file_name)
+        with self._connection:
+            self._delete_page(source)
+            if is_collector_output(json_data):
+                self._insert_collector_page(source, mtime, size, json_data)
+            else:
+                self._insert_interceptor_page(source, mtime, size, json_data)
+        return json_data
+
+    def ingest_directory(self, directory):
+        """Store every crawl file below the given directory and return how many were added."""
+        ingested = 0
+        for path, _, _ in os.walk(directory):
+            for entry in self.read_ahead(path):
+                if os.path.basename(entry.name) == "metadata.json" or entry.data is None and entry.error is None:
+                    continue
+                try:
+                    self.load_entry(entry)
+                except (OSError, ValueError, KeyError, TypeError, AttributeError):
+                    print("Error: Could not ingest", entry.name, file=sys.stderr)
+                    continue
+                ingested += 1
+        return ingested
+
+    def read_ahead(self, directory, depth=CrawlArchive.READ_AHEAD, select=None):
+        """Yield the crawl files of the given directory as CrawlArchive entries.
+
+        Files that are not in the store yet are read and decompressed ahead on
+        a background thread; pass the entries to `load_entry`. If given, only
+        files for which `select(file_name)` returns True are yielded.
+        """
+        # The background thread checks the store through a connection of its own.
+        connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        def wanted(entry):
+            return self._get_page(entry.name, entry.stamp, connection) is None
+        entries = CrawlArchive.iter_entries(directory)
+        if select is not None:
+            entries = (entry for entry in entries if select(entry.name))
+        try:
+            yield from CrawlArchive.read_ahead(entries, wanted, depth)
+        finally:
+            connection.close()
+
+    def watch(self, directory, select=None, **kwargs):
+        """Yield batches of complete crawl files as they appear in `directory` (see CrawlWatcher.watch).
+
+        Files already in the store are not read again; pass the entries to
+        `load_entry`. If given, only files for which `select(file_name)`
+        returns True are yielded.
+        """
+        def wanted(entry):
+            if select is not None and not select(entry.name):
+                return False
+            return self._get_page(entry.name, entry.stamp) is None
+        for batch in CrawlWatcher.watch(directory, wanted, **kwargs):
+            if select is not None:
+                batch = [entry for entry in batch if select(entry.name)]
+            if batch:
+                yield batch
+
+    def load(self, file_name):
+        """Return the content of the given crawl file, from the store when possible.
+
+        Files that are not yet in the store (or changed since) are decoded
+        and ingested so that the next run can skip the JSON decoding.
+        """
+        page = self._get_page(file_name)
+        if page is None:
+            return self.ingest(file_name)
+        page_id, format = page
+        if format == "collector":
+            return self._load_collector_page(page_id)
+        return self._load_interceptor_page(page_id)
+
+    def load_entry(self, entry):
+        """Like `load`, for an entry yielded by `read_ahead` or `watch`."""
+        if entry.error is not None:
+            raise entry.error
+        if entry.json_data is not None and self._get_page(entry.name, entry.stamp) is None:
+            return self.ingest(entry.name, json_data=entry.json_data)
+        if entry.data is not None and self._get_page(entry.name, entry.stamp) is None:
+            return self.ingest(entry.name, data=entry.data)
+        return self.load(entry.name)
+
+    def load_call_stats(self, file_name):
+        """Return only the `callStats` of a tracker radar collector file."""
+        page = self._get_page(file_name)
+        if page is None:
+            return self.ingest(file_name)["data"]["apis"]["callStats"]
+        return self._load_call_stats(page[0])
+
+    def peek_call_stats(self, entry):
+        """Return the `callStats` of a collector file yielded by `read_ahead`.
+
+        Files that are not in the store are not decoded (nor ingested) beyond
+        their `callStats`, so that only the files of interest need to be
+        passed to `load_entry` afterwards.
+        """
+        if entry.error is not None:
+            raise entry.error
+        if entry.json_data is not None:
+            return entry.json_data["data"]["apis"]["callStats"]
+        if entry.data is not None and self._get_page(entry.name, entry.stamp) is None:
+            call_stats = extract_call_stats(entry.data)
+            if call_stats is not None:
+                return call_stats
+            return self.load_entry(entry)["data"]["apis"]["callStats"]
+        return self.load_call_stats(entry.name)
+
+    def load_url(self, file_name):
+        """Return the page URL (`url` or `initialUrl`) of the given crawl file."""
+        page = self._get_page(file_name)
+        if page is None:
+            json_data = self.ingest(file_name)
+            return json_data["initialUrl"] if is_collector_output(json_data) else json_data.get("url")
+        return self._connection.execute("SELECT url FROM pages WHERE id = ?", (page[0],)).fetchone()[0]
+
+    def load_initiators(self, file_name):
+        """Return the URL and initiators of every request of a tracker radar collector file."""
+        page = self._get_page(file_name)
+        if page is None:
+            return self.ingest(file_name)["data"]["requests"]
+        requests = dict()
+        for request_id, url in self._connection.execute(
+                "SELECT id, url FROM requests WHERE page_id = ? ORDER BY seq", (page[0],)):
+            requests[request_id] = {"url": url, "initiators": []}
+        for request_id, initiator in self._connection.execute(
+                "SELECT i.request_id, i.initiator FROM initiators i JOIN requests r ON r.id = i.request_id WHERE r.page_id = ? ORDER BY i.request_id, i.seq",
+                (page[0],)):
+            requests[request_id]["initiators"].append(initiator)
+        return list(requests.values())
+
+    def _delete_page(self, source):
+        row = self._connection.execute("SELECT id FROM pages WHERE source = ?", (source,)).fetchone()
+        if row is None:
+            return
+        page_id = row[0]
+        request_ids = "SELECT id FROM requests WHERE page_id = ?"
+        self._connection.execute("DELETE FROM headers WHERE request_id IN ("+request_ids+")", (page_id,))
+        self._connection.execute("DELETE FROM initiators WHERE request_id IN ("+request_ids+")", (page_id,))
+        self._connection.execute("DELETE FROM requests WHERE page_id = ?", (page_id,))
+        self._connection.execute("DELETE FROM cookies WHERE page_id = ?", (page_id,))
+        self._connection.execute("DELETE FROM api_calls WHERE page_id = ?", (page_id,))
+        self._connection.execute("DELETE FROM pages WHERE id = ?", (page_id,))
+
+    def _insert_page(self, source, mtime, size, format, url, has_cookies, extra):
+        cursor = self._connection.execute(
+            "INSERT INTO pages (source, mtime, size, format, url, etld1, has_cookies, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (source, mtime, size, format, url, get_etld1(url) if url else None, has_cookies, extra))
+        return cursor.lastrowid
+
+    def _insert_headers(self, request_id, direction, headers):
+        if not headers or not isinstance(headers, dict):
+            return
+        self._connection.executemany(
+            "INSERT INTO headers (request_id, direction, name, value) VALUES (?, ?, ?, ?)",
+            [(request_id, direction, name, value) for name, value in headers.items()])
+
+    def _insert_cookies(self, page_id, cookies):
+        self._connection.executemany(
+            "INSERT INTO cookies (page_id, seq, name, value, domain, etld1, extra) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(page_id, seq, cookie.get("name"), cookie.get("value"), cookie.get("domain"),
+              get_cookie_etld1(cookie.get("domain")), dump_extra(cookie, COOKIE_KEYS))
+             for seq, cookie in enumerate(cookies)])
+
+    def _insert_interceptor_page(self, source, mtime, size, json_data):
+        page_id = self._insert_page(source, mtime, size, "interceptor", json_data.get("url"),
+                                    "cookies" in json_data, dump_extra(json_data, ["url", "requests", "cookies"]))
+        for seq, req in enumerate(json_data.get("requests", [])):
+            request_context = None
+            if req.get("requestContext") is not None:
+                request_context = CONTEXT_SEPARATOR.join(req["requestContext"])
+            cursor = self._connection.execute(
+                "INSERT INTO requests (page_id, seq, external_id, url, etld1, type, method, status, post_data, request_context, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (page_id, seq, req.get("id"), req.get("url"), get_etld1(req.get("url", "")), req.get("type"), req.get("method"),
+                 req.get("status"), req.get("postData"), request_context, dump_extra(req, INTERCEPTOR_REQUEST_KEYS)))
+            self._insert_headers(cursor.lastrowid, "request", req.get("headers"))
+            self._insert_headers(cursor.lastrowid, "response", req.get("responseHeaders"))
+        if "cookies" in json_data:
+            self._insert_cookies(page_id, json_data["cookies"])
+
+    def _insert_collector_page(self, source, mtime, size, json_data):
+        data = json_data["data"]
+        page_extra = {key: value for key, value in json_data.items() if key != "data"}
+        page_extra["data"] = {key: value for key, value in data.items() if key not in ["requests", "cookies", "apis"]}
+        if "apis" in data:
+            page_extra["data"]["apis"] = {key: value for key, value in data["apis"].items() if key != "callStats"}
+        page_id = self._insert_page(source, mtime, size, "collector", json_data.get("initialUrl"),
+                                    "cookies" in data, json.dumps(page_extra))
+        for seq, req in enumerate(data.get("requests", [])):
+            cursor = self._connection.execute(
+                "INSERT INTO requests (page_id, seq, url, etld1, type, method, status, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (page_id, seq, req.get("url"), get_etld1(req.get("url", "")), req.get("type"), req.get("method"),
+                 req.get("status"), dump_extra(req, COLLECTOR_REQUEST_KEYS)))
+            request_id = cursor.lastrowid
+            self._insert_headers(request_id, "response", req.get("responseHeaders"))
+            self._connection.executemany(
+                "INSERT INTO initiators (request_id, seq, initiator) VALUES (?, ?, ?)",
+                [(request_id, i, initiator) for i, initiator in enumerate(req.get("initiators", []))])
+        if "cookies" in data:
+            self._insert_cookies(page_id, data["cookies"])
+        if "apis" in data and "callStats" in data["apis"]:
+            rows = list()
+            for script, calls in data["apis"]["callStats"].items():
+                for api, count in calls.items():
+                    rows.append((page_id, script, api, count))
+            self._connection.executemany("INSERT INTO api_calls (page_id, script, api, count) VALUES (?, ?, ?, ?)", rows)
+
+    def _load_headers(self, page_id):
+        """Return {request_id: {direction: {name: value}}} for all requests of a page."""
+        headers = dict()
+        for request_id, direction, name, value in self._connection.execute(
+                "SELECT h.request_id, h.direction, h.name, h.value FROM headers h JOIN requests r ON r.id = h.request_id WHERE r.page_id = ?",
+                (page_id,)):
+            headers.setdefault(request_id, {"request": {}, "response": {}})[direction][name] = value
+        return headers
+
+    def _load_cookies(self, page_id):
+        cookies = list()
+        for name, value, domain, extra in self._connection.execute(
+                "SELECT name, value, domain, extra FROM cookies WHERE page_id = ? ORDER BY seq", (page_id,)):
+            cookies.append(load_extra({"name": name, "value": value, "domain": domain}, extra))
+        return cookies
+
+    def _load_call_stats(self, page_id):
+        call_stats = dict()
+        for script, api, count in self._connection.execute(
+                "SELECT script, api, count FROM api_calls WHERE page_id = ? ORDER BY rowid", (page_id,)):
+            call_stats.setdefault(script, dict())[api] = count
+        return call_stats
+
+    def _load_interceptor_page(self, page_id):
+        url, has_cookies, extra = self._connection.execute("SELECT url, has_cookies, extra FROM pages WHERE id = ?", (page_id,)).fetchone()
+        json_data = load_extra({"url": url} if url is not None else {}, extra)
+        headers = self._load_headers(page_id)
+        requests = list()
+        for request_id, external_id, url, type, method, status, post_data, request_context, extra in self._connection.execute(
+                "SELECT id, external_id, url, type, method, status, post_data, request_context, extra FROM requests WHERE page_id = ? ORDER BY seq",
+                (page_id,)):
+            request_headers = headers.get(request_id, {"request": {}, "response": {}})
+            req = {
+                "requestContext": request_context.split(CONTEXT_SEPARATOR) if request_context else [],
+                "id": external_id,
+                "url": url,
+                "type": type,
+                "status": status,
+                "method": method,
+                "headers": request_headers["request"],
+                "postData": post_data,
+                "responseHeaders": request_headers["response"]
+            }
+            requests.append(load_extra(drop_missing(req, ["id", "status", "method", "postData"]), extra))
+        json_data["requests"] = requests
+        if has_cookies:
+            json_data["cookies"] = self._load_cookies(page_id)
+        return json_data
+
+    def _load_collector_page(self, page_id):
+        has_cookies, extra = self._connection.execute("SELECT has_cookies, extra FROM pages WHERE id = ?", (page_id,)).fetchone()
+        json_data = json.loads(extra)
+        data = json_data["data"]
+        headers = self._load_headers(page_id)
+        initiators = dict()
+        for request_id, initiator in self._connection.execute(
+                "SELECT i.request_id, i.initiator FROM initiators i JOIN requests r ON r.id = i.request_id WHERE r.page_id = ? ORDER BY i.request_id, i.seq",
+                (page_id,)):
+            initiators.setdefault(request_id, list()).append(initiator)
+        requests = list()
+        for request_id, url, type, method, status, extra in self._connection.execute(
+                "SELECT id, url, type, method, status, extra FROM requests WHERE page_id = ? ORDER BY seq", (page_id,)):
+            req = {
+                "url": url,
+                "method": method,
+                "type": type,
+                "status": status,
+                "initiators": initiators.get(request_id, []),
+                "responseHeaders": headers.get(request_id, {"response": {}})["response"]
+            }
+            requests.append(load_extra(drop_missing(req, ["method", "status"]), extra))
+        data["requests"] = requests
+        if has_cookies:
+            data["cookies"] = self._load_cookies(page_id)
+        data.setdefault("apis", dict())["callStats"] = self._load_call_stats(page_id)
+        return json_data
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: {} <STORE> <DIRECTORY> [<DIRECTORY> ...]".format(sys.argv[0]), file=sys.stderr)
+        sys.exit(1)
+    with CrawlStore(sys.argv[1]) as store:
+        for directory in sys.argv[2:]:
+            print("Ingested", store.ingest_directory(directory), "file(s) from", directory, file=sys.stderr)
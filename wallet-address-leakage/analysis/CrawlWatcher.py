@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Watches a crawl destination directory while the crawler is still writing to
+ it. The directory is polled for new or changed crawl files, and a file is
+ only handed on once it is complete: its size and modification time have not
+ changed for a while and its content decodes as JSON. Files caught in the
+ middle of a write are retried on a later poll.
+"""
+
+import os
+import json
+import time
+import zipfile
+import CrawlArchive
+
+# Seconds between two scans of the watched directory.
+WATCH_INTERVAL = 5.0
+
+# Seconds a file must remain unchanged before it is read.
+SETTLE_TIME = 2.0
+
+# Seconds after which an unchanged file that does not decode is handed on
+# as it is (e.g. left behind by a crawler that was killed).
+INCOMPLETE_TIMEOUT = 600.0
+
+def decode(entry):
+    """Read and decode the given entry; return None if it is (still) incomplete."""
+    try:
+        return json.loads(entry.read())
+    except (OSError, EOFError, ValueError, zipfile.BadZipFile):
+        return None
+
+def watch(directory, wanted=None, interval=WATCH_INTERVAL, settle=SETTLE_TIME, idle_timeout=None):
+    """Yield lists of new or changed complete crawl files of `directory` as CrawlArchive entries.
+
+    The first list holds the files that are already complete. Entries for
+    which `wanted(entry)` returns False are passed on without being read;
+    the others carry their decoded content in `json_data` (None if the file
+    never became valid JSON within INCOMPLETE_TIMEOUT). Watching ends
+    once no file has been added or changed for `idle_timeout` seconds (if
+    given), or on KeyboardInterrupt.
+    """
+    done = dict()
+    pending = dict()
+    last_change = time.time()
+    try:
+        while True:
+            now = time.time()
+            batch = list()
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if not CrawlArchive.is_crawl_file(name) or not os.path.isfile(path):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                if done.get(path) == stamp:
+                    continue
+                if pending.get(path) != stamp:
+                    # New or still growing: look again on the next scan.
+                    pending[path] = stamp
+                    last_change = now
+                    if stat.st_mtime > now - settle:
+                        continue
+                entry = CrawlArchive.CrawlEntry(path, stamp, lambda path=path: open(path, "rb"))
+                if wanted is None or wanted(entry):
+                    entry.json_data = decode(entry)
+                    if entry.json_data is None and stat.st_mtime > now - INCOMPLETE_TIMEOUT:
+                        continue
+                done[path] = stamp
+                del pending[path]
+                batch.append(entry)
+            if batch:
+                yield batch
+            if idle_timeout is not None and time.time() - last_change >= idle_timeout and not pending:
+                return
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        return
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Bipartite index of the third-party domains embedded by the crawled sites.
+ Sites and third parties get integer IDs, every (site, third party) edge is
+ stored once no matter how many requests produced it, and the degree of every
+ node is kept up to date, so that popularity and reach queries are answered
+ in time linear in the number of edges, and co-occurrences in time linear in
+ the number of co-embedded pairs. networkx is only needed to plot the graph.
+"""
+
+import collections
+
+class DependencyGraph():
+    def __init__(self):
+        """DependencyGraph maps sites to the third-party domains they embed and vice versa."""
+        self.site_ids = dict()
+        self.sites = list()
+        self.third_party_ids = dict()
+        self.third_parties = list()
+        # Adjacency sets, indexed by site ID and by third-party ID.
+        self.embeds = list()
+        self.embedded_by = list()
+        self.edges = 0
+
+    def add_site(self, site):
+        """Add the site (if new) and return its ID."""
+        if not site in self.site_ids:
+            self.site_ids[site] = len(self.sites)
+            self.sites.append(site)
+            self.embeds.append(set())
+        return self.site_ids[site]
+
+    def add_third_party(self, third_party):
+        """Add the third-party domain (if new) and return its ID."""
+        if not third_party in self.third_party_ids:
+            self.third_party_ids[third_party] = len(self.third_parties)
+            self.third_parties.append(third_party)
+            self.embedded_by.append(set())
+        return self.third_party_ids[third_party]
+
+    def add_edge(self, site, third_party):
+        """Record that `site` embeds `third_party`. Repeated edges are ignored."""
+        site_id = self.add_site(site)
+        third_party_id = self.add_third_party(third_party)
+        if not third_party_id in self.embeds[site_id]:
+            self.embeds[site_id].add(third_party_id)
+            self.embedded_by[third_party_id].add(site_id)
+            self.edges += 1
+
+    def __len__(self):
+        return self.edges
+
+    def degree(self, third_party):
+        """Return the number of sites that embed the given third party."""
+        third_party_id = self.third_party_ids.get(third_party)
+        return 0 if third_party_id is None else len(self.embedded_by[third_party_id])
+
+    def popularity(self):
+        """Return [(third_party, number of sites)] sorted by decreasing popularity."""
+        return sorted([(third_party, len(self.embedded_by[third_party_id])) for third_party_id, third_party in enumerate(self.third_parties)],
+                      key=lambda item: (-item[1], item[0]))
+
+    def reach(self, matches=None):
+        """Return the number of sites that embed at least one third party.
+
+        If given, only third parties for which `matches(third_party)` returns
+        True are counted.
+        """
+        if matches is None:
+            return len([third_party_ids for third_party_ids in self.embeds if third_party_ids])
+        site_ids = set()
+        for third_party_id, third_party in enumerate(self.third_parties):
+            if matches(third_party):
+                site_ids.update(self.embedded_by[third_party_id])
+        return len(site_ids)
+
+    def co_occurrence(self, top=None):
+        """Return [((third_party, third_party), number of sites)] for pairs embedded together.
+
+        Pairs are sorted by decreasing count; only the `top` most frequent
+        pairs are returned if `top` is given.
+        """
+        pairs = collections.Counter()
+        for third_party_ids in self.embeds:
+            third_party_ids = sorted(third_party_ids)
+            for i, first in enumerate(third_party_ids):
+                for second in third_party_ids[i + 1:]:
+                    pairs[(first, second)] += 1
+        return [((self.third_parties[first], self.third_parties[second]), count) for (first, second), count in pairs.most_common(top)]
+
+    def iter_edges(self):
+        """Yield every (site, third_party) edge once."""
+        for site_id, third_party_ids in enumerate(self.embeds):
+            for third_party_id in third_party_ids:
+                yield self.sites[site_id], self.third_parties[third_party_id]
+
+    def to_networkx(self):
+        """Return the graph as a networkx DiGraph, with the `bipartite` node attribute set to 0 for sites and 1 for third parties."""
+        import networkx as nx
+        G = nx.DiGraph()
+        G.add_nodes_from(self.sites, bipartite=0)
+        G.add_nodes_from([third_party for third_party in self.third_parties if not third_party in self.site_ids], bipartite=1)
+        G.add_edges_from(self.iter_edges())
+        return G
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ First/third-party classification of the requests of a crawled page. The
+ request interceptor records the frame ancestry (`requestContext`) of every
+ request, and the same few chains repeat for thousands of requests of a page.
+ FrameContextIndex resolves the eTLD+1 of every distinct URL and chain of a
+ page once, and the party classification of (domain, origin) pairs is cached
+ across pages.
+"""
+
+import functools
+import publicsuffix2
+
+from urllib.parse import urlparse
+
+@functools.lru_cache(maxsize=1 << 16)
+def get_host_etld1(host):
+    """Return the eTLD+1 of the given host name."""
+    return publicsuffix2.get_sld(host)
+
+def get_etld1(url, strip_port=True):
+    """Return the given URL's eTLD+1."""
+    fqdn = urlparse(url).netloc
+    if strip_port:
+        fqdn = fqdn.split(":")[0]
+    return get_host_etld1(fqdn)
+
+@functools.lru_cache(maxsize=1 << 16)
+def are_unrelated(domain, origin):
+    """Return True if the two given domains are likely independent."""
+    if domain != None and "." in domain:
+        if origin.split('.')[-2] in domain.split('.')[-2]:
+            return False
+    return domain != origin
+
+class FrameContextIndex():
+    def __init__(self, origin, strip_port=True):
+        """FrameContextIndex classifies the requests of the page of `origin` (an eTLD+1).
+
+        `strip_port` selects whether the port is removed from a URL's host
+        before its eTLD+1 is looked up.
+        """
+        self.origin = origin
+        self.strip_port = strip_port
+        self._etld1 = dict()
+        self._same_context = dict()
+        self._mentions = dict()
+
+    def etld1(self, url):
+        """Return the eTLD+1 of the given URL."""
+        if not url in self._etld1:
+            self._etld1[url] = get_etld1(url, self.strip_port)
+        return self._etld1[url]
+
+    def is_same_request_context(self, request_context):
+        """Return True if every frame of the request context belongs to the origin."""
+        chain = tuple(request_context)
+        if not chain in self._same_context:
+            self._same_context[chain] = all([self.etld1(url) == self.origin for url in chain])
+        return self._same_context[chain]
+
+    def mentions(self, request_context, text):
+        """Return True if any frame URL of the request context contains `text`."""
+        key = (tuple(request_context), text)
+        if not key in self._mentions:
+            self._mentions[key] = any([text in url for url in request_context])
+        return self._mentions[key]
+
+    def is_third_party(self, domain):
+        """Return True if the given domain is likely independent of the origin."""
+        return are_unrelated(domain, self.origin)
@@ -741,10 +741,10 @@ class LeakDetector():
         if substring_search:
             # print('input_string', input_string)
             substr_results = self.substring_search(input_string, max_layers=2)
-            # filter repeating results
-            return list(set(results + substr_results))
+            # filter repeating results; sorted, as the order of sets differs between processes
+            return sorted(set(results + substr_results))
         else:
-            return results
+            return sorted(results)
 
     def substring_search(self, input_string, max_layers=None, prev_encodings=tuple()):
         """Do a substring search for all precomputed hashes/encodings
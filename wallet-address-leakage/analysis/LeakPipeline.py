@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ The leak analysis of a single crawled page, shared by the DApp, Winter et al.
+ and wallet extension studies. A LeakPipeline runs every request of a page
+ through the same stages:
+
+   page       set up the page: origin, search terms and leak label
+   relevant   drop requests that are irrelevant to the study
+   classify   find the request's domain and whether it is a third party
+   detection  check the channels (GET, POST/WebSocket, Referer, Cookies) of
+              third-party requests and the page's third-party cookies
+   attribute  name the encoding of a detected leak
+   record     store the leak (and write it to the ResultSink, if any)
+
+ The defaults implement the website studies; a study replaces the stages in
+ which it differs. Detectors are built once per set of search terms and
+ shared by all pages.
+"""
+
+import threading
+import LeakDetector
+import FrameContext
+import PayloadStore
+import AnalysisLog
+
+MAX_LEAK_DETECTION_LAYERS = 3
+
+# Channels checked in every third-party request; "POST" includes WebSocket frames.
+REQUEST_CHANNELS = ("GET", "POST", "Referer", "Cookies")
+
+colors = AnalysisLog.colors
+log = AnalysisLog.log
+
+# Detectors are expensive to build (they precompute all encodings and hashes
+# of the search terms) and are therefore shared by all pages.
+_detectors = dict()
+_detector_lock = threading.Lock()
+
+def get_detector(search_terms):
+    """Return the (cached) LeakDetector for the given search terms."""
+    search_terms = tuple(search_terms)
+    with _detector_lock:
+        if not search_terms in _detectors:
+            _detectors[search_terms] = LeakDetector.LeakDetector(
+                list(search_terms),
+                encoding_set=LeakDetector.LIKELY_ENCODINGS,
+                hash_set=LeakDetector.LIKELY_HASHES,
+                encoding_layers=MAX_LEAK_DETECTION_LAYERS,
+                hash_layers=MAX_LEAK_DETECTION_LAYERS,
+                debugging=False
+            )
+        return _detectors[search_terms]
+
+def get_address_terms(eth_address):
+    """Return the search terms for an Ethereum address (without "0x")."""
+    return [eth_address, eth_address.lower(), eth_address.upper()]
+
+def get_encoding(leaks_detected, eth_address):
+    """Return the encoding of the last detected leak that is not the plain address."""
+    encoding = ""
+    for leak in leaks_detected:
+        if leak[0].lower() != eth_address.lower():
+            encoding = leak[0]
+    return encoding
+
+class Page():
+    def __init__(self, json_data, url, origin, search_terms, label=None, strip_port=True):
+        """Page holds the state of the analysis of one crawl file.
+
+        `url` and `label` name the page in the leak records; the leaks are
+        stored under `label` (default: `origin`).
+        """
+        self.json_data = json_data
+        self.url = url
+        self.origin = origin
+        self.label = origin if label is None else label
+        self.search_terms = search_terms
+        self.frames = FrameContext.FrameContextIndex(origin, strip_port)
+        self.third_parties = set()
+        self.leaks = dict()
+        self.graph = None
+
+    def etld1(self, url):
+        return self.frames.etld1(url)
+
+def site_page(eth_address, strip_port=True):
+    """Return a page stage for crawled websites that are searched for `eth_address`."""
+    def page(json_data):
+        origin = FrameContext.get_etld1(json_data["url"], strip_port)
+        return Page(json_data, json_data["url"], origin, get_address_terms(eth_address), strip_port=strip_port)
+    return page
+
+def is_relevant_site_request(page, req):
+    """Keep the requests of the page's own frames, except those of extensions."""
+    if req["url"].startswith("chrome-extension://"):
+        return False
+    return page.frames.is_same_request_context(req.get("requestContext", []))
+
+def classify_site_request(page, req):
+    """Return the request's domain and whether it is a third party of the site."""
+    domain = page.etld1(req["url"])
+    if domain != page.origin and domain != None:
+        page.third_parties.add(domain)
+        if page.graph is not None:
+            page.graph.add_edge(page.origin, domain)
+    return domain, page.frames.is_third_party(domain)
+
+def attribute_address_leak(page, leaks_detected):
+    return get_encoding(leaks_detected, page.search_terms[0])
+
+class LeakPipeline():
+    def __init__(self, study, page, relevant=is_relevant_site_request, classify=classify_site_request,
+                 attribute=attribute_address_leak, channels=REQUEST_CHANNELS, match_plain=True,
+                 cookies_per_request=False, on_request=None):
+        """LeakPipeline finds the leaks of the crawl files of one study.
+
+        `study` is the first field of the leak records and the stages are
+        called as `page(json_data)`, `relevant(page, req)`, `classify(page,
+        req)`, `attribute(page, leaks_detected)` and, for every relevant
+        request, `on_request(page, req, domain, third_party)`. With
+        `match_plain`, a value that contains a search term (in any case) is a
+        leak even if the detector does not find it. With
+        `cookies_per_request`, the page's cookies are checked after every
+        relevant request instead of once, as the DApp analysis always did.
+        """
+        self.study = study
+        self.page = page
+        self.relevant = relevant
+        self.classify = classify
+        self.attribute = attribute
+        self.channels = channels
+        self.match_plain = match_plain
+        self.cookies_per_request = cookies_per_request
+        self.on_request = on_request
+
+    def detect(self, page, check, text):
+        """Return the leaks of `text` found by the detector method `check`, or None."""
+        leaks_detected = check(text, encoding_layers=MAX_LEAK_DETECTION_LAYERS)
+        if len(leaks_detected) > 0:
+            return leaks_detected
+        if self.match_plain:
+            lowered = text.lower()
+            for term in page.search_terms:
+                if term.lower() in lowered:
+                    return leaks_detected
+        return None
+
+    def record(self, page, payloads, sink, category, domain, channel, url, payload, leaks_detected):
+        encoding = self.attribute(page, leaks_detected)
+        if AnalysisLog.is_tracing():
+            AnalysisLog.trace("Found leak (%s): %s %s", channel, url, encoding, event="leak", color=colors.OK, origin=page.origin, third_party=domain, channel=channel, url=url, encoding=encoding)
+        PayloadStore.add_leak(page.leaks, page.label, channel, domain, payloads, payload, encoding)
+        if sink:
+            sink.write((self.study, category, page.url, page.label, domain, url, channel, encoding, payload))
+
+    def check_request(self, page, req, domain, payloads, sink, category):
+        detector = get_detector(page.search_terms)
+        url = req["url"]
+
+        # Get
+        if "GET" in self.channels:
+            leaks_detected = self.detect(page, detector.check_url, url)
+            if leaks_detected is not None:
+                self.record(page, payloads, sink, category, domain, "GET", url, url, leaks_detected)
+
+        # Post & WebSockets
+        if "POST" in self.channels and req.get("postData"):
+            leaks_detected = self.detect(page, detector.check_post_data, req["postData"])
+            if leaks_detected is not None:
+                type = "WebSocket" if req.get("type") == "WebSocket" else "POST"
+                self.record(page, payloads, sink, category, domain, type, url, req["postData"], leaks_detected)
+
+        # Referer
+        if "Referer" in self.channels and "headers" in req and "referer" in req["headers"] and req["headers"]["referer"]:
+            leaks_detected = self.detect(page, detector.check_referrer_str, req["headers"]["referer"])
+            if leaks_detected is not None:
+                self.record(page, payloads, sink, category, domain, "Referer", url, req["headers"]["referer"], leaks_detected)
+
+        # Cookies
+        if "Cookies" in self.channels and "responseHeaders" in req and req["responseHeaders"] and "set-cookie" in req["responseHeaders"] and req["responseHeaders"]["set-cookie"]:
+            leaks_detected = self.detect(page, detector.check_cookie_str, req["responseHeaders"]["set-cookie"])
+            if leaks_detected is not None:
+                self.record(page, payloads, sink, category, domain, "Cookies", url, req["responseHeaders"]["set-cookie"], leaks_detected)
+
+    def check_cookies(self, page, payloads, sink, category, cookies=None):
+        """Check the given cookies, by default those of the page's crawl file."""
+        if cookies is None:
+            cookies = page.json_data.get("cookies")
+        if not cookies:
+            return
+        detector = get_detector(page.search_terms)
+        for cookie in cookies:
+            if page.frames.is_third_party(cookie["domain"]):
+                for text in (cookie["value"], cookie["name"]):
+                    leaks_detected = self.detect(page, detector.check_cookie_str, text)
+                    if leaks_detected is not None:
+                        self.record(page, payloads, sink, category, cookie["domain"], "Cookies", "", text, leaks_detected)
+
+    def run(self, json_data, payloads, sink=None, category="", graph=None):
+        """Analyse the content of one crawl file and return its Page.
+
+        The leaks are stored in `page.leaks` with their payloads in
+        `payloads` (a PayloadStore) and written to `sink` if given. The
+        site's third parties are added to `graph` (a DependencyGraph) if given.
+        """
+        page = self.page(json_data)
+        page.graph = graph
+
+        log("Analyzing requests for origin: %s", page.origin, event="origin", origin=page.origin)
+
+        if len(page.search_terms) == 0:
+            return page
+
+        for req in json_data["requests"]:
+            if not self.relevant(page, req):
+                continue
+            domain, third_party = self.classify(page, req)
+            if self.on_request:
+                self.on_request(page, req, domain, third_party)
+            if third_party:
+                self.check_request(page, req, domain, payloads, sink, category)
+            if self.cookies_per_request:
+                self.check_cookies(page, payloads, sink, category)
+
+        if not self.cookies_per_request:
+            self.check_cookies(page, payloads, sink, category)
+
+        if AnalysisLog.is_tracing():
+            AnalysisLog.trace("Third-parties: %s", list(page.third_parties), event="third_parties", origin=page.origin, third_parties=list(page.third_parties))
+        log("Found %s third-party script(s).", len(page.third_parties), event="scripts", origin=page.origin, third_parties=len(page.third_parties))
+
+        return page
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Live leak detection for request events streamed by the request interceptor
+ while it crawls a site. Messages are JSON objects, one per line, read from
+ stdin or from the connections of a Unix socket:
+
+   {"event": "site", "url": ..., "address": ...}     start a site (address optional)
+   {"event": "request", "id": ..., "url": ..., ...}  a request as stored in the crawl JSON
+   {"event": "response", "id": ..., "responseHeaders": {...}}
+   {"event": "cookies", "cookies": [...]}
+   {"event": "end"}                                  finish the site
+
+ Every message that reveals a leak is answered with a "verdict" line, and
+ "end" with a "summary" line. Each message goes through the stages of the
+ DApp analysis (see LeakPipeline), with the detector for an address built
+ only once.
+"""
+
+import os
+import sys
+import json
+import time
+import socketserver
+import LeakPipeline
+import PayloadStore
+import AnalysisLog
+
+MAX_LEAK_DETECTION_LAYERS = LeakPipeline.MAX_LEAK_DETECTION_LAYERS
+
+log = AnalysisLog.log
+
+def get_detector(eth_address):
+    """Return the LeakDetector for the given Ethereum address, shared with the batch analyses."""
+    return LeakPipeline.get_detector(LeakPipeline.get_address_terms(eth_address))
+
+class VerdictSink():
+    def __init__(self):
+        """VerdictSink collects the leak records of a LeakPipeline as verdict dicts."""
+        self.verdicts = list()
+
+    def write(self, record):
+        _, _, _, _, domain, url, channel, encoding, _ = record
+        self.verdicts.append({"channel": channel, "third_party": domain, "url": url, "encoding": encoding})
+
+class LeakSession():
+    def __init__(self, url, eth_address, stop_after=None):
+        """LeakSession checks the requests of one crawled site for leaks of `eth_address`.
+
+        The stages of the DApp analysis are applied to every message. Once
+        `stop_after` leaks have been found, verdicts ask the crawler to stop.
+        """
+        self.url = url
+        self.eth_address = eth_address
+        self.stop_after = stop_after
+        self.pipeline = LeakPipeline.LeakPipeline("live", LeakPipeline.site_page(eth_address), on_request=self._on_request)
+        # Responses are only checked for the cookies they set.
+        self.response_pipeline = LeakPipeline.LeakPipeline("live", self.pipeline.page, channels=("Cookies",))
+        self.page = self.pipeline.page({"url": url})
+        self.origin = self.page.origin
+        self.third_parties = self.page.third_parties
+        self.payloads = PayloadStore.PayloadStore()
+        # Third-party domains of the relevant requests, by request ID, for their responses.
+        self.domains = dict()
+        self.requests = 0
+        self.leaks = 0
+        self.seconds = 0.0
+
+    def is_leaky(self):
+        return self.leaks > 0
+
+    def should_stop(self):
+        return self.stop_after is not None and self.leaks >= self.stop_after
+
+    def _on_request(self, page, req, domain, third_party):
+        if third_party and "id" in req:
+            self.domains[req["id"]] = (domain, req["url"])
+
+    def check_request(self, req):
+        """Return the leaks (as verdict dicts) of a single request."""
+        sink = VerdictSink()
+        if not self.pipeline.relevant(self.page, req):
+            return sink.verdicts
+        domain, third_party = self.pipeline.classify(self.page, req)
+        self.pipeline.on_request(self.page, req, domain, third_party)
+        if third_party:
+            self.pipeline.check_request(self.page, req, domain, self.payloads, sink, "")
+        return sink.verdicts
+
+    def check_response(self, response):
+        """Return the leaks in the Set-Cookie header of the response to an earlier request."""
+        sink = VerdictSink()
+        if response.get("id") in self.domains:
+            domain, url = self.domains[response["id"]]
+            req = {"url": url, "responseHeaders": response.get("responseHeaders")}
+            self.response_pipeline.check_request(self.page, req, domain, self.payloads, sink, "")
+        return sink.verdicts
+
+    def check_cookies(self, cookies):
+        """Return the leaks in the names and values of third-party cookies."""
+        sink = VerdictSink()
+        self.pipeline.check_cookies(self.page, self.payloads, sink, "", cookies)
+        return sink.verdicts
+
+    def summary(self):
+        return {
+            "event": "summary",
+            "url": self.url,
+            "origin": self.origin,
+            "requests": self.requests,
+            "leaks": self.leaks,
+            "leaky": self.is_leaky(),
+            "third_parties": sorted(self.third_parties),
+            "seconds": self.seconds
+        }
+
+class LeakService():
+    def __init__(self, eth_address, stop_after=None):
+        """LeakService answers the messages of one event stream.
+
+        `eth_address` is used for sites whose "site" message has no address.
+        """
+        self.eth_address = eth_address
+        self.stop_after = stop_after
+        self.session = None
+
+    def handle(self, message):
+        """Process a single message and return the list of messages to reply with."""
+        event = message.get("event")
+        if event == "site":
+            eth_address = (message.get("address") or self.eth_address).replace("0x", "")
+            self.session = LeakSession(message["url"], eth_address, self.stop_after)
+            log("Analyzing live requests for origin: %s", self.session.origin, event="origin", origin=self.session.origin)
+            return []
+        if self.session is None:
+            return [{"event": "error", "message": "Expected a 'site' message before '"+str(event)+"'."}]
+        session = self.session
+        if event == "end":
+            self.session = None
+            log("Found %s leak(s) in %s requests to %s third parties.", session.leaks, session.requests, len(session.third_parties), event="summary", origin=session.origin, leaks=session.leaks, requests=session.requests)
+            return [session.summary()]
+        start = time.perf_counter()
+        if event == "request":
+            session.requests += 1
+            verdicts = session.check_request(message)
+        elif event == "response":
+            verdicts = session.check_response(message)
+        elif event == "cookies":
+            verdicts = session.check_cookies(message.get("cookies", []))
+        else:
+            return [{"event": "error", "message": "Unknown event: "+str(event)}]
+        session.seconds += time.perf_counter() - start
+        if not verdicts:
+            return []
+        session.leaks += len(verdicts)
+        return [{"event": "verdict", "id": message.get("id"), "origin": session.origin, "leaks": verdicts, "leaky": True, "stop": session.should_stop()}]
+
+    def serve(self, lines, write):
+        """Answer every JSON line of `lines` by calling `write` with the reply lines."""
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line)
+                replies = self.handle(message)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                replies = [{"event": "error", "message": repr(e)}]
+            if replies:
+                write("".join([json.dumps(reply)+"\n" for reply in replies]))
+
+def serve_stdio(eth_address, stop_after=None):
+    """Read messages from stdin and write the replies to stdout."""
+    def write(text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+    LeakService(eth_address, stop_after).serve(sys.stdin, write)
+
+def serve_unix_socket(path, eth_address, stop_after=None):
+    """Accept connections on the Unix socket `path`, one event stream (and thread) per connection."""
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            def write(text):
+                self.wfile.write(text.encode("utf-8"))
+                self.wfile.flush()
+            LeakService(eth_address, stop_after).serve((line.decode("utf-8") for line in self.rfile), write)
+
+    if os.path.exists(path):
+        os.remove(path)
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+        server.daemon_threads = True
+        log("Listening on %s", path, event="listen", socket=path)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(path)
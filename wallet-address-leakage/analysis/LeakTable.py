@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Flat, typed table of leak records. Every record describes one leak of a DApp
+ (or wallet extension) to a third party via a channel (GET, POST, WebSocket,
+ Cookies, Referer) and the encoding it was detected under. String columns are
+ dictionary encoded into integer codes held in NumPy arrays so that counts,
+ distinct values and overlaps are computed by vectorized group-by operations.
+"""
+
+import numpy
+
+COLUMNS = ["dapp", "category", "third_party", "channel", "encoding"]
+
+CHANNELS = ["GET", "POST", "WebSocket", "Cookies"]
+
+# Encodings that do not count as an obfuscated leak.
+PLAIN_ENCODINGS = ["", "urlencode"]
+
+class LeakTable():
+    def __init__(self):
+        """LeakTable stores leak records column-wise as integer codes.
+
+        Records are appended to plain lists and converted to NumPy arrays the
+        first time the table is queried. Payloads (the leaking URL, POST body
+        or cookie string) are kept in a separate object column.
+        """
+        self._labels = {column: list() for column in COLUMNS}
+        self._codes = {column: dict() for column in COLUMNS}
+        self._pending = {column: list() for column in COLUMNS}
+        self._pending_payloads = list()
+        self._arrays = {column: numpy.zeros(0, dtype=numpy.int32) for column in COLUMNS}
+        self._payloads = numpy.zeros(0, dtype=object)
+
+    @classmethod
+    def from_leaks(cls, leaks, category=""):
+        """Build a table from the nested {dapp: {channel: {third_party: [(leak, encoding)]}}} dict."""
+        table = cls()
+        for dapp in leaks:
+            for channel in leaks[dapp]:
+                for third_party in leaks[dapp][channel]:
+                    for leak, encoding in leaks[dapp][channel][third_party]:
+                        table.append(dapp, category, third_party, channel, encoding, leak)
+        return table
+
+    @classmethod
+    def concat(cls, tables):
+        """Return a new table holding the records of all given tables."""
+        result = cls()
+        for table in tables:
+            table._flush()
+            for column in COLUMNS:
+                remap = numpy.asarray([result._encode(column, label) for label in table._labels[column]], dtype=numpy.int32)
+                codes = remap[table._arrays[column]] if len(remap) else table._arrays[column]
+                result._arrays[column] = numpy.concatenate((result._arrays[column], codes))
+            result._payloads = numpy.concatenate((result._payloads, table._payloads))
+        return result
+
+    def _encode(self, column, value):
+        codes = self._codes[column]
+        if value not in codes:
+            codes[value] = len(self._labels[column])
+            self._labels[column].append(value)
+        return codes[value]
+
+    def append(self, dapp, category, third_party, channel, encoding, payload=None):
+        """Add a single leak record."""
+        for column, value in zip(COLUMNS, (dapp, category, third_party, channel, encoding)):
+            self._pending[column].append(self._encode(column, value))
+        self._pending_payloads.append(payload)
+
+    def _flush(self):
+        if not self._pending_payloads:
+            return
+        for column in COLUMNS:
+            self._arrays[column] = numpy.concatenate(
+                (self._arrays[column], numpy.asarray(self._pending[column], dtype=numpy.int32)))
+            self._pending[column] = list()
+        payloads = numpy.empty(len(self._pending_payloads), dtype=object)
+        payloads[:] = self._pending_payloads
+        self._payloads = numpy.concatenate((self._payloads, payloads))
+        self._pending_payloads = list()
+
+    def __len__(self):
+        return len(self._payloads) + len(self._pending_payloads)
+
+    def column(self, column):
+        """Return the integer codes of the given column."""
+        self._flush()
+        return self._arrays[column]
+
+    def labels(self, column):
+        """Return the labels of the given column, indexed by code."""
+        return self._labels[column]
+
+    def records(self):
+        """Yield every record as a (dapp, category, third_party, channel, encoding) tuple."""
+        self._flush()
+        columns = [numpy.asarray(self._labels[column], dtype=object)[self._arrays[column]] if len(self) else [] for column in COLUMNS]
+        return zip(*columns)
+
+    def payloads(self):
+        """Return the payload column."""
+        self._flush()
+        return self._payloads
+
+    def mask(self, **conditions):
+        """Return a boolean mask of the records whose columns take one of the given values.
+
+        Each keyword is a column name mapped to a single value or a list of
+        values, e.g. ``mask(channel=CHANNELS, dapp="uniswap.org")``.
+        """
+        self._flush()
+        mask = numpy.ones(len(self), dtype=bool)
+        for column, values in conditions.items():
+            if isinstance(values, str) or not hasattr(values, "__iter__"):
+                values = [values]
+            codes = [self._codes[column][value] for value in values if value in self._codes[column]]
+            mask &= numpy.isin(self._arrays[column], numpy.asarray(codes, dtype=numpy.int32))
+        return mask
+
+    def take(self, mask):
+        """Return a new table holding the records selected by the boolean mask."""
+        self._flush()
+        table = LeakTable()
+        # Copies, so that appending to the new table does not add labels to this one.
+        table._labels = {column: list(self._labels[column]) for column in COLUMNS}
+        table._codes = {column: dict(self._codes[column]) for column in COLUMNS}
+        table._arrays = {column: self._arrays[column][mask] for column in COLUMNS}
+        table._payloads = self._payloads[mask]
+        return table
+
+    def select(self, **conditions):
+        """Return the records matching the conditions (see `mask`)."""
+        return self.take(self.mask(**conditions))
+
+    def exclude(self, **conditions):
+        """Return the records not matching the conditions (see `mask`)."""
+        return self.take(~self.mask(**conditions))
+
+    def _keys(self, columns):
+        """Return one combined integer key per record for the given columns."""
+        self._flush()
+        if len(columns) == 1:
+            return self._arrays[columns[0]].astype(numpy.int64)
+        shape = tuple(max(len(self._labels[column]), 1) for column in columns)
+        return numpy.ravel_multi_index(tuple(self._arrays[column] for column in columns), shape).astype(numpy.int64)
+
+    def _decode_keys(self, keys, columns):
+        shape = tuple(max(len(self._labels[column]), 1) for column in columns)
+        codes = numpy.unravel_index(keys, shape) if len(columns) > 1 else (keys,)
+        labels = [self._labels[column] for column in columns]
+        return [tuple(labels[i][code] for i, code in enumerate(combination)) for combination in zip(*codes)]
+
+    def count_by(self, *columns):
+        """Return {(value, ...): number of records} grouped by the given columns.
+
+        Groups are returned in order of first appearance in the table.
+        """
+        keys = self._keys(columns)
+        unique_keys, first, counts = numpy.unique(keys, return_index=True, return_counts=True)
+        order = numpy.argsort(first, kind="stable")
+        groups = self._decode_keys(unique_keys[order], columns)
+        if len(columns) == 1:
+            return {group[0]: int(count) for group, count in zip(groups, counts[order])}
+        return {group: int(count) for group, count in zip(groups, counts[order])}
+
+    def unique(self, *columns):
+        """Return the distinct values (or value tuples) of the given columns in order of first appearance."""
+        return list(self.count_by(*columns).keys())
+
+    def nunique(self, column, by):
+        """Return {group: number of distinct `column` values} grouped by column `by`."""
+        pairs = self.unique(by, column)
+        counts = dict()
+        for group, _ in pairs:
+            counts[group] = counts.get(group, 0) + 1
+        return counts
+
+    def isin(self, other, *columns):
+        """Return a boolean mask of the records whose value combination for the given columns also occurs in `other`."""
+        self._flush()
+        if len(self) == 0:
+            return numpy.zeros(0, dtype=bool)
+        combinations = other.unique(*columns) if len(columns) > 1 else [(value,) for value in other.unique(*columns)]
+        shape = tuple(max(len(self._labels[column]), 1) for column in columns)
+        wanted = list()
+        for combination in combinations:
+            if all(value in self._codes[column] for column, value in zip(columns, combination)):
+                codes = tuple(self._codes[column][value] for column, value in zip(columns, combination))
+                wanted.append(numpy.ravel_multi_index(codes, shape) if len(columns) > 1 else codes[0])
+        return numpy.isin(self._keys(columns), numpy.asarray(wanted, dtype=numpy.int64))
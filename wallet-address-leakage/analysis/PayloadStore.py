@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Deduplicated storage for leak payloads (request URLs, POST bodies, cookies).
+ Leak records keep a 128-bit content hash of their payload instead of the
+ payload itself, and every distinct payload is held once, either in memory or
+ in a SQLite file, so that memory grows with the number of distinct payloads
+ rather than with the number of leaks.
+"""
+
+import sys
+import sqlite3
+import hashlib
+
+# Number of new payloads written to a disk-backed store per transaction.
+COMMIT_INTERVAL = 1000
+
+# JSON object keys are strings, so a leak without a third-party domain (e.g.
+# to a data: URL) is stored under this key in result and checkpoint files.
+NO_DOMAIN = "null"
+
+def get_key(payload):
+    """Return the content hash of the given payload as an integer."""
+    return int.from_bytes(hashlib.blake2b(payload.encode("utf-8", "surrogatepass"), digest_size=16).digest(), "big")
+
+class PayloadStore():
+    def __init__(self, path=None):
+        """PayloadStore maps content hashes to payloads.
+
+        Payloads are kept in a dict unless `path` is given, in which case
+        they are written to a SQLite database at `path` and only their keys
+        are kept in memory. Several processes may share the same database.
+        """
+        self.path = path
+        self._payloads = dict()
+        self._keys = set()
+        self._pending = 0
+        self._connection = None
+        if path:
+            self._connection = sqlite3.connect(path, timeout=60)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS payloads (key TEXT PRIMARY KEY, payload TEXT NOT NULL)")
+
+    def put(self, payload):
+        """Store the payload (if new) and return its key."""
+        key = get_key(payload)
+        if self._connection is None:
+            self._payloads.setdefault(key, payload)
+        elif not key in self._keys:
+            self._keys.add(key)
+            self._connection.execute("INSERT OR IGNORE INTO payloads (key, payload) VALUES (?, ?)", (format(key, "032x"), payload))
+            self._pending += 1
+            if self._pending >= COMMIT_INTERVAL:
+                self.commit()
+        return key
+
+    def get(self, key):
+        """Return the payload stored under the given key."""
+        if self._connection is None:
+            return self._payloads[key]
+        row = self._connection.execute("SELECT payload FROM payloads WHERE key = ?", (format(key, "032x"),)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def commit(self):
+        if self._connection is not None and self._pending:
+            self._connection.commit()
+            self._pending = 0
+
+    def close(self):
+        if self._connection is not None:
+            self.commit()
+            self._connection.close()
+            self._connection = None
+
+    def __len__(self):
+        return len(self._payloads) if self._connection is None else len(self._keys)
+
+def add_leak(leaks, origin, type, domain, payloads, leak, encoding):
+    """Add a leak to the nested {origin: {type: {domain: [(key, encoding)]}}} dict.
+
+    The payload is stored in `payloads` and referenced by its key; domain,
+    type and encoding strings are interned.
+    """
+    leaks.setdefault(origin, dict()).setdefault(type, dict()).setdefault(sys.intern(domain) if domain else domain, list()).append(
+        (payloads.put(leak), sys.intern(encoding)))
+
+def expand_leaks(leaks, payloads):
+    """Return a copy of the nested leaks dict with payload keys replaced by the payloads."""
+    return {origin: {type: {domain: [(payloads.get(key), encoding) for key, encoding in leaks[origin][type][domain]]
+                            for domain in leaks[origin][type]}
+                     for type in leaks[origin]}
+            for origin in leaks}
+
+def compact_leaks(leaks, payloads):
+    """Inverse of `expand_leaks`: store the payloads and return the dict referencing them by key.
+
+    `leaks` may have been loaded from JSON, where the None domain became NO_DOMAIN.
+    """
+    compacted = dict()
+    for origin in leaks:
+        for type in leaks[origin]:
+            for domain in leaks[origin][type]:
+                for leak, encoding in leaks[origin][type][domain]:
+                    add_leak(compacted, origin, type, None if domain == NO_DOMAIN else domain, payloads, leak, encoding)
+    return compacted
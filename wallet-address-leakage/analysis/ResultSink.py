@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Buffered sinks for the records produced by the leak analyses. Records are
+ tuples in the order of the sink's fields and are written in batches, either
+ as CSV, as JSON lines, or column-wise into a NumPy .npz archive in which
+ every column is dictionary encoded. All analyses write leak records with the
+ same fields (LEAK_FIELDS).
+
+ `checkpoint()` returns a position from which a sink can be reopened with
+ `resume=position`, dropping whatever was written after the checkpoint.
+"""
+
+import os
+import csv
+import json
+import numpy
+
+LEAK_FIELDS = ["analysis", "category", "page", "origin", "third_party", "url", "channel", "encoding", "payload"]
+
+BATCH_SIZE = 10000
+
+class Sink():
+    def __init__(self, file_name, fields=LEAK_FIELDS, batch_size=BATCH_SIZE):
+        self.file_name = file_name
+        self.fields = list(fields)
+        self.batch_size = batch_size
+        self.batch = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, record):
+        """Add a single record, given as a tuple in the order of `fields`."""
+        self.batch.append(record)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        if self.batch:
+            self._write_batch(self.batch)
+            self.batch = list()
+
+    def close(self):
+        self.flush()
+
+    def checkpoint(self):
+        """Write out all records added so far and return the position to resume from."""
+        self.flush()
+        return self._position()
+
+    def _write_batch(self, records):
+        raise NotImplementedError
+
+    def _position(self):
+        raise NotImplementedError
+
+class TextSink(Sink):
+    def __init__(self, file_name, fields=LEAK_FIELDS, batch_size=BATCH_SIZE, resume=None):
+        super().__init__(file_name, fields, batch_size)
+        if resume is None:
+            self.file = open(file_name, "w", encoding="utf-8", newline="")
+        else:
+            os.truncate(file_name, resume)
+            self.file = open(file_name, "a", encoding="utf-8", newline="")
+
+    def _position(self):
+        self.file.flush()
+        return os.fstat(self.file.fileno()).st_size
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+class CsvSink(TextSink):
+    def __init__(self, file_name, fields=LEAK_FIELDS, batch_size=BATCH_SIZE, resume=None, header=True, **fmtparams):
+        """CsvSink writes records as CSV rows, preceded by a header unless `header` is False."""
+        super().__init__(file_name, fields, batch_size, resume)
+        self.writer = csv.writer(self.file, **fmtparams)
+        if header and resume is None:
+            self.writer.writerow(self.fields)
+
+    def _write_batch(self, records):
+        # Quoting keeps line breaks inside fields, but NUL bytes are not valid CSV.
+        self.writer.writerows([[value.replace("\x00", "") if isinstance(value, str) else value for value in record] for record in records])
+
+class JsonLinesSink(TextSink):
+    def __init__(self, file_name, fields=LEAK_FIELDS, batch_size=BATCH_SIZE, resume=None):
+        """JsonLinesSink writes every record as a JSON object on its own line."""
+        super().__init__(file_name, fields, batch_size, resume)
+
+    def _write_batch(self, records):
+        self.file.write("".join([json.dumps(dict(zip(self.fields, record)))+"\n" for record in records]))
+
+def encode_labels(labels):
+    """Return the UTF-8 blob and offsets of a list of labels."""
+    encoded = [label.encode("utf-8") for label in labels]
+    blob = numpy.frombuffer(b"".join(encoded), dtype=numpy.uint8)
+    offsets = numpy.cumsum([0] + [len(label) for label in encoded], dtype=numpy.int64)
+    return blob, offsets
+
+def decode_labels(blob, offsets):
+    blob = blob.tobytes()
+    return [blob[offsets[i]:offsets[i+1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+class ColumnarSink(Sink):
+    def __init__(self, file_name, fields=LEAK_FIELDS, batch_size=BATCH_SIZE, resume=None):
+        """ColumnarSink writes records column-wise into a NumPy .npz archive.
+
+        Every column is dictionary encoded: its distinct values are stored
+        once as a UTF-8 blob with offsets and every record refers to them by
+        an int32 code. Every batch is appended as a chunk (its codes and the
+        labels it introduced) to `<file_name>.chunks`; the chunks are combined
+        into the archive when the sink is closed.
+        """
+        super().__init__(file_name, fields, batch_size)
+        self.chunks_file = file_name+".chunks"
+        self.codes = {field: dict() for field in self.fields}
+        self.records = 0
+        if resume is None:
+            self.file = open(self.chunks_file, "wb")
+        else:
+            self._resume(resume)
+
+    def _resume(self, records):
+        if not os.path.exists(self.chunks_file):
+            # Closed after the checkpoint: start over from the records of the archive up to it.
+            with open(self.chunks_file, "wb") as f:
+                for field, (codes, labels) in load_columns(self.file_name).items():
+                    used = labels[:int(codes[:records].max()) + 1] if records else []
+                    self._save_chunk(f, codes[:records], used)
+        position = 0
+        with open(self.chunks_file, "rb") as f:
+            for chunk_records, labels in read_chunks(f, self.fields):
+                if self.records + chunk_records > records:
+                    break
+                self.records += chunk_records
+                for field in self.fields:
+                    for label in labels[field]:
+                        self.codes[field][label] = len(self.codes[field])
+                position = f.tell()
+        if self.records != records:
+            raise ValueError("Cannot resume "+self.file_name+" after "+str(records)+" records: no chunk ends there")
+        os.truncate(self.chunks_file, position)
+        self.file = open(self.chunks_file, "ab")
+
+    def _save_chunk(self, f, codes, labels):
+        blob, offsets = encode_labels(labels)
+        numpy.save(f, numpy.asarray(codes, dtype=numpy.int32))
+        numpy.save(f, blob)
+        numpy.save(f, offsets)
+
+    def _write_batch(self, records):
+        for field, values in zip(self.fields, zip(*records)):
+            codes = self.codes[field]
+            new_labels = list()
+            encoded = list()
+            for value in values:
+                value = "" if value is None else str(value)
+                if not value in codes:
+                    codes[value] = len(codes)
+                    new_labels.append(value)
+                encoded.append(codes[value])
+            self._save_chunk(self.file, encoded, new_labels)
+        self.records += len(records)
+
+    def _position(self):
+        self.file.flush()
+        return self.records
+
+    def close(self):
+        super().close()
+        self.file.close()
+        codes = {field: list() for field in self.fields}
+        labels = {field: list() for field in self.fields}
+        with open(self.chunks_file, "rb") as f:
+            for _, chunk_labels in read_chunks(f, self.fields, codes):
+                for field in self.fields:
+                    labels[field].extend(chunk_labels[field])
+        arrays = {"fields": numpy.asarray(self.fields)}
+        for field in self.fields:
+            arrays[field+".codes"] = numpy.concatenate(codes[field]) if codes[field] else numpy.zeros(0, dtype=numpy.int32)
+            arrays[field+".blob"], arrays[field+".offsets"] = encode_labels(labels[field])
+        with open(self.file_name+".tmp", "wb") as f:
+            numpy.savez_compressed(f, **arrays)
+        os.replace(self.file_name+".tmp", self.file_name)
+        os.remove(self.chunks_file)
+
+def read_chunks(f, fields, codes=None):
+    """Yield (records, {field: new labels}) for every chunk written by ColumnarSink, appending the codes to `codes` if given."""
+    size = os.fstat(f.fileno()).st_size
+    while f.tell() < size:
+        labels = dict()
+        for field in fields:
+            chunk_codes = numpy.load(f)
+            labels[field] = decode_labels(numpy.load(f), numpy.load(f))
+            if codes is not None:
+                codes[field].append(chunk_codes)
+        yield len(chunk_codes), labels
+
+SINK_FORMATS = {
+    "csv": CsvSink,
+    "jsonl": JsonLinesSink,
+    "npz": ColumnarSink
+}
+
+def open_sink(file_name, fields=LEAK_FIELDS, **kwargs):
+    """Return a sink for `file_name`, choosing the format by its extension."""
+    extension = file_name.rsplit(".", 1)[-1].lower()
+    if not extension in SINK_FORMATS:
+        raise ValueError("Unsupported result format: "+file_name+" (supported: "+", ".join(SINK_FORMATS)+")")
+    return SINK_FORMATS[extension](file_name, fields, **kwargs)
+
+def load_columns(file_name):
+    """Load an archive written by ColumnarSink as {field: (codes, labels)}."""
+    columns = dict()
+    with numpy.load(file_name) as archive:
+        for field in archive["fields"]:
+            columns[str(field)] = (archive[field+".codes"], decode_labels(archive[field+".blob"], archive[field+".offsets"]))
+    return columns
+
+def load_records(file_name):
+    """Return the records of a file written by any of the sinks as a list of dicts."""
+    extension = file_name.rsplit(".", 1)[-1].lower()
+    if extension == "npz":
+        columns = load_columns(file_name)
+        values = [numpy.asarray(labels, dtype=object)[codes] if len(codes) else [] for codes, labels in columns.values()]
+        return [dict(zip(columns.keys(), record)) for record in zip(*values)]
+    if extension == "jsonl":
+        with open(file_name, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    with open(file_name, "r", encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
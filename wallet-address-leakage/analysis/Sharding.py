@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Splits a crawl across several machines (or processes). Every crawl file is
+ assigned to one of N shards by a stable hash of the site it belongs to, so
+ that each shard can be analysed independently and the partial results of
+ all shards can be merged afterwards into the results of a single run.
+
+ Crawl files are named after the host they were crawled from (e.g.
+ app.uniswap.org.json); files of hosts with the same eTLD+1 belong to the
+ same site and thus to the same shard.
+"""
+
+import os
+import json
+import hashlib
+import FrameContext
+import CrawlArchive
+
+class Shard():
+    def __init__(self, index, count):
+        """Shard `index` (0-based) of `count` shards."""
+        if count < 1 or not 0 <= index < count:
+            raise ValueError("Invalid shard "+str(index)+"/"+str(count))
+        self.index = index
+        self.count = count
+
+    def __str__(self):
+        return str(self.index)+"/"+str(self.count)
+
+    def __contains__(self, file_name):
+        return get_shard(file_name, self.count) == self.index
+
+    def suffix(self):
+        """Return the suffix that tells the output files of this shard apart."""
+        return ".shard-"+str(self.index)+"-of-"+str(self.count)
+
+def parse_shard(text):
+    """Parse "I/N" into a Shard; usable as an argparse type."""
+    try:
+        index, count = [int(value) for value in text.split("/")]
+    except ValueError:
+        raise ValueError("Expected a shard as INDEX/COUNT, e.g. 0/4: "+text)
+    return Shard(index, count)
+
+def get_site_key(file_name):
+    """Return the site a crawl file belongs to, derived from its name."""
+    name = os.path.basename(file_name)
+    for suffix in sorted(CrawlArchive.CRAWL_SUFFIXES, key=len, reverse=True):
+        if name.lower().endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return FrameContext.get_host_etld1(name.lower()) or name
+
+def get_shard(file_name, count):
+    """Return the shard (0 to count - 1) of the given crawl file."""
+    digest = hashlib.blake2b(get_site_key(file_name).encode("utf-8", "surrogatepass"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+def sort_key(value):
+    """Return a key that sorts None (also inside lists) after all other values instead of failing."""
+    if isinstance(value, (list, tuple)):
+        return [sort_key(element) for element in value]
+    return (value is None, value)
+
+def merge_lists(partials, key):
+    """Concatenate the lists stored under `key` in the given partial results."""
+    merged = list()
+    for partial in partials:
+        merged.extend(partial[key])
+    return merged
+
+def merge_dict_lists(partials, key):
+    """Merge the {name: list} dicts stored under `key`, concatenating lists of the same name."""
+    merged = dict()
+    for partial in partials:
+        for name, values in partial[key].items():
+            merged.setdefault(name, list()).extend(values)
+    return merged
+
+def merge_counts(partials, key):
+    """Sum the {label: count} dicts stored under `key`."""
+    merged = dict()
+    for partial in partials:
+        for label, count in partial[key].items():
+            merged[label] = merged.get(label, 0) + count
+    return merged
+
+def merge_leaks(partials, key):
+    """Merge the nested {origin: {channel: {third_party: [(leak, encoding)]}}} dicts stored under `key`.
+
+    As in a single run, the leaks of an origin found in a later partial replace earlier ones.
+    """
+    merged = dict()
+    for partial in partials:
+        merged.update(partial[key])
+    return merged
+
+def load_partials(file_names):
+    """Load the partial result files written by the shards."""
+    partials = list()
+    for file_name in file_names:
+        with open(file_name, "r") as f:
+            partials.append(json.load(f))
+    return partials
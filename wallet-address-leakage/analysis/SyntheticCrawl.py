@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ Generates synthetic crawl files in the format of the request interceptor, for
+ benchmarks that have to run offline and at any scale. Every site issues a mix
+ of first-party resources, third-party scripts, tracker beacons, JSON-RPC
+ POSTs, WebSocket frames, requests of third-party frames and cookies. Leaks of
+ the wallet address are planted at random under known encoding and hash
+ stacks; the generated corpus only depends on the seed.
+"""
+
+import os
+import json
+import random
+import LeakDetector
+
+ETH_ADDR = "7e4ABd63A7C8314Cc28D388303472353D884f292"
+
+TRACKERS = ["pixel-metrics.com", "adnetwork-sync.net", "beacon-analytics.io", "tagmanager-cdn.com", "session-replay.io", "audience-graph.net"]
+RPC_PROVIDERS = ["rpc-gateway.io", "node-provider.com", "chain-api.net"]
+CDNS = ["static-cdn.net", "jsdelivery.com", "fonts-cdn.com"]
+WIDGETS = ["chat-widget.io", "wallet-connect-bridge.org"]
+
+# Stacks of encodings and hashes (applied first to last) under which leaks are
+# planted; all of them are found by a detector for LIKELY_ENCODINGS/HASHES.
+LEAK_STACKS = [
+    (),
+    ("base64",),
+    ("urlencode",),
+    ("lzstring",),
+    ("md5",),
+    ("sha1",),
+    ("sha256",),
+    ("sha_salted_1",),
+    ("sha256", "base64"),
+    ("md5", "urlencode")
+]
+
+RPC_METHODS = ["eth_getBalance", "eth_call", "eth_getTransactionCount", "eth_estimateGas", "eth_blockNumber", "net_version"]
+
+_hasher = LeakDetector.Hasher()
+_encoder = LeakDetector.Encoder()
+
+def apply_stack(value, stack):
+    """Return `value` encoded and hashed as given by `stack`."""
+    for name in stack:
+        if name in LeakDetector.HASHES:
+            value = _hasher.get_hash(name, value)
+        else:
+            value = _encoder.encode(name, value)
+            if isinstance(value, bytes):
+                value = value.decode()
+    return value
+
+def random_hex(rng, length):
+    return "".join([rng.choice("0123456789abcdef") for _ in range(length)])
+
+class SiteGenerator():
+    def __init__(self, rng, index, eth_address, requests, leak_rate):
+        """SiteGenerator creates the crawl of the `index`-th synthetic site."""
+        self.rng = rng
+        self.host = "app.dapp"+str(index)+".org"
+        self.url = "https://"+self.host+"/"
+        self.eth_address = eth_address
+        self.requests = requests
+        self.leak_rate = leak_rate
+        self.planted = list()
+
+    def leak(self, channel):
+        """Return the address under a random stack if a leak is planted, else None."""
+        if self.rng.random() >= self.leak_rate:
+            return None
+        stack = self.rng.choice(LEAK_STACKS)
+        self.planted.append({"site": self.url, "channel": channel, "stack": list(stack)})
+        if not stack:
+            return "0x"+self.eth_address.lower()
+        return apply_stack(self.rng.choice([self.eth_address, self.eth_address.lower()]), stack)
+
+    def request(self, id, url, type="Script", method="GET", post_data=None, context=None, set_cookie=None, referer=None):
+        req = {
+            "requestContext": context or [self.url],
+            "id": str(id),
+            "url": url,
+            "type": type,
+            "method": method,
+            "headers": {"referer": referer or self.url}
+        }
+        if post_data is not None:
+            req["postData"] = post_data
+        if set_cookie is not None:
+            req["responseHeaders"] = {"set-cookie": set_cookie}
+        return req
+
+    def beacon(self, id):
+        tracker = self.rng.choice(TRACKERS)
+        leak = self.leak("GET")
+        params = ["v=1", "cid="+random_hex(self.rng, 32), "dl="+self.url, "ev="+self.rng.choice(["pageview", "click", "connect", "scroll"])]
+        if leak is not None:
+            params.append(self.rng.choice(["uid", "wallet", "a", "u"])+"="+leak)
+        leak = self.leak("Cookies")
+        set_cookie = "_id="+(leak if leak is not None else random_hex(self.rng, 24))+"; Path=/; Secure"
+        return self.request(id, "https://collect."+tracker+"/b?"+"&".join(params), "Image", set_cookie=set_cookie)
+
+    def rpc(self, id):
+        provider = self.rng.choice(RPC_PROVIDERS)
+        method = self.rng.choice(RPC_METHODS)
+        leak = self.leak("POST")
+        params = ["0x"+random_hex(self.rng, 40), "latest"] if leak is None else [leak, "latest"]
+        post_data = json.dumps({"jsonrpc": "2.0", "id": id, "method": method, "params": params})
+        return self.request(id, "https://mainnet."+provider+"/v1/"+random_hex(self.rng, 32), "Fetch", "POST", post_data)
+
+    def websocket(self, id):
+        provider = self.rng.choice(RPC_PROVIDERS)
+        leak = self.leak("WebSocket")
+        frame = {"type": "subscribe", "channel": self.rng.choice(["blocks", "prices", "account"]), "id": id}
+        if leak is not None:
+            frame["account"] = leak
+        return self.request(id, "wss://ws."+provider+"/stream", "WebSocket", post_data=json.dumps(frame))
+
+    def first_party(self, id):
+        path = self.rng.choice(["static/js/main.", "static/css/app.", "images/logo.", "api/v1/prices?t="])+random_hex(self.rng, 8)
+        return self.request(id, self.url+path, self.rng.choice(["Script", "Stylesheet", "Image", "XHR"]))
+
+    def third_party_script(self, id):
+        leak = self.leak("Referer")
+        referer = self.url+"#/account/"+leak if leak is not None else None
+        return self.request(id, "https://"+self.rng.choice(CDNS)+"/npm/lib@"+str(self.rng.randint(1, 9))+".min.js", referer=referer)
+
+    def framed(self, id):
+        # Requests of third-party frames are not attributed to the site.
+        widget = "https://"+self.rng.choice(WIDGETS)+"/frame"
+        return self.request(id, widget+"/poll?s="+random_hex(self.rng, 16), "XHR", context=[self.url, widget])
+
+    def cookies(self):
+        cookies = [{"name": "_ga", "value": "GA1.2."+str(self.rng.randint(10**8, 10**9)), "domain": "."+self.host}]
+        for tracker in self.rng.sample(TRACKERS, 2):
+            leak = self.leak("Cookies")
+            cookies.append({"name": "_uid", "value": leak if leak is not None else random_hex(self.rng, 32), "domain": "."+tracker})
+        return cookies
+
+    def generate(self):
+        kinds = [(self.first_party, 30), (self.third_party_script, 10), (self.beacon, 25), (self.rpc, 20), (self.websocket, 10), (self.framed, 5)]
+        generators = [kind for kind, _ in kinds]
+        weights = [weight for _, weight in kinds]
+        requests = [self.rng.choices(generators, weights)[0](id) for id in range(self.requests)]
+        return {
+            "url": self.url,
+            "requests": requests,
+            "cookies": self.cookies(),
+            "connected": self.rng.random() < 0.8
+        }
+
+def write_corpus(directory, sites=100, requests=200, leak_rate=0.05, seed=0, eth_address=ETH_ADDR):
+    """Write `sites` crawl files with `requests` requests each to `directory`.
+
+    Returns a summary of the corpus, including the planted leaks.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    planted = list()
+    size = 0
+    for index in range(sites):
+        site = SiteGenerator(rng, index, eth_address, requests, leak_rate)
+        text = json.dumps(site.generate())
+        with open(os.path.join(directory, site.host+".json"), "w") as f:
+            f.write(text)
+        size += len(text)
+        planted.extend(site.planted)
+    return {
+        "directory": directory,
+        "sites": sites,
+        "requests": sites * requests,
+        "bytes": size,
+        "seed": seed,
+        "leak_rate": leak_rate,
+        "planted": len(planted),
+        "planted_by_channel": count_by(planted, "channel")
+    }
+
+def count_by(planted, key):
+    counts = dict()
+    for leak in planted:
+        counts[leak[key]] = counts.get(leak[key], 0) + 1
+    return counts
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import resource
+import tracemalloc
+import subprocess
+import importlib.util
+import LeakDetector
+import LeakPipeline
+import SyntheticCrawl
+import AnalysisLog
+
+ETH_ADDR = SyntheticCrawl.ETH_ADDR
+
+DAPPS_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "find-leaks-and-scripts-dapps.py")
+
+# Benchmarks that run more than this much slower than in the compared results are flagged.
+REGRESSION_THRESHOLD = 1.1
+
+def measure(function, repeat, memory=True):
+    """Call `function` `repeat` times; return the best and mean seconds and the peak memory of one more call."""
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return min(times), sum(times) / len(times), peak
+
+def add_result(results, name, seconds, mean_seconds, peak, ops=None, unit=None, size=None):
+    result = {"name": name, "seconds": seconds, "mean_seconds": mean_seconds, "peak_memory_bytes": peak}
+    if ops is not None:
+        result["ops"] = ops
+        result["unit"] = unit
+        result["throughput"] = ops / seconds if seconds > 0 else None
+    if size is not None:
+        result["bytes"] = size
+        result["bytes_per_second"] = size / seconds if seconds > 0 else None
+    results.append(result)
+    print("{:<32} {:>10.4f}s  {}".format(name, seconds, "" if ops is None else "{:,.0f} {}/s".format(result["throughput"] or 0, unit)))
+
+def collect_inputs(directory):
+    """Return the values of the corpus that the pipeline checks, by detector method."""
+    inputs = {"check_url": list(), "check_post_data": list(), "check_referrer_str": list(), "check_cookie_str": list()}
+    for file_name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, file_name), "r") as f:
+            json_data = json.load(f)
+        page = LeakPipeline.site_page(ETH_ADDR)(json_data)
+        for req in json_data["requests"]:
+            if not LeakPipeline.is_relevant_site_request(page, req):
+                continue
+            inputs["check_url"].append(req["url"])
+            if "postData" in req:
+                inputs["check_post_data"].append(req["postData"])
+            if req["headers"].get("referer"):
+                inputs["check_referrer_str"].append(req["headers"]["referer"])
+            if req.get("responseHeaders") and req["responseHeaders"].get("set-cookie"):
+                inputs["check_cookie_str"].append(req["responseHeaders"]["set-cookie"])
+        for cookie in json_data.get("cookies", []):
+            inputs["check_cookie_str"].extend([cookie["value"], cookie["name"]])
+    return inputs
+
+def benchmark_detector(results, repeat, memory):
+    def construct():
+        return LeakDetector.LeakDetector(
+            LeakPipeline.get_address_terms(ETH_ADDR),
+            encoding_set=LeakDetector.LIKELY_ENCODINGS,
+            hash_set=LeakDetector.LIKELY_HASHES,
+            encoding_layers=LeakPipeline.MAX_LEAK_DETECTION_LAYERS,
+            hash_layers=LeakPipeline.MAX_LEAK_DETECTION_LAYERS,
+            debugging=False
+        )
+    add_result(results, "detector_construction", *measure(construct, repeat, memory), ops=1, unit="detectors")
+    return construct()
+
+def benchmark_checks(results, detector, inputs, repeat, memory):
+    found = dict()
+    for method, values in inputs.items():
+        check = getattr(detector, method)
+        def run():
+            return sum([len(check(value, encoding_layers=LeakPipeline.MAX_LEAK_DETECTION_LAYERS)) > 0 for value in values])
+        add_result(results, method, *measure(run, repeat, memory), ops=len(values), unit="values", size=sum([len(value) for value in values]))
+        found[method] = run()
+    return found
+
+def load_dapps_script():
+    spec = importlib.util.spec_from_file_location("find_leaks_and_scripts_dapps", DAPPS_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def benchmark_parse_directory(results, directory, corpus, repeat, memory):
+    """Time the DApp analysis of the corpus with an empty (cold) and a filled (warm) crawl store."""
+    dapps = load_dapps_script()
+    work_directory = tempfile.mkdtemp(prefix="leak-benchmark-")
+    cwd = os.getcwd()
+    os.chdir(work_directory)
+    try:
+        dapps.CRAWL_STORE = os.path.join(work_directory, "crawl_store.sqlite")
+        def parse():
+            dapps.http_leaks.clear()
+            dapps.encoded_leaks.clear()
+            dapps.PAYLOADS = dapps.PayloadStore.PayloadStore()
+            return dapps.parse_directory(directory, ETH_ADDR, "benchmark")
+        def parse_cold():
+            if os.path.exists(dapps.CRAWL_STORE):
+                os.remove(dapps.CRAWL_STORE)
+            return parse()
+        add_result(results, "parse_directory_cold", *measure(parse_cold, repeat, memory), ops=corpus["requests"], unit="requests", size=corpus["bytes"])
+        parse()
+        add_result(results, "parse_directory_warm", *measure(parse, repeat, memory), ops=corpus["requests"], unit="requests", size=corpus["bytes"])
+        _, leaks, _, _ = parse()
+        return sum([len(leaks[origin][type][domain]) for origin in leaks for type in leaks[origin] for domain in leaks[origin][type]])
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+def get_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(DAPPS_SCRIPT), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, file_name):
+    """Print how the benchmarks compare to those of an earlier results file."""
+    with open(file_name, "r") as f:
+        previous = {result["name"]: result for result in json.load(f)["benchmarks"]}
+    print()
+    print("{:<32} {:>12} {:>12} {:>8}".format("Benchmark", "Previous", "Current", "Ratio"))
+    for result in results:
+        if not result["name"] in previous:
+            continue
+        ratio = result["seconds"] / previous[result["name"]]["seconds"]
+        flag = "  slower" if ratio > REGRESSION_THRESHOLD else ""
+        print("{:<32} {:>11.4f}s {:>11.4f}s {:>7.2f}x{}".format(result["name"], previous[result["name"]]["seconds"], result["seconds"], ratio, flag))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the leak detection on a synthetic crawl corpus.")
+    parser.add_argument("--sites", type=int, default=50, help="Number of synthetic sites (default: %(default)s).")
+    parser.add_argument("--requests", type=int, default=200, help="Number of requests per site (default: %(default)s).")
+    parser.add_argument("--leak-rate", type=float, default=0.05, help="Probability that a value carries a planted leak (default: %(default)s).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus generator (default: %(default)s).")
+    parser.add_argument("--corpus", metavar="DIRECTORY", help="Write the corpus to DIRECTORY (which should be empty) and keep it (default: a temporary directory).")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per benchmark; the best one is reported (default: %(default)s).")
+    parser.add_argument("--no-memory", action="store_true", help="Do not measure the peak memory (saves one traced run per benchmark).")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="File to write the results to (default: %(default)s).")
+    parser.add_argument("--compare", metavar="FILE", help="Compare the results with those of an earlier run.")
+    AnalysisLog.add_arguments(parser)
+    # The per-file records of the analysis would otherwise dominate the timings.
+    parser.set_defaults(log_level="warning")
+    args = parser.parse_args()
+    AnalysisLog.setup_from_arguments(args)
+
+    directory = args.corpus or tempfile.mkdtemp(prefix="leak-corpus-")
+    try:
+        corpus = SyntheticCrawl.write_corpus(directory, args.sites, args.requests, args.leak_rate, args.seed)
+        print("Generated {} sites with {} requests and {} planted leaks in {}".format(corpus["sites"], corpus["requests"], corpus["planted"], directory))
+
+        results = list()
+        memory = not args.no_memory
+        detector = benchmark_detector(results, args.repeat, memory)
+        found = benchmark_checks(results, detector, collect_inputs(directory), args.repeat, memory)
+        found["parse_directory"] = benchmark_parse_directory(results, directory, corpus, args.repeat, memory)
+    finally:
+        if not args.corpus:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        "revision": get_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "corpus": corpus,
+        "repeat": args.repeat,
+        "found": found,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "benchmarks": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Results written to", args.output)
+
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import LeakService
+import AnalysisLog
+
+ETH_ADDR = "7e4ABd63A7C8314Cc28D388303472353D884f292"
+
+DEBUG = False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect wallet address leaks live, in the request events streamed by the request interceptor.")
+    parser.add_argument("-s", "--socket", metavar="PATH", help="Listen on the Unix socket PATH instead of reading events from stdin.")
+    parser.add_argument("-a", "--address", default=ETH_ADDR, help="Wallet address to look for, unless the crawler sends one (default: %(default)s).")
+    parser.add_argument("--stop-after", metavar="N", type=int, help="Ask the crawler to stop once N leaks of a site have been found.")
+    AnalysisLog.add_arguments(parser, debug=DEBUG)
+    args = parser.parse_args()
+    AnalysisLog.setup_from_arguments(args)
+
+    # Build the detector before the first site arrives.
+    LeakService.get_detector(args.address)
+    if args.socket:
+        LeakService.serve_unix_socket(args.socket, args.address, args.stop_after)
+    else:
+        LeakService.serve_stdio(args.address, args.stop_after)
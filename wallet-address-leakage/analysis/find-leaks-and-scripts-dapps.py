@@ -3,78 +3,52 @@
 
 import os
 import sys
-import csv
 import json
+import time
+import argparse
 import numpy
 import operator
 import matplotlib.pyplot as plt
-import publicsuffix2
-import networkx as nx
-import LeakDetector
-
-from urllib.parse import urlparse
-
-MAX_LEAK_DETECTION_LAYERS = 3
+import LeakTable
+import CrawlStore
+import CategoryRunner
+import ResultSink
+import PayloadStore
+import Checkpoint
+import AnalysisLog
+import FrameContext
+import LeakPipeline
+import DependencyGraph
+import Sharding
+
+CRAWL_STORE = "../results/crawl_store.sqlite"
 
 ETH_ADDR = "7e4ABd63A7C8314Cc28D388303472353D884f292"
 
-DEBUG = True
+DAPPS_CRAWL_FOLDER = "../results/dapps/crawl"
 
-class colors:
-    INFO = '\033[94m'
-    OK = '\033[92m'
-    FAIL = '\033[91m'
-    END = '\033[0m'
+CATEGORIES = [
+    ("Collectibles", "collectibles"),
+    ("DeFi", "defi"),
+    ("Games", "games"),
+    ("Other", "other"),
+    ("Marketplaces", "marketplaces"),
+    ("High Risk", "high_risk"),
+    ("Exchanges", "exchanges"),
+    ("Gambling", "gambling"),
+    ("Social", "social")
+]
 
-def log(msg):
-    """Log the given message to stderr."""
-    print("[+] " + msg, file=sys.stderr)
+DEBUG = True
 
-def parse_file(file_name):
-    """Parse the given JSON file and return its content."""
-    with open(file_name, "r") as fd:
-            json_data = json.load(fd)
-    return json_data
+colors = AnalysisLog.colors
+log = AnalysisLog.log
 
 def get_etld1(url):
     """Return the given URL's eTLD+1."""
-    fqdn = urlparse(url).netloc
-    fqdn = fqdn.split(":")[0]
-    return publicsuffix2.get_sld(fqdn)
-
-def has_eth_addr(url, eth_address):
-    """Return True if the given URL contains our Ethereum address."""
-    url = url.lower()
-    return eth_address in url
-
-def is_irrelevant(req):
-    """Return True if the given request is irrelevant to our data analysis."""
-    if req["url"].startswith("chrome-extension://"):
-        return True
-    return False
-
-def is_same_request_context(request_context, origin):
-    same = True
-    for url in request_context:
-        if get_etld1(url) != origin:
-            same = False
-    return same
-
-def are_unrelated(domain, origin):
-    """Return True if the two given domains are likely independent."""
-    if domain != None and "." in domain:
-        if origin.split('.')[-2] in domain.split('.')[-2]:
-            return False
-    return domain != origin
-
-def add_leak(domain, type, origin, leaks, leak, encoding):
-    if not origin in leaks:
-        leaks[origin] = dict()
-    if not type in leaks[origin]:
-        leaks[origin][type] = dict()
-    if not domain in leaks[origin][type]:
-        leaks[origin][type][domain] = list()
-    leaks[origin][type][domain].append((leak, encoding))
+    return FrameContext.get_etld1(url)
+
+PAYLOADS = PayloadStore.PayloadStore()
 
 http_leaks = dict()
 encoded_leaks = dict()
@@ -82,135 +56,37 @@ encoded_leaks = dict()
 connect_labels = dict()
 metamask_labels = dict()
 
-def analyse_data(writer, json_data, G, script_nodes, edges, eth_address):
-    origin = json_data["url"]
-    reqs = json_data["requests"]
-    script_domains = set()
-    req_dst = {}
-    origin = get_etld1(origin)
-
-    log("Analyzing requests for origin: "+colors.INFO+origin+colors.END)
-
-    search_terms = [eth_address, eth_address.lower(), eth_address.upper()]
-
-    detector = LeakDetector.LeakDetector(
-        search_terms,
-        encoding_set=LeakDetector.LIKELY_ENCODINGS,
-        hash_set=LeakDetector.LIKELY_HASHES,
-        encoding_layers=MAX_LEAK_DETECTION_LAYERS,
-        hash_layers=MAX_LEAK_DETECTION_LAYERS,
-        debugging=False
-    )
-
-    leaks = {}
-
-    for req in reqs:
-        if is_irrelevant(req):
-            continue
-        if not is_same_request_context(req["requestContext"], origin):
-            continue
-        url = req["url"]
-        domain = get_etld1(url)
-
-        if domain != origin and domain != None:
-            G.add_node(domain)
-            script_domains.add(domain)
-            script_nodes.add(domain)
-            edges.append(tuple([origin, domain]))
-
-        if are_unrelated(domain, origin):
-            if req["url"].startswith("http") or req["url"].startswith("ws"):
-                protocol = req["url"].split("://")[0]
-                if protocol == "http" or protocol == "ws":
-                    if not origin in http_leaks:
-                        http_leaks[origin] = list()
-                    http_leaks[origin].append(req["url"])
-
-            # Get
-            url_leaks_detected = detector.check_url(req["url"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-            if len(url_leaks_detected) > 0 or has_eth_addr(req["url"], eth_address.lower()):
-                encoding = ""
-                for url_leak in url_leaks_detected:
-                    if url_leak[0].lower() != eth_address.lower():
-                        encoding = url_leak[0]
-                if DEBUG:
-                    log(colors.OK+"Found leak (GET): "+req["url"]+" "+encoding+colors.END)
-                add_leak(domain, "GET", origin, leaks, req["url"], encoding)
-                writer.writerow([json_data["url"], req["url"], "GET", ""])
-
-            # Post & WebSockets
-            if "postData" in req:
-                post_leaks_detected = detector.check_post_data(req["postData"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-                if len(post_leaks_detected) > 0 or has_eth_addr(req["postData"], eth_address.lower()):
-                    type = req["type"] if req["type"] == "WebSocket" else "POST"
-                    encoding = ""
-                    for post_leak in post_leaks_detected:
-                        if post_leak[0].lower() != eth_address.lower():
-                            encoding = post_leak[0]
-                    if DEBUG:
-                        log(colors.OK+"Found leak ("+type+"): "+req["url"]+colors.END)
-                    add_leak(domain, type, origin, leaks, req["postData"], encoding)
-                    writer.writerow([json_data["url"], req["url"], type, req["postData"].replace("\n", "").replace("\r", "").replace("\x00", "").replace(" ", "")])
-
-            # Referer
-            if "headers" in req and "referer" in req["headers"] and req["headers"]["referer"]:
-                referrer_leaks_detected = detector.check_referrer_str(req["headers"]["referer"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-                if len(referrer_leaks_detected) > 0 or has_eth_addr(req["headers"]["referer"], eth_address.lower()):
-                    encoding = ""
-                    for referrer_leak in referrer_leaks_detected:
-                        if referrer_leak[0].lower() != eth_address.lower():
-                            encoding = referrer_leak[0]
-                    add_leak(domain, "Referer", origin, leaks, req["headers"]["referer"], encoding)
-                    writer.writerow([json_data["url"], req["url"], "Referer", req["headers"]["referer"]])
-
-            # Cookies
-            if "responseHeaders" in req and req["responseHeaders"] and "set-cookie" in req["responseHeaders"] and req["responseHeaders"]["set-cookie"]:
-                cookie_leaks_detected = detector.check_cookie_str(req["responseHeaders"]["set-cookie"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-                if len(cookie_leaks_detected) > 0 or has_eth_addr(req["responseHeaders"]["set-cookie"], eth_address.lower()):
-                    encoding = ""
-                    for cookie_leak in cookie_leaks_detected:
-                        if cookie_leak[0].lower() != eth_address.lower():
-                            encoding = cookie_leak[0]
-                    add_leak(domain, "Cookies", origin, leaks, req["responseHeaders"]["set-cookie"], encoding)
-                    writer.writerow([json_data["url"], req["url"], "Cookies", req["responseHeaders"]["set-cookie"]])
-
-        req_dst[domain] = req_dst.get(domain, 0) + 1
-
-        if "cookies" in json_data:
-            for cookie in json_data["cookies"]:
-                if are_unrelated(cookie["domain"], origin):
-                    cookie_leaks_detected = detector.check_cookie_str(cookie["value"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-                    if len(cookie_leaks_detected) > 0 or has_eth_addr(cookie["value"], eth_address.lower()):
-                        encoding = ""
-                        for cookie_leak in cookie_leaks_detected:
-                            if cookie_leak[0].lower() != eth_address.lower():
-                                encoding = cookie_leak[0]
-                        add_leak(cookie["domain"], "Cookies", origin, leaks, cookie["value"], encoding)
-                        writer.writerow([json_data["url"], cookie["domain"], "Cookies", cookie["value"]])
-                    cookie_leaks_detected = detector.check_cookie_str(cookie["name"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-                    if len(cookie_leaks_detected) > 0 or has_eth_addr(cookie["name"], eth_address.lower()):
-                        encoding = ""
-                        for cookie_leak in cookie_leaks_detected:
-                            if cookie_leak[0].lower() != eth_address.lower():
-                                encoding = cookie_leak[0]
-                        add_leak(cookie["domain"], "Cookies", origin, leaks, cookie["name"], encoding)
-                        writer.writerow([json_data["url"], cookie["domain"], "Cookies", cookie["name"]])
-
-    if DEBUG:
-        log("Third-parties: "+str(list(script_domains)))
-    log("Found "+colors.INFO+str(len(script_domains))+colors.END+" third-party script(s).")
-
-    return leaks, script_domains
-
-def parse_directory(directory, eth_address, category):
-    """Iterate over the given directory and parse its JSON files."""
-    log("")
-    log("Parsing "+colors.INFO+directory+colors.END+" directory...")
-
-    G = nx.DiGraph()
-    defi_nodes = set()
-    script_nodes = set()
-    edges = []
+def record_http_leak(page, req, domain, third_party):
+    """Remember the third-party requests of the site that are not encrypted."""
+    if third_party and (req["url"].startswith("http") or req["url"].startswith("ws")):
+        protocol = req["url"].split("://")[0]
+        if protocol == "http" or protocol == "ws":
+            if not page.origin in http_leaks:
+                http_leaks[page.origin] = list()
+            http_leaks[page.origin].append(req["url"])
+
+def get_pipeline(eth_address):
+    # The cookies of a site have always been checked once per relevant
+    # request, so that the published cookie leak counts can be reproduced.
+    return LeakPipeline.LeakPipeline("dapps", LeakPipeline.site_page(eth_address), cookies_per_request=True, on_request=record_http_leak)
+
+def analyse_data(sink, category, json_data, graph, eth_address):
+    page = get_pipeline(eth_address).run(json_data, PAYLOADS, sink, category, graph)
+    return page.leaks, page.third_parties
+
+def parse_directory(directory, eth_address, category, progress=None, leak_format="csv", resume=False, shard=None):
+    """Iterate over the given directory and parse its JSON files.
+
+    If given, `progress(file_name, requests, seconds)` is called after each
+    JSON file. Every leak is written to dapps_<category>_leaks.<leak_format>.
+    The processed files and partial results are checkpointed periodically;
+    with `resume`, the last checkpoint is loaded and its files are skipped.
+    With a `shard`, only the files of that shard are parsed and the names of
+    the output files carry the shard's suffix.
+    """
+    log("Parsing %s directory...", directory, event="directory", directory=directory)
+
+    graph = DependencyGraph.DependencyGraph()
 
     total_sites = []
     total_third_parties = []
@@ -219,39 +95,67 @@ def parse_directory(directory, eth_address, category):
 
     leaks = dict()
 
-    csvfile = open("dapps_"+category+"_leaks.csv", "w", encoding="utf-8")
-    writer = csv.writer(csvfile, delimiter=';', quotechar='|', quoting=csv.QUOTE_MINIMAL)
-
-    for file_name in os.listdir(directory):
-        file_name = os.path.join(directory, file_name)
-        if not os.path.isfile(file_name) or not file_name.endswith(".json"):
-            if DEBUG:
-                log("")
-                log("Skipping {}; not a JSON file.".format(file_name))
+    leaks_file = "dapps_"+category+"_leaks"+(shard.suffix() if shard else "")+"."+leak_format
+    checkpoint = Checkpoint.Checkpoint(get_checkpoint_file(category, shard), resume)
+    if checkpoint.state:
+        log("Resuming after %s files from checkpoint: %s", len(checkpoint.done), checkpoint.file_name, event="resume", checkpoint=checkpoint.file_name, files=len(checkpoint.done))
+        total_sites = checkpoint.state["total_sites"]
+        leaks = PayloadStore.compact_leaks(checkpoint.state["leaks"], PAYLOADS)
+        connected = checkpoint.state["connected"]
+        total_third_parties = checkpoint.state["total_third_parties"]
+        http_leaks.update(checkpoint.state["http_leaks"])
+        connect_labels.update(checkpoint.state["connect_labels"])
+        metamask_labels.update(checkpoint.state["metamask_labels"])
+        sink = ResultSink.open_sink(leaks_file, resume=checkpoint.state["sink"])
+    else:
+        sink = ResultSink.open_sink(leaks_file)
+
+    def file_done(file_name, requests, start):
+        if progress:
+            progress(file_name, requests, time.time() - start)
+        checkpoint.add(file_name)
+        if checkpoint.is_due():
+            checkpoint.save({
+                "total_sites": total_sites,
+                "leaks": PayloadStore.expand_leaks(leaks, PAYLOADS),
+                "connected": connected,
+                "total_third_parties": total_third_parties,
+                "http_leaks": http_leaks,
+                "connect_labels": connect_labels,
+                "metamask_labels": metamask_labels,
+                "sink": sink.checkpoint()
+            })
+
+    store = CrawlStore.CrawlStore(CRAWL_STORE)
+
+    for entry in store.read_ahead(directory, select=(lambda file_name: file_name in shard) if shard else None):
+        file_name = entry.name
+        if checkpoint.is_done(file_name):
             continue
 
-        log("")
-        log("Parsing file: "+colors.INFO+file_name+colors.END)
+        log("Parsing file: %s", file_name, event="file", file=file_name)
+        start = time.time()
         try:
-            json_data = parse_file(file_name)
+            json_data = store.load_entry(entry)
         except:
-            print(colors.FAIL+"Error: Could not parse", file_name+colors.END)
+            AnalysisLog.warning("Error: Could not parse %s", file_name, event="parse_error", file=file_name)
+            file_done(file_name, 0, start)
             continue
 
         if not "url" in json_data:
+            file_done(file_name, 0, start)
             continue
 
         defi_domain = get_etld1(json_data["url"])
         total_sites.append(defi_domain)
 
 
-        log("Extracted "+colors.INFO+str(len(json_data["requests"]))+colors.END+" requests from file: "+colors.INFO+file_name+colors.END)
+        log("Extracted %s requests from file: %s", len(json_data["requests"]), file_name, event="requests", file=file_name, requests=len(json_data["requests"]))
 
         # Add DeFi site as new node to dependency graph.
-        G.add_node(defi_domain)
-        defi_nodes.add(defi_domain)
+        graph.add_site(defi_domain)
 
-        detected_leaks, detected_third_parties = analyse_data(writer, json_data, G, script_nodes, edges, eth_address)
+        detected_leaks, detected_third_parties = analyse_data(sink, category, json_data, graph, eth_address)
         total_third_parties.append(list(detected_third_parties))
         leaks.update(detected_leaks)
 
@@ -270,138 +174,196 @@ def parse_directory(directory, eth_address, category):
             metamask_labels[json_data["metamask_label"]] += 1
             metamask_labels.update(dict(sorted(metamask_labels.items(), key=lambda item: item[1])))
 
-    csvfile.close()
+        file_done(file_name, len(json_data["requests"]), start)
+
+    store.close()
+
+    sink.close()
 
     return total_sites, leaks, connected, total_third_parties
 
-def add_leaks_to_results(results, total, leaks, connected, detected_third_parties, third_party_leaks, category):
-    get_leaks = 0
-    post_leaks = 0
-    websocket_leaks = 0
-    cookie_leaks = 0
-    third_parties = set()
-    for dapp in leaks:
-        for type in leaks[dapp]:
-            if type == "GET":
-                for third_party in leaks[dapp][type]:
-                    if not third_party in third_party_leaks:
-                        third_party_leaks[third_party] = dict()
-                        third_party_leaks[third_party]["GET"] = list()
-                        third_party_leaks[third_party]["POST"] = list()
-                        third_party_leaks[third_party]["WebSocket"] = list()
-                        third_party_leaks[third_party]["Cookies"] = list()
-                        third_party_leaks[third_party]["DApps"] = set()
-                    third_party_leaks[third_party][type] += leaks[dapp][type][third_party]
-                    third_party_leaks[third_party]["DApps"].add(dapp)
-                    third_parties.add(third_party)
-                    get_leaks += len(leaks[dapp][type][third_party])
-                    for leak in leaks[dapp][type][third_party]:
-                        if leak[1] != "" and leak[1] != "urlencode":
-                            if not dapp in encoded_leaks:
-                                 encoded_leaks[dapp] = list()
-                            encoded_leaks[dapp].append((type, leak))
-            if type == "POST":
-                for third_party in leaks[dapp][type]:
-                    if not third_party in third_party_leaks:
-                        third_party_leaks[third_party] = dict()
-                        third_party_leaks[third_party]["GET"] = list()
-                        third_party_leaks[third_party]["POST"] = list()
-                        third_party_leaks[third_party]["WebSocket"] = list()
-                        third_party_leaks[third_party]["Cookies"] = list()
-                        third_party_leaks[third_party]["DApps"] = set()
-                    third_party_leaks[third_party][type] += leaks[dapp][type][third_party]
-                    third_party_leaks[third_party]["DApps"].add(dapp)
-                    third_parties.add(third_party)
-                    post_leaks += len(leaks[dapp][type][third_party])
-                    for leak in leaks[dapp][type][third_party]:
-                        if leak[1] != "" and leak[1] != "urlencode":
-                            if not dapp in encoded_leaks:
-                                 encoded_leaks[dapp] = list()
-                            encoded_leaks[dapp].append((type, leak))
-            if type == "WebSocket":
-                for third_party in leaks[dapp][type]:
-                    if not third_party in third_party_leaks:
-                        third_party_leaks[third_party] = dict()
-                        third_party_leaks[third_party]["GET"] = list()
-                        third_party_leaks[third_party]["POST"] = list()
-                        third_party_leaks[third_party]["WebSocket"] = list()
-                        third_party_leaks[third_party]["Cookies"] = list()
-                        third_party_leaks[third_party]["DApps"] = set()
-                    third_party_leaks[third_party][type] += leaks[dapp][type][third_party]
-                    third_party_leaks[third_party]["DApps"].add(dapp)
-                    third_parties.add(third_party)
-                    websocket_leaks += len(leaks[dapp][type][third_party])
-                    for leak in leaks[dapp][type][third_party]:
-                        if leak[1] != "" and leak[1] != "urlencode":
-                            if not dapp in encoded_leaks:
-                                 encoded_leaks[dapp] = list()
-                            encoded_leaks[dapp].append((type, leak))
-            if type == "Cookies":
-                for third_party in leaks[dapp][type]:
-                    if not third_party in third_party_leaks:
-                        third_party_leaks[third_party] = dict()
-                        third_party_leaks[third_party]["GET"] = list()
-                        third_party_leaks[third_party]["POST"] = list()
-                        third_party_leaks[third_party]["WebSocket"] = list()
-                        third_party_leaks[third_party]["Cookies"] = list()
-                        third_party_leaks[third_party]["DApps"] = set()
-                    third_party_leaks[third_party][type] += leaks[dapp][type][third_party]
-                    third_party_leaks[third_party]["DApps"].add(dapp)
-                    third_parties.add(third_party)
-                    cookie_leaks += len(leaks[dapp][type][third_party])
-                    for leak in leaks[dapp][type][third_party]:
-                        if leak[1] != "" and leak[1] != "urlencode":
-                            if not dapp in encoded_leaks:
-                                 encoded_leaks[dapp] = list()
-                            encoded_leaks[dapp].append((type, leak))
+def add_leaks_to_results(results, total, leaks, connected, detected_third_parties, leak_tables, category):
+    table = LeakTable.LeakTable.from_leaks(leaks, category).select(channel=LeakTable.CHANNELS)
+    leak_tables.append(table)
+    channel_counts = table.count_by("channel")
+    encoded = table.exclude(encoding=LeakTable.PLAIN_ENCODINGS)
+    for (dapp, _, _, type, encoding), leak in zip(encoded.records(), encoded.payloads()):
+        if not dapp in encoded_leaks:
+            encoded_leaks[dapp] = list()
+        encoded_leaks[dapp].append((type, (PAYLOADS.get(leak), encoding)))
     results[category] = dict()
     results[category]["total_dapps"] = total
     results[category]["connected_dapps"] = connected
     results[category]["leaky_dapps"] = list(leaks.keys())
-    results[category]["third_parties"] = list(third_parties)
-    results[category]["get_leaks"] = get_leaks
-    results[category]["post_leaks"] = post_leaks
-    results[category]["websocket_leaks"] = websocket_leaks
-    results[category]["cookie_leaks"] = cookie_leaks
+    results[category]["third_parties"] = table.unique("third_party")
+    results[category]["get_leaks"] = channel_counts.get("GET", 0)
+    results[category]["post_leaks"] = channel_counts.get("POST", 0)
+    results[category]["websocket_leaks"] = channel_counts.get("WebSocket", 0)
+    results[category]["cookie_leaks"] = channel_counts.get("Cookies", 0)
     results[category]["detected_third_parties"] = detected_third_parties
 
-if __name__ == "__main__":
-    results = dict()
-    third_party_leaks = dict()
-
-    if not os.path.exists("dapps_results.json"):
-        total, leaks, connected, third_parties = parse_directory("../results/dapps/crawl/dapps_collectibles/", ETH_ADDR, "collectibles")
-        add_leaks_to_results(results, total, leaks, connected, third_parties, third_party_leaks, "Collectibles")
+def get_default_manifest():
+    """Return the manifest of the DAppRadar.com categories crawled for the paper."""
+    return [{"category": category, "name": name, "directory": os.path.join(DAPPS_CRAWL_FOLDER, "dapps_"+name)} for category, name in CATEGORIES]
 
-        total, leaks, connected, third_parties = parse_directory("../results/dapps/crawl/dapps_defi/", ETH_ADDR, "defi")
-        add_leaks_to_results(results, total, leaks, connected, third_parties, third_party_leaks, "DeFi")
+def get_partial_results_file(job):
+    shard = job.get("shard")
+    return "dapps_results_"+job["name"]+(shard.suffix() if shard else "")+".json"
 
-        total, leaks, connected, third_parties = parse_directory("../results/dapps/crawl/dapps_games/", ETH_ADDR, "games")
-        add_leaks_to_results(results, total, leaks, connected, third_parties, third_party_leaks, "Games")
+def get_checkpoint_file(name, shard=None):
+    return "dapps_checkpoint_"+name+(shard.suffix() if shard else "")+".json"
 
-        total, leaks, connected, third_parties = parse_directory("../results/dapps/crawl/dapps_other/", ETH_ADDR, "other")
-        add_leaks_to_results(results, total, leaks, connected, third_parties, third_party_leaks, "Other")
+def get_shard_results_file(shard):
+    return "dapps_results"+shard.suffix()+".json"
 
-        total, leaks, connected, third_parties = parse_directory("../results/dapps/crawl/dapps_marketplaces/", ETH_ADDR, "marketplaces")
-        add_leaks_to_results(results, total, leaks, connected, third_parties, third_party_leaks, "Marketplaces")
-
-        total, leaks, connected, third_parties = parse_directory("../results/dapps/crawl/dapps_high_risk/", ETH_ADDR, "high_risk")
-        add_leaks_to_results(results, total, leaks, connected, third_parties, third_party_leaks, "High Risk")
-
-        total, leaks, connected, third_parties = parse_directory("../results/dapps/crawl/dapps_exchanges/", ETH_ADDR, "exchanges")
-        add_leaks_to_results(results, total, leaks, connected, third_parties, third_party_leaks, "Exchanges")
+def analyse_category(job, progress=None):
+    """Analyse the crawl directory of one manifest entry and return its partial results."""
+    global PAYLOADS
+    PAYLOADS = PayloadStore.PayloadStore(job.get("payload_store"))
+    http_leaks.clear()
+    encoded_leaks.clear()
+    connect_labels.clear()
+    metamask_labels.clear()
+    results = dict()
+    leak_tables = list()
+    total, leaks, connected, third_parties = parse_directory(job["directory"], ETH_ADDR, job["name"], progress, job.get("leak_format", "csv"), job.get("resume", False), job.get("shard"))
+    add_leaks_to_results(results, total, leaks, connected, third_parties, leak_tables, job["category"])
+    PAYLOADS.close()
+    return sort_partial({
+        "results": results[job["category"]],
+        "http_leaks": http_leaks,
+        "encoded_leaks": encoded_leaks,
+        "connect_labels": connect_labels,
+        "metamask_labels": metamask_labels,
+        "leak_records": [list(record) for record in leak_tables[0].records()]
+    })
+
+def sort_partial(partial):
+    """Put the lists and dicts of partial results in a canonical order.
+
+    The order of the crawl files differs between a single run and the
+    shards, so the merged results of the shards only equal those of a single
+    run once both are sorted.
+    """
+    # Leaks to data: or blob: URLs have no third-party domain (None).
+    key = Sharding.sort_key
+    results = partial["results"]
+    dapps = sorted(zip(results["total_dapps"], [sorted(third_parties, key=key) for third_parties in results["detected_third_parties"]]), key=key)
+    results["total_dapps"] = [dapp for dapp, _ in dapps]
+    results["detected_third_parties"] = [third_parties for _, third_parties in dapps]
+    for name in ["connected_dapps", "leaky_dapps", "third_parties"]:
+        results[name] = sorted(results[name], key=key)
+    for name in ["http_leaks", "encoded_leaks", "connect_labels", "metamask_labels"]:
+        partial[name] = dict(sorted(partial[name].items(), key=lambda item: key(item[0])))
+    partial["leak_records"] = sorted(partial["leak_records"], key=key)
+    return partial
+
+def save_partial_results(job, partial):
+    """Write the results of a finished category so that they survive a later crash."""
+    Checkpoint.write_json_atomically(get_partial_results_file(job), partial)
+    if os.path.exists(get_checkpoint_file(job["name"], job.get("shard"))):
+        os.remove(get_checkpoint_file(job["name"], job.get("shard")))
+
+def merge_shard_results(partials):
+    """Merge the partial results of one category computed by several shards into those of a single run."""
+    leak_records = Sharding.merge_lists(partials, "leak_records")
+    table = LeakTable.LeakTable()
+    for record in leak_records:
+        table.append(*record)
+    channel_counts = table.count_by("channel")
+    results = [partial["results"] for partial in partials]
+    return sort_partial({
+        "results": {
+            "total_dapps": Sharding.merge_lists(results, "total_dapps"),
+            "connected_dapps": Sharding.merge_lists(results, "connected_dapps"),
+            "leaky_dapps": Sharding.merge_lists(results, "leaky_dapps"),
+            "third_parties": table.unique("third_party"),
+            "get_leaks": channel_counts.get("GET", 0),
+            "post_leaks": channel_counts.get("POST", 0),
+            "websocket_leaks": channel_counts.get("WebSocket", 0),
+            "cookie_leaks": channel_counts.get("Cookies", 0),
+            "detected_third_parties": Sharding.merge_lists(results, "detected_third_parties")
+        },
+        "http_leaks": Sharding.merge_dict_lists(partials, "http_leaks"),
+        "encoded_leaks": Sharding.merge_dict_lists(partials, "encoded_leaks"),
+        "connect_labels": Sharding.merge_counts(partials, "connect_labels"),
+        "metamask_labels": Sharding.merge_counts(partials, "metamask_labels"),
+        "leak_records": leak_records
+    })
+
+def merge_partial_results(results, leak_tables, job, partial):
+    results[job["category"]] = partial["results"]
+    for origin in partial["http_leaks"]:
+        http_leaks.setdefault(origin, list()).extend(partial["http_leaks"][origin])
+    for dapp in partial["encoded_leaks"]:
+        encoded_leaks.setdefault(dapp, list()).extend(partial["encoded_leaks"][dapp])
+    for label in partial["connect_labels"]:
+        connect_labels[label] = connect_labels.get(label, 0) + partial["connect_labels"][label]
+    for label in partial["metamask_labels"]:
+        metamask_labels[label] = metamask_labels.get(label, 0) + partial["metamask_labels"][label]
+    table = LeakTable.LeakTable()
+    for record in partial["leak_records"]:
+        table.append(*record)
+    leak_tables.append(table)
 
-        total, leaks, connected, third_parties = parse_directory("../results/dapps/crawl/dapps_gambling/", ETH_ADDR, "gambling")
-        add_leaks_to_results(results, total, leaks, connected, third_parties, third_party_leaks, "Gambling")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find wallet address leaks in the DApp crawls.")
+    parser.add_argument("-m", "--manifest", help="JSON list of {\"category\", \"name\", \"directory\"} entries to analyse (default: the DAppRadar.com categories).")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="Number of worker processes shared by all categories.")
+    parser.add_argument("-r", "--resume", action="store_true", help="Continue an interrupted run: reuse finished categories and resume the others from their last checkpoint.")
+    parser.add_argument("--payload-store", metavar="FILE", help="Keep the distinct leak payloads in a SQLite file instead of in memory.")
+    parser.add_argument("-f", "--leak-format", choices=list(ResultSink.SINK_FORMATS), default="csv", help="Format of the per-category leak records (dapps_<category>_leaks.<format>).")
+    parser.add_argument("-s", "--shard", type=Sharding.parse_shard, metavar="I/N", help="Only analyse shard I of N (0-based) and write its partial results to dapps_results.shard-I-of-N.json.")
+    parser.add_argument("--merge", nargs="+", metavar="FILE", help="Merge the partial results written by the shards instead of analysing the crawls.")
+    AnalysisLog.add_arguments(parser, debug=DEBUG)
+    args = parser.parse_args()
+    AnalysisLog.setup_from_arguments(args)
 
-        total, leaks, connected, third_parties = parse_directory("../results/dapps/crawl/dapps_social/", ETH_ADDR, "social")
-        add_leaks_to_results(results, total, leaks, connected, third_parties, third_party_leaks, "Social")
+    results = dict()
+    leak_tables = list()
+
+    if args.merge or not os.path.exists("dapps_results.json"):
+        if args.merge:
+            shards = Sharding.load_partials(args.merge)
+            manifest = shards[0]["manifest"]
+            log("Merging the results of %s shards", len(shards), event="merge", shards=len(shards))
+            partials = dict()
+            for job in manifest:
+                partials[job["name"]] = merge_shard_results([shard["partials"][job["name"]] for shard in shards])
+        else:
+            manifest = CategoryRunner.load_manifest(args.manifest) if args.manifest else get_default_manifest()
+            for job in manifest:
+                job["leak_format"] = args.leak_format
+                job["resume"] = args.resume
+                job["payload_store"] = args.payload_store
+                job["shard"] = args.shard
+            partials = dict()
+            for job in manifest:
+                if args.resume and os.path.exists(get_partial_results_file(job)):
+                    log("Reusing results of finished category: %s", job["category"], event="reuse", category=job["category"])
+                    with open(get_partial_results_file(job), "r") as f:
+                        partials[job["name"]] = sort_partial(json.load(f))
+            pending = [job for job in manifest if not job["name"] in partials]
+            if pending:
+                runner = CategoryRunner.CategoryRunner(pending, analyse_category, workers=args.workers, on_result=save_partial_results)
+                partials.update(runner.run())
+            if args.shard:
+                # The tables are only printed once the shards are merged.
+                Checkpoint.write_json_atomically(get_shard_results_file(args.shard), {
+                    "shard": str(args.shard),
+                    "manifest": [{"category": job["category"], "name": job["name"], "directory": job["directory"]} for job in manifest],
+                    "partials": partials
+                })
+                log("Wrote the results of shard %s to %s", args.shard, get_shard_results_file(args.shard), event="shard", shard=str(args.shard), file=get_shard_results_file(args.shard))
+                sys.exit(0)
+        for job in manifest:
+            merge_partial_results(results, leak_tables, job, partials[job["name"]])
 
         results["http_leaks"] = http_leaks
         results["encoded_leaks"] = encoded_leaks
 
         with open("dapps_results.json", "w") as f:
-            json.dump(results, f, indent=4)
+            json.dump(results, f, separators=(",", ":"))
 
     print("connect_labels", connect_labels)
     print("metamask_labels", metamask_labels)
@@ -469,10 +431,13 @@ if __name__ == "__main__":
     print("DApps with insecure HTTP leaks:", len(results["http_leaks"]))
     print()
 
+    third_party_leaks = LeakTable.LeakTable.concat(leak_tables)
+    third_party_dapps = third_party_leaks.nunique("dapp", by="third_party")
+    third_party_channels = third_party_leaks.count_by("third_party", "channel")
     sorted_third_parties = dict()
-    for third_party in third_party_leaks:
-        sorted_third_parties[third_party] = [len(third_party_leaks[third_party]["DApps"]), len(third_party_leaks[third_party]["GET"]), len(third_party_leaks[third_party]["POST"]), len(third_party_leaks[third_party]["WebSocket"]), len(third_party_leaks[third_party]["Cookies"])]
-    sorted_third_parties = dict(sorted(sorted_third_parties.items(), key=lambda x:x[0]))
+    for third_party in third_party_dapps:
+        sorted_third_parties[third_party] = [third_party_dapps[third_party]] + [third_party_channels.get((third_party, channel), 0) for channel in LeakTable.CHANNELS]
+    sorted_third_parties = dict(sorted(sorted_third_parties.items(), key=lambda x:Sharding.sort_key(x[0])))
     sorted_third_parties = dict(sorted(sorted_third_parties.items(), key=lambda x:x[1][0], reverse=True))
     top = 20
     print("\\toprule")
@@ -481,6 +446,6 @@ if __name__ == "__main__":
     for i in range(len(sorted_third_parties)):
         if i < top:
             third_party = list(sorted_third_parties.keys())[i]
-            print(" & ", str("\\textbf{"+third_party+"}").ljust(26), " & ", " & ", " & ",sorted_third_parties[third_party][0], " & ", sorted_third_parties[third_party][1], " & ", sorted_third_parties[third_party][2], " & ", sorted_third_parties[third_party][3], " & ", sorted_third_parties[third_party][4], "\\\\")
+            print(" & ", str("\\textbf{"+str(third_party)+"}").ljust(26), " & ", " & ", " & ",sorted_third_parties[third_party][0], " & ", sorted_third_parties[third_party][1], " & ", sorted_third_parties[third_party][2], " & ", sorted_third_parties[third_party][3], " & ", sorted_third_parties[third_party][4], "\\\\")
     print("\\bottomrule")
     print()
@@ -4,237 +4,155 @@ import os
 import sys
 import csv
 import json
+import argparse
 import numpy
 import operator
 import matplotlib.pyplot as plt
-import publicsuffix2
 import networkx as nx
-import LeakDetector
+import LeakTable
+import CrawlStore
+import ResultSink
+import PayloadStore
+import Checkpoint
+import AnalysisLog
+import FrameContext
+import LeakPipeline
+import Sharding
 
-from urllib.parse import urlparse
+CRAWL_STORE = "../results/crawl_store.sqlite"
 
-MAX_LEAK_DETECTION_LAYERS = 3
+EXTENSIONS_CRAWL_FOLDER = "../results/extensions/crawl"
 
-DEBUG = False
-
-class colors:
-    INFO = '\033[94m'
-    OK = '\033[92m'
-    FAIL = '\033[91m'
-    END = '\033[0m'
+EXTENSION_LEAK_FIELDS = ["extension", "third_party", "get_leaks", "post_leaks", "websocket_leaks", "cookie_leaks"]
 
-def log(msg):
-    """Log the given message to stderr."""
-    print("[+] " + msg, file=sys.stderr)
+DEBUG = False
 
-def parse_file(file_name):
-    """Parse the given JSON file and return its content."""
-    with open(file_name, "r") as fd:
-            json_data = json.load(fd)
-    return json_data
+colors = AnalysisLog.colors
+log = AnalysisLog.log
 
 def get_etld1(url):
     """Return the given URL's eTLD+1."""
-    fqdn = urlparse(url).netloc
-    fqdn = fqdn.split(":")[0]
-    return publicsuffix2.get_sld(fqdn)
-
-def has_eth_addr(url, eth_address):
-    """Return True if the given URL contains our Ethereum address."""
-    url = url.lower()
-    return eth_address in url
-
-def is_irrelevant(req, extensionID):
-    for context in req["requestContext"]:
-        if extensionID in context:
-            return False
-    return True
-
-def are_unrelated(domain, origin):
-    """Return True if the two given domains are likely independent."""
-    if domain != None and "." in domain:
-        if origin.split('.')[-2] in domain.split('.')[-2]:
-            return False
-    return domain != origin
-
-def add_leak(domain, type, origin, leaks, leak, encoding):
-    if not origin in leaks:
-        leaks[origin] = dict()
-    if not type in leaks[origin]:
-        leaks[origin][type] = dict()
-    if not domain in leaks[origin][type]:
-        leaks[origin][type][domain] = list()
-    leaks[origin][type][domain].append((leak, encoding))
+    return FrameContext.get_etld1(url)
+
+PAYLOADS = PayloadStore.PayloadStore()
 
 http_leaks = dict()
 
 encoded_leaks = dict()
 
-def analyse_data(json_data):
-    reqs = json_data["requests"]
-    script_domains = set()
-    leaks = dict()
-
-    log("Analyzing requests for origin: "+colors.INFO+json_data["extensionID"]+colors.END)
-
+def get_extension_page(json_data):
+    """Search the crawl of an extension for its wallet address and password."""
+    origin = json_data["extensionID"]
     search_terms = []
     if json_data["walletAddress"]:
-        search_terms.append(json_data["walletAddress"].replace("0x", ""))
-        search_terms.append(json_data["walletAddress"].replace("0x", "").lower())
-        search_terms.append(json_data["walletAddress"].replace("0x", "").upper())
+        search_terms.extend(LeakPipeline.get_address_terms(json_data["walletAddress"].replace("0x", "")))
     if json_data["password"]:
         search_terms.append(json_data["password"])
     else:
-        print("!!!!!!")
-        print("password: '"+json_data["password"]+"'")
-        print("!!!!!!")
-
-    if len(search_terms) == 0:
-        return leaks, script_domains
-
-    detector = LeakDetector.LeakDetector(
-        search_terms,
-        encoding_set=LeakDetector.LIKELY_ENCODINGS,
-        hash_set=LeakDetector.LIKELY_HASHES,
-        encoding_layers=MAX_LEAK_DETECTION_LAYERS,
-        hash_layers=MAX_LEAK_DETECTION_LAYERS,
-        debugging=False
-    )
-
-    for req in reqs:
-        if is_irrelevant(req, json_data["extensionID"]):
-            continue
-        if json_data["extensionID"] in req["url"]:
-            continue
-        if req["url"].startswith("data:"):
-            continue
-
-        url = req["url"]
-        domain = get_etld1(url)
-        script_domains.add(domain)
-
-        # Get
-        url_leaks_detected = detector.check_url(req["url"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-        if len(url_leaks_detected) > 0:
-            encoding = ""
-            for url_leak in url_leaks_detected:
-                if url_leak[0].lower() != json_data["walletAddress"].replace("0x", "").lower():
-                    encoding = url_leak[0]
-                if url_leak[0] != json_data["password"]:
-                    encoding = url_leak[0]
-            if DEBUG:
-                log(colors.OK+"Found leak (GET): "+req["url"]+" "+encoding+colors.END)
-            add_leak(domain, "GET", json_data["arguments"]["walletPath"].split("/")[-1], leaks, req["url"], encoding)
-
-        # Post & WebSockets
-        if "postData" in req:
-            post_leaks_detected = detector.check_post_data(req["postData"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-            if len(post_leaks_detected) > 0:
-                type = req["type"] if req["type"] == "WebSocket" else "POST"
-                encoding = ""
-                for post_leak in post_leaks_detected:
-                    if post_leak[0].lower() != json_data["walletAddress"].replace("0x", "").lower():
-                        encoding = post_leak[0]
-                    if post_leak[0] != json_data["password"]:
-                        encoding = post_leak[0]
-                if DEBUG:
-                    log(colors.OK+"Found leak ("+type+"): "+req["url"]+colors.END)
-                add_leak(domain, type, json_data["arguments"]["walletPath"].split("/")[-1], leaks, req["postData"], encoding)
-
-        # Cookies
-        if "responseHeaders" in req and req["responseHeaders"] and "set-cookie" in req["responseHeaders"] and req["responseHeaders"]["set-cookie"]:
-            cookie_leaks_detected = detector.check_cookie_str(req["responseHeaders"]["set-cookie"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-            if len(cookie_leaks_detected) > 0:
-                encoding = ""
-                for cookie_leak in cookie_leaks_detected:
-                    if cookie_leak[0].lower() != json_data["walletAddress"].replace("0x", "").lower():
-                        encoding = cookie_leak[0]
-                    if cookie_leak[0] != json_data["password"]:
-                        encoding = cookie_leak[0]
-                add_leak(domain, "Cookies", json_data["arguments"]["walletPath"].split("/")[-1], leaks, req["responseHeaders"]["set-cookie"], encoding)
-
-    if "cookies" in json_data:
-        for cookie in json_data["cookies"]:
-            if are_unrelated(cookie["domain"], origin):
-                cookie_leaks_detected = detector.check_cookie_str(cookie["value"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-                if len(cookie_leaks_detected) > 0:
-                    encoding = ""
-                    for cookie_leak in cookie_leaks_detected:
-                        if cookie_leak[0].lower() != json_data["walletAddress"].replace("0x", "").lower():
-                            encoding = cookie_leak[0]
-                        if cookie_leak[0] != json_data["password"]:
-                            encoding = cookie_leak[0]
-                    add_leak(cookie["domain"], "Cookies", json_data["arguments"]["walletPath"].split("/")[-1], leaks, cookie["value"], encoding)
-                cookie_leaks_detected = detector.check_cookie_str(cookie["name"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-                if len(cookie_leaks_detected) > 0:
-                    encoding = ""
-                    for cookie_leak in cookie_leaks_detected:
-                        if cookie_leak[0].lower() != json_data["walletAddress"].replace("0x", "").lower():
-                            encoding = cookie_leak[0]
-                        if cookie_leak[0] != json_data["password"]:
-                            encoding = cookie_leak[0]
-                    add_leak(cookie["domain"], "Cookies", json_data["arguments"]["walletPath"].split("/")[-1], leaks, cookie["name"], encoding)
-
-    if DEBUG:
-        log("Third-parties: "+str(list(script_domains)))
-    log("Found "+colors.INFO+str(len(script_domains))+colors.END+" third-party script(s).")
-
-    return leaks, script_domains
-
-def parse_directory(directory):
-    """Iterate over the given directory and parse its JSON files."""
-    log("")
-    log("Parsing "+colors.INFO+directory+colors.END+" directory...")
+        AnalysisLog.warning("No password recorded for extension: %s", origin, event="no_password", origin=origin)
+    return LeakPipeline.Page(json_data, origin, origin, search_terms, label=json_data["arguments"]["walletPath"].split("/")[-1])
+
+def is_relevant_extension_request(page, req):
+    """Keep the requests of the extension's frames to other origins, except data: URLs."""
+    extension_id = page.json_data["extensionID"]
+    if not page.frames.mentions(req["requestContext"], extension_id):
+        return False
+    if extension_id in req["url"]:
+        return False
+    return not req["url"].startswith("data:")
+
+def classify_extension_request(page, req):
+    """Every remaining request of an extension goes to a third party."""
+    domain = get_etld1(req["url"])
+    page.third_parties.add(domain)
+    return domain, True
+
+def attribute_extension_leak(page, leaks_detected):
+    encoding = ""
+    wallet_address = page.json_data["walletAddress"].replace("0x", "").lower()
+    for leak in leaks_detected:
+        if leak[0].lower() != wallet_address:
+            encoding = leak[0]
+        if leak[0] != page.json_data["password"]:
+            encoding = leak[0]
+    return encoding
+
+PIPELINE = LeakPipeline.LeakPipeline(
+    "wallet_extensions",
+    get_extension_page,
+    relevant=is_relevant_extension_request,
+    classify=classify_extension_request,
+    attribute=attribute_extension_leak,
+    channels=("GET", "POST", "Cookies"),
+    match_plain=False
+)
+
+def analyse_data(json_data, sink=None):
+    page = PIPELINE.run(json_data, PAYLOADS, sink)
+    return page.leaks, page.third_parties
+
+def parse_directory(directory, sink=None, watch=False, idle_timeout=None, update=None, shard=None):
+    """Iterate over the given directory and parse its JSON files.
+
+    If given, every leak is also written to `sink` as a ResultSink.LEAK_FIELDS record.
+    With `watch`, the directory is watched for new crawl files (until no file
+    has arrived for `idle_timeout` seconds, if given) and `update(leaks,
+    third_parties)` is called after every batch of newly analysed files.
+    With a `shard`, only the files of that shard are parsed.
+    """
+    log("Parsing %s directory...", directory, event="directory", directory=directory)
 
     all_leaks = dict()
     all_third_parties_detected = set()
 
-    for file_name in os.listdir(directory):
-        file_name = os.path.join(directory, file_name)
-        if not os.path.isfile(file_name) or not file_name.endswith(".json"):
-            if DEBUG:
-                log("")
-                log("Skipping {}; not a JSON file.".format(file_name))
-            continue
+    store = CrawlStore.CrawlStore(CRAWL_STORE)
 
-        log("")
-        log("Parsing file: "+colors.INFO+file_name+colors.END)
-        try:
-            json_data = parse_file(file_name)
-        except:
-            print(colors.FAIL+"Error: Could not parse", file_name+colors.END)
-            continue
+    select = (lambda file_name: file_name in shard) if shard else None
+    if watch:
+        batches = store.watch(directory, select, idle_timeout=idle_timeout)
+    else:
+        batches = [store.read_ahead(directory, select=select)]
 
-        log("Extracted "+colors.INFO+str(len(json_data["requests"]))+colors.END+" requests from file: "+colors.INFO+file_name+colors.END)
+    for batch in batches:
+        for entry in batch:
+            file_name = entry.name
 
-        detected_leaks, detected_third_parties = analyse_data(json_data)
-        all_leaks.update(detected_leaks)
-        all_third_parties_detected.update(detected_third_parties)
+            log("Parsing file: %s", file_name, event="file", file=file_name)
+            try:
+                json_data = store.load_entry(entry)
+            except:
+                AnalysisLog.warning("Error: Could not parse %s", file_name, event="parse_error", file=file_name)
+                continue
 
-    return all_leaks, all_third_parties_detected
+            log("Extracted %s requests from file: %s", len(json_data["requests"]), file_name, event="requests", file=file_name, requests=len(json_data["requests"]))
 
-if __name__ == "__main__":
-    results = dict()
+            detected_leaks, detected_third_parties = analyse_data(json_data, sink)
+            all_leaks.update(detected_leaks)
+            all_third_parties_detected.update(detected_third_parties)
 
-    extension_names = dict()
-    with open('../datasets/wallets/extensions.csv', newline='') as csvfile:
-        reader = csv.reader(csvfile, delimiter=',', quotechar='"')
-        next(reader)
-        for row in reader:
-            extension_names[row[0]] = row[1]
+        if watch:
+            if sink:
+                # Make the leak file current as well.
+                sink.checkpoint()
+            if update:
+                update(all_leaks, all_third_parties_detected)
+
+    store.close()
 
-    leaks, third_parties_detected = parse_directory("../results/extensions/crawl")
+    return all_leaks, all_third_parties_detected
 
+def print_summary(leaks, third_parties_detected, extension_names):
+    """Print the leak table of the wallet extensions and write it to wallet_extension_leaks.csv."""
     valid_third_parties = ['mewapi.io', 'suiet.app','thebifrost.io', 'quarkchain.io', 'near.org', 'okex.org', 'iota.org', 'iotaichi.com', 'coinbase.com', 'phantom.app', 'keplr.app', 'coin98.com', 'timebird.network', 'martianwallet.xyz', 'gbrick.net', 'gamestop.com', "nu.fi", 'aptoslabs.com', 'petra-wallet.workers.dev', 'icon.foundation', 'pontem.network', 'sui.io']
 
+    third_parties_detected = set(third_parties_detected)
     for valid_third_party in valid_third_parties:
-        third_parties_detected.remove(valid_third_party)
+        third_parties_detected.discard(valid_third_party)
     print()
     print("Third-parties detected:", len(third_parties_detected))
     print()
 
-    with open("wallet_extension_leaks.csv", "w", encoding="utf-8", newline="") as csvfile:
-        writer = csv.writer(csvfile)
+    with ResultSink.CsvSink("wallet_extension_leaks.csv", EXTENSION_LEAK_FIELDS, header=False) as writer:
         print("\\toprule")
         print("\\textbf{Wallet Extension} & \\textbf{Third-Party} & \\textbf{GET} & \\textbf{POST} & \\textbf{WebSockets} & \\textbf{Cookies} \\\\")
         print("\\midrule")
@@ -243,65 +161,78 @@ if __name__ == "__main__":
         total_post_leaks = 0
         total_websocket_leaks = 0
         total_cookie_leaks = 0
+        table = LeakTable.LeakTable.from_leaks(leaks).select(channel=LeakTable.CHANNELS).exclude(third_party=valid_third_parties)
+        counts = table.count_by("dapp", "third_party", "channel")
+        extension_third_parties = dict()
+        for extension, third_party in table.unique("dapp", "third_party"):
+            extension_third_parties.setdefault(extension, list()).append(third_party)
         for extension in leaks:
             if extension_names[extension] == "Binance Wallet": # Skip Binance as it's only leaking to itself
                 continue
-            third_parties = set()
-            get_leaks = dict()
-            post_leaks = dict()
-            websocket_leaks = dict()
-            cookie_leaks = dict()
-            if "GET" in leaks[extension]:
-                for third_party in leaks[extension]["GET"]:
-                    if not third_party in valid_third_parties:
-                        third_parties.add(third_party)
-                        if not third_party in get_leaks:
-                            get_leaks[third_party] = 0
-                        get_leaks[third_party] += len(leaks[extension]["GET"][third_party])
-            if "POST" in leaks[extension]:
-                for third_party in leaks[extension]["POST"]:
-                    if not third_party in valid_third_parties:
-                        third_parties.add(third_party)
-                        if not third_party in post_leaks:
-                            post_leaks[third_party] = 0
-                        post_leaks[third_party] += len(leaks[extension]["POST"][third_party])
-            if "WebSocket" in leaks[extension]:
-                for third_party in leaks[extension]["WebSocket"]:
-                    if not third_party in valid_third_parties:
-                        third_parties.add(third_party)
-                        if not third_party in websocket_leaks:
-                            websocket_leaks[third_party] = 0
-                        websocket_leaks[third_party] += len(leaks[extension]["WebSocket"][third_party])
-            if "Cookies" in leaks[extension]:
-                for third_party in leaks[extension]["Cookies"]:
-                    if not third_party in valid_third_parties:
-                        third_parties.add(third_party)
-                        if not third_party in cookie_leaks:
-                            cookie_leaks[third_party] = 0
-                        cookie_leaks[third_party] += len(leaks[extension]["Cookies"][third_party])
-            if third_parties:
-                extension_name_output = False
-                for third_party in third_parties:
-                    total_third_parties.add(third_party)
-                    if not third_party in get_leaks:
-                        get_leaks[third_party] = 0
-                    if not third_party in post_leaks:
-                        post_leaks[third_party] = 0
-                    if not third_party in websocket_leaks:
-                        websocket_leaks[third_party] = 0
-                    if not third_party in cookie_leaks:
-                        cookie_leaks[third_party] = 0
-                    if not extension_name_output:
-                        writer.writerow([extension_names[extension], third_party, get_leaks[third_party], post_leaks[third_party], websocket_leaks[third_party], cookie_leaks[third_party]])
-                        print(extension_names[extension].replace("&", "\\&"), " & ", "\\textbf{"+str(third_party)+"}", " & ", get_leaks[third_party], " & ", post_leaks[third_party], " & ", websocket_leaks[third_party], " & ", cookie_leaks[third_party], "\\\\")
-                    else:
-                        writer.writerow([extension_names[extension], third_party, get_leaks[third_party], post_leaks[third_party], websocket_leaks[third_party], cookie_leaks[third_party]])
-                        print(" & ", "\\textbf{"+str(third_party)+"}", " & ", get_leaks[third_party], " & ", post_leaks[third_party], " & ", websocket_leaks[third_party], " & ", cookie_leaks[third_party], "\\\\")
-                    total_get_leaks += get_leaks[third_party]
-                    total_post_leaks += post_leaks[third_party]
-                    total_websocket_leaks += websocket_leaks[third_party]
-                    total_cookie_leaks += cookie_leaks[third_party]
-                    extension_name_output = True
+            extension_name_output = False
+            for third_party in extension_third_parties.get(extension, []):
+                total_third_parties.add(third_party)
+                get_leaks, post_leaks, websocket_leaks, cookie_leaks = [counts.get((extension, third_party, channel), 0) for channel in LeakTable.CHANNELS]
+                writer.write((extension_names[extension], third_party, get_leaks, post_leaks, websocket_leaks, cookie_leaks))
+                if not extension_name_output:
+                    print(extension_names[extension].replace("&", "\\&"), " & ", "\\textbf{"+str(third_party)+"}", " & ", get_leaks, " & ", post_leaks, " & ", websocket_leaks, " & ", cookie_leaks, "\\\\")
+                else:
+                    print(" & ", "\\textbf{"+str(third_party)+"}", " & ", get_leaks, " & ", post_leaks, " & ", websocket_leaks, " & ", cookie_leaks, "\\\\")
+                total_get_leaks += get_leaks
+                total_post_leaks += post_leaks
+                total_websocket_leaks += websocket_leaks
+                total_cookie_leaks += cookie_leaks
+                extension_name_output = True
         print("\\midrule")
         print("\\textbf{Total} & ", len(total_third_parties), " & ", total_get_leaks, " & ", total_post_leaks, " & ", total_websocket_leaks, " & ", total_cookie_leaks, "\\\\")
         print("\\bottomrule")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find password and wallet address leaks of the wallet extensions.")
+    parser.add_argument("--leaks", metavar="FILE", help="Write every detected leak to FILE (.csv, .jsonl or .npz).")
+    parser.add_argument("--payload-store", metavar="FILE", help="Keep the distinct leak payloads in a SQLite file instead of in memory.")
+    parser.add_argument("-d", "--directory", default=EXTENSIONS_CRAWL_FOLDER, help="Directory with the crawl files of the wallet extensions (default: %(default)s).")
+    parser.add_argument("-w", "--watch", action="store_true", help="Keep watching the directory and analyse crawl files as they are written.")
+    parser.add_argument("--idle-timeout", metavar="SECONDS", type=float, help="With --watch, stop once no crawl file has arrived for SECONDS.")
+    parser.add_argument("-s", "--shard", type=Sharding.parse_shard, metavar="I/N", help="Only analyse shard I of N (0-based) and write its leaks to extensions_results.shard-I-of-N.json.")
+    parser.add_argument("--merge", nargs="+", metavar="FILE", help="Merge the leaks written by the shards instead of analysing the crawls.")
+    AnalysisLog.add_arguments(parser, debug=DEBUG)
+    args = parser.parse_args()
+    AnalysisLog.setup_from_arguments(args)
+
+    results = dict()
+
+    extension_names = dict()
+    with open('../datasets/wallets/extensions.csv', newline='') as csvfile:
+        reader = csv.reader(csvfile, delimiter=',', quotechar='"')
+        next(reader)
+        for row in reader:
+            extension_names[row[0]] = row[1]
+
+    sink = ResultSink.open_sink(args.leaks) if args.leaks else None
+    PAYLOADS = PayloadStore.PayloadStore(args.payload_store)
+    if args.merge:
+        shards = Sharding.load_partials(args.merge)
+        log("Merging the leaks of %s shards", len(shards), event="merge", shards=len(shards))
+        leaks = PayloadStore.compact_leaks(Sharding.merge_leaks(shards, "leaks"), PAYLOADS)
+        third_parties_detected = set(Sharding.merge_lists(shards, "third_parties"))
+    else:
+        update = lambda leaks, third_parties_detected: print_summary(leaks, third_parties_detected, extension_names)
+        leaks, third_parties_detected = parse_directory(args.directory, sink, args.watch, args.idle_timeout, update, args.shard)
+    if sink:
+        sink.close()
+
+    if args.shard and not args.merge:
+        # The summary is only printed once the shards are merged.
+        shard_file = "extensions_results"+args.shard.suffix()+".json"
+        Checkpoint.write_json_atomically(shard_file, {
+            "shard": str(args.shard),
+            "leaks": PayloadStore.expand_leaks(leaks, PAYLOADS),
+            "third_parties": sorted(third_parties_detected, key=Sharding.sort_key)
+        })
+        log("Wrote the leaks of shard %s to %s", args.shard, shard_file, event="shard", shard=str(args.shard), file=shard_file)
+        PAYLOADS.close()
+        sys.exit(0)
+    PAYLOADS.close()
+
+    print_summary(leaks, third_parties_detected, extension_names)
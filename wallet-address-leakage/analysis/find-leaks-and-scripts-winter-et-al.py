@@ -3,183 +3,47 @@
 import json
 import os
 import sys
+import argparse
 import matplotlib.pyplot as plt
-import publicsuffix2
 import networkx as nx
-import LeakDetector
-
-from urllib.parse import urlparse
-
-MAX_LEAK_DETECTION_LAYERS = 3
+import LeakTable
+import CrawlStore
+import ResultSink
+import PayloadStore
+import Checkpoint
+import AnalysisLog
+import FrameContext
+import LeakPipeline
+import DependencyGraph
+import Sharding
+
+CRAWL_STORE = "../results/crawl_store.sqlite"
 
 ETH_ADDR_WHATS_IN_YOUR_WALLET = "FDb672F061E5718eF0A56Db332e08616e9055548"
 ETH_ADDR = "7e4ABd63A7C8314Cc28D388303472353D884f292"
 
 DEBUG = False
 
-class colors:
-    INFO = '\033[94m'
-    OK = '\033[92m'
-    FAIL = '\033[91m'
-    END = '\033[0m'
-
-def log(msg):
-    """Log the given message to stderr."""
-    print("[+] " + msg, file=sys.stderr)
-
-def parse_file(file_name):
-    """Parse the given JSON file and return its content."""
-    with open(file_name, "r") as fd:
-            json_data = json.load(fd)
-    return json_data
+colors = AnalysisLog.colors
+log = AnalysisLog.log
 
 def get_etld1(url):
     """Return the given URL's eTLD+1."""
-    fqdn = urlparse(url).netloc
-    return publicsuffix2.get_sld(fqdn)
-
-def has_eth_addr(url, eth_address):
-    """Return True if the given URL contains our Ethereum address."""
-    url = url.lower()
-    return eth_address in url
-
-def is_irrelevant(req):
-    """Return True if the given request is irrelevant to our data analysis."""
-    if req["url"].startswith("chrome-extension://"):
-        return True
-    return False
-
-def is_same_request_context(request_context, origin):
-    same = True
-    for url in request_context:
-        if get_etld1(url) != origin:
-            same = False
-    return same
-
-def are_unrelated(domain, origin):
-    """Return True if the two given domains are likely independent."""
-    if domain != None and "." in domain:
-        if origin.split('.')[-2] in domain.split('.')[-2]:
-            return False
-    return domain != origin
-
-def add_leak(domain, type, origin, leaks, leak, encoding):
-    if not origin in leaks:
-        leaks[origin] = dict()
-    if not type in leaks[origin]:
-        leaks[origin][type] = dict()
-    if not domain in leaks[origin][type]:
-        leaks[origin][type][domain] = list()
-    leaks[origin][type][domain].append((leak, encoding))
-
-def analyse_data(json_data, G, script_nodes, edges, addr_leaks, post_leaks, eth_address):
-    origin = json_data["url"]
-    reqs = json_data["requests"]
-    script_domains = set()
-    req_dst = {}
-    origin = get_etld1(origin)
-    log("Analyzing requests for origin: "+colors.INFO+origin+colors.END)
-
-    search_terms = [eth_address, eth_address.lower(), eth_address.upper()]
-
-    detector = LeakDetector.LeakDetector(
-        search_terms,
-        encoding_set=LeakDetector.LIKELY_ENCODINGS,
-        hash_set=LeakDetector.LIKELY_HASHES,
-        encoding_layers=MAX_LEAK_DETECTION_LAYERS,
-        hash_layers=MAX_LEAK_DETECTION_LAYERS,
-        debugging=False
-    )
-
-    leaks = {}
-
-    for req in reqs:
-        if is_irrelevant(req):
-            continue
-        if not is_same_request_context(req["requestContext"], origin):
-            continue
-        url = req["url"]
-        domain = get_etld1(url)
-
-        if domain != origin and domain != None:
-            G.add_node(domain)
-            script_domains.add(domain)
-            script_nodes.add(domain)
-            edges.append(tuple([origin, domain]))
-
-        if are_unrelated(domain, origin):
-            # Get
-            url_leaks_detected = detector.check_url(req["url"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-            if len(url_leaks_detected) > 0 or has_eth_addr(req["url"], eth_address.lower()):
-                encoding = ""
-                for url_leak in url_leaks_detected:
-                    if url_leak[0].lower() != eth_address.lower():
-                        encoding = url_leak[0]
-                if DEBUG:
-                    log(colors.OK+"Found leak (GET): "+req["url"]+" "+encoding+colors.END)
-                addr_leaks[origin] = addr_leaks.get(origin, 0) + 1
-                add_leak(domain, "GET", origin, leaks, req["url"], encoding)
-
-            # Post & WebSockets
-            if "postData" in req:
-                post_leaks_detected = detector.check_post_data(req["postData"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-                if len(post_leaks_detected) > 0 or has_eth_addr(req["postData"], eth_address.lower()):
-                    type = req["type"] if req["type"] == "WebSocket" else "POST"
-                    encoding = ""
-                    for post_leak in post_leaks_detected:
-                        if post_leak[0].lower() != eth_address.lower():
-                            encoding = post_leak[0]
-                    if DEBUG:
-                        log(colors.OK+"Found leak ("+type+"): "+req["url"]+colors.END)
-                    addr_leaks[origin] = addr_leaks.get(origin, 0) + 1
-                    post_leaks[origin] = post_leaks.get(origin, 0) + 1
-                    add_leak(domain, type, origin, leaks, req["postData"], encoding)
-
-            # Referer
-            if "headers" in req and "referer" in req["headers"] and req["headers"]["referer"]:
-                referrer_leaks_detected = detector.check_referrer_str(req["headers"]["referer"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-                if len(referrer_leaks_detected) > 0 or has_eth_addr(req["headers"]["referer"], eth_address.lower()):
-                    encoding = ""
-                    for referrer_leak in referrer_leaks_detected:
-                        if referrer_leak[0].lower() != eth_address.lower():
-                            encoding = referrer_leak[0]
-                    add_leak(domain, "Referer", origin, leaks, req["headers"]["referer"], encoding)
-
-            # Cookies
-            if "responseHeaders" in req and req["responseHeaders"] and "set-cookie" in req["responseHeaders"] and req["responseHeaders"]["set-cookie"]:
-                cookie_leaks_detected = detector.check_cookie_str(req["responseHeaders"]["set-cookie"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-                if len(cookie_leaks_detected) > 0 or has_eth_addr(req["responseHeaders"]["set-cookie"], eth_address.lower()):
-                    encoding = ""
-                    for cookie_leak in cookie_leaks_detected:
-                        if cookie_leak[0].lower() != eth_address.lower():
-                            encoding = cookie_leak[0]
-                    add_leak(domain, "Cookies", origin, leaks, req["responseHeaders"]["set-cookie"], encoding)
-
-        req_dst[domain] = req_dst.get(domain, 0) + 1
-
-    if "cookies" in json_data:
-        for cookie in json_data["cookies"]:
-            if are_unrelated(cookie["domain"], origin):
-                cookie_leaks_detected = detector.check_cookie_str(cookie["value"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-                if len(cookie_leaks_detected) > 0 or has_eth_addr(cookie["value"], eth_address.lower()):
-                    encoding = ""
-                    for cookie_leak in cookie_leaks_detected:
-                        if cookie_leak[0].lower() != eth_address.lower():
-                            encoding = cookie_leak[0]
-                    add_leak(cookie["domain"], "Cookies", origin, leaks, cookie["value"], encoding)
-                cookie_leaks_detected = detector.check_cookie_str(cookie["name"], encoding_layers=MAX_LEAK_DETECTION_LAYERS)
-                if len(cookie_leaks_detected) > 0 or has_eth_addr(cookie["name"], eth_address.lower()):
-                    encoding = ""
-                    for cookie_leak in cookie_leaks_detected:
-                        if cookie_leak[0].lower() != eth_address.lower():
-                            encoding = cookie_leak[0]
-                    add_leak(cookie["domain"], "Cookies", origin, leaks, cookie["name"], encoding)
-
-    if DEBUG:
-        log("Third-parties: "+str(list(script_domains)))
-    log("Found "+colors.INFO+str(len(script_domains))+colors.END+" third-party script(s).")
-
-    return leaks
+    return FrameContext.get_etld1(url, strip_port=False)
+
+PAYLOADS = PayloadStore.PayloadStore()
+
+def analyse_data(json_data, graph, addr_leaks, post_leaks, eth_address, sink=None, category=""):
+    pipeline = LeakPipeline.LeakPipeline("winter_et_al", LeakPipeline.site_page(eth_address, strip_port=False))
+    page = pipeline.run(json_data, PAYLOADS, sink, category, graph)
+    for origin in page.leaks:
+        for type in page.leaks[origin]:
+            if type in ("GET", "POST", "WebSocket"):
+                num_leaks = sum([len(leaks) for leaks in page.leaks[origin][type].values()])
+                addr_leaks[origin] = addr_leaks.get(origin, 0) + num_leaks
+                if type != "GET":
+                    post_leaks[origin] = post_leaks.get(origin, 0) + num_leaks
+    return page.leaks
 
 def print_leaks(total, addr_leaks, post_leaks, whats_in_your_wallet_leaks):
     log("")
@@ -201,33 +65,33 @@ def print_leaks(total, addr_leaks, post_leaks, whats_in_your_wallet_leaks):
                 print("  {} \t {} ".format(num_leaks, origin))
     log(" [P] This indicates that leaks happened via HTTP POST requests.")
 
-def print_sourced_script_popularity():
+def print_sourced_script_popularity(graph):
     """Print the domains whose scripts are sourced by DeFi sites."""
 
-    sorted_script_domains = sorted(script_nodes, key=lambda x:
-                                   len([edge for edge in set(edges)]),
-                                   reverse=True)
-    log("# of embedded 3rd party domains: {}".format(len(sorted_script_domains)))
-    for script_domain in sorted_script_domains:
-        num = len([e for e in set(edges) if script_domain in e])
+    popularity = graph.popularity()
+    log("# of embedded 3rd party domains: {}".format(len(popularity)))
+    for script_domain, num in popularity:
         print("{} & {} \\\\".format(script_domain, num))
 
-    n = len(set([edge[0] for edge in edges]))
+    n = graph.reach()
     log("# of DeFi sites that embed at least one script: {} ({:.0%})".format(
-        n, n / len(defi_nodes)))
+        n, n / len(graph.sites)))
 
-    # Find all edges that point to Google.
-    n = len(set([edge[0] for edge in edges if "google" in edge[1]]))
+    # Find all sites that embed scripts from Google.
+    n = graph.reach(lambda script_domain: "google" in script_domain)
     log("# of DeFi sites that embed Google scripts: {} ({:.0%})".format(
-        n, n / len(defi_nodes)))
+        n, n / len(graph.sites)))
 
-def create_connectivity_graph():
+def create_connectivity_graph(graph):
     """Create a connectivity graph of DeFi sites and their sourced scripts."""
+    G = graph.to_networkx()
+    defi_nodes = [node for node, part in G.nodes(data="bipartite") if part == 0]
+    script_nodes = [node for node, part in G.nodes(data="bipartite") if part == 1]
     pos = nx.bipartite_layout(G, defi_nodes, align="horizontal")
     options = {"edgecolors": "tab:gray", "node_size": 800, "alpha": 0.9}
-    nx.draw_networkx_nodes(G, pos, nodelist=list(defi_nodes), node_color="tab:blue", **options)
+    nx.draw_networkx_nodes(G, pos, nodelist=defi_nodes, node_color="tab:blue", **options)
     nx.draw_networkx_nodes(G, pos, nodelist=script_nodes, node_color="tab:red", **options)
-    nx.draw_networkx_edges(G, pos, edgelist=edges, width=2, alpha=0.3, edge_color="tab:gray")
+    nx.draw_networkx_edges(G, pos, edgelist=list(G.edges()), width=2, alpha=0.3, edge_color="tab:gray")
 
     labels = {key: key for key in defi_nodes}
     text = nx.draw_networkx_labels(G, pos, labels, font_size=22)
@@ -242,15 +106,22 @@ def create_connectivity_graph():
     plt.tight_layout()
     plt.show()
 
-def parse_directory(directory, eth_address):
-    """Iterate over the given directory and parse its JSON files."""
-    log("")
-    log("Parsing "+colors.INFO+directory+colors.END+" directory...")
+def parse_directory(directory, eth_address, sink=None, category="", graph=None, watch=False, idle_timeout=None, update=None, shard=None):
+    """Iterate over the given directory and parse its JSON files.
 
-    G = nx.DiGraph()
-    defi_nodes = set()
-    script_nodes = set()
-    edges = []
+    The sites and the third-party domains they embed are added to `graph`
+    (a DependencyGraph) if given.
+
+    If given, every leak is also written to `sink` as a ResultSink.LEAK_FIELDS record.
+    With `watch`, the directory is watched for new crawl files (until no file
+    has arrived for `idle_timeout` seconds, if given) and `update(leaks)` is
+    called after every batch of newly analysed files. With a `shard`, only
+    the files of that shard are parsed.
+    """
+    log("Parsing %s directory...", directory, event="directory", directory=directory)
+
+    if graph is None:
+        graph = DependencyGraph.DependencyGraph()
     addr_leaks = {}
 
     total_sites = 0
@@ -263,55 +134,66 @@ def parse_directory(directory, eth_address):
 
     leaks = dict()
 
-    for file_name in os.listdir(directory):
-        file_name = os.path.join(directory, file_name)
-        if not os.path.isfile(file_name) or not file_name.endswith(".json"):
-            if DEBUG:
-                log("")
-                log("Skipping {}; not a JSON file.".format(file_name))
-            continue
+    store = CrawlStore.CrawlStore(CRAWL_STORE)
 
-        total_sites += 1
+    select = (lambda file_name: file_name in shard) if shard else None
+    if watch:
+        batches = store.watch(directory, select, idle_timeout=idle_timeout)
+    else:
+        batches = [store.read_ahead(directory, select=select)]
 
-        log("")
-        log("Parsing file: "+colors.INFO+file_name+colors.END)
-        try:
-            json_data = parse_file(file_name)
-        except:
-            print(colors.FAIL+"Error: Could not parse", file_name+colors.END)
-            continue
+    for batch in batches:
+        for entry in batch:
+            file_name = entry.name
 
-        log("Extracted "+colors.INFO+str(len(json_data["requests"]))+colors.END+" requests from file: "+colors.INFO+file_name+colors.END)
+            total_sites += 1
 
-        # Add DeFi site as new node to dependency graph.
+            log("Parsing file: %s", file_name, event="file", file=file_name)
+            try:
+                json_data = store.load_entry(entry)
+            except:
+                AnalysisLog.warning("Error: Could not parse %s", file_name, event="parse_error", file=file_name)
+                continue
 
-        defi_domain = get_etld1(json_data["url"])
-        G.add_node(defi_domain)
-        defi_nodes.add(defi_domain)
+            log("Extracted %s requests from file: %s", len(json_data["requests"]), file_name, event="requests", file=file_name, requests=len(json_data["requests"]))
 
-        leaks.update(analyse_data(json_data, G, script_nodes, edges, addr_leaks, post_leaks, eth_address))
+            # Add DeFi site as new node to dependency graph.
 
-        """if json_data["success"]:
-            successful += 1
-        else:
-            print(colors.FAIL+json_data["msg"]+colors.END)
+            defi_domain = get_etld1(json_data["url"])
+            graph.add_site(defi_domain)
 
-        if json_data["connected"]:
-            connected += 1
-        else:
-            log(colors.FAIL+"Could not connect MetaMask to: "+json_data["url"]+colors.END)
+            leaks.update(analyse_data(json_data, graph, addr_leaks, post_leaks, eth_address, sink, category))
 
-        if json_data["connect_label"]:
-            if not json_data["connect_label"] in connect_labels:
-                connect_labels[json_data["connect_label"]] = 0
-            connect_labels[json_data["connect_label"]] += 1
-            connect_labels = dict(sorted(connect_labels.items(), key=lambda item: item[1]))
+            """if json_data["success"]:
+                successful += 1
+            else:
+                print(colors.FAIL+json_data["msg"]+colors.END)
+
+            if json_data["connected"]:
+                connected += 1
+            else:
+                log(colors.FAIL+"Could not connect MetaMask to: "+json_data["url"]+colors.END)
 
-        if json_data["metamask_label"]:
-            if not json_data["metamask_label"] in metamask_labels:
-                metamask_labels[json_data["metamask_label"]] = 0
-            metamask_labels[json_data["metamask_label"]] += 1
-            metamask_labels = dict(sorted(metamask_labels.items(), key=lambda item: item[1]))"""
+            if json_data["connect_label"]:
+                if not json_data["connect_label"] in connect_labels:
+                    connect_labels[json_data["connect_label"]] = 0
+                connect_labels[json_data["connect_label"]] += 1
+                connect_labels = dict(sorted(connect_labels.items(), key=lambda item: item[1]))
+
+            if json_data["metamask_label"]:
+                if not json_data["metamask_label"] in metamask_labels:
+                    metamask_labels[json_data["metamask_label"]] = 0
+                metamask_labels[json_data["metamask_label"]] += 1
+                metamask_labels = dict(sorted(metamask_labels.items(), key=lambda item: item[1]))"""
+
+        if watch:
+            if sink:
+                # Make the leak file current as well.
+                sink.checkpoint()
+            if update:
+                update(leaks)
+
+    store.close()
 
     #log("")
     #log("Successful: "+str(successful)+"/"+str(total_sites)+"("+"{:.2f}".format(successful/total_sites*100.0)+"%)")
@@ -334,118 +216,58 @@ def compare_leaks(other_leaks, our_leaks):
     print("\\textbf{DeFi Website} & \\textbf{GET}~\cite{winter2021web3} & \\textbf{GET} & \\textbf{POST} & \\textbf{WebSockets} & \\textbf{Cookies} \\\\")
     print("\\midrule")
 
-    whats_in_your_wallet_third_parties_mapping = dict()
-    whats_in_your_wallet_leaky_websites = 0
-    whats_in_your_wallet_third_parties = set()
-    whats_in_your_wallet_total_leaks = 0
-
-    our_leaky_third_parties = dict()
-    our_leaky_websites = 0
-
-    our_leaky_gets_total = 0
-    our_leaky_posts_total = 0
-    our_leaky_websockets_total = 0
-    our_leaky_cookies_total = 0
-
-    our_leaky_gets_total_overlap = 0
-    our_leaky_posts_total_overlap = 0
-    our_leaky_websockets_total_overlap = 0
-    our_leaky_cookies_total_overlap = 0
+    other_table = LeakTable.LeakTable.from_leaks(other_leaks).select(channel="GET")
+    our_table = LeakTable.LeakTable.from_leaks(our_leaks).select(channel=LeakTable.CHANNELS)
+    overlap_table = our_table.take(our_table.isin(other_table, "dapp", "third_party"))
 
-    total_post_websocket_cookies_leaks = 0
+    whats_in_your_wallet_leaky_websites = 0
+    whats_in_your_wallet_third_parties = set(other_table.unique("third_party"))
+    whats_in_your_wallet_total_leaks = len(other_table)
+    whats_in_your_wallet_domain_leaks = other_table.count_by("dapp")
+
+    our_leaky_third_parties = set(our_table.unique("third_party"))
+    our_leaky_websites = len(our_leaks)
+    our_domain_leaks = our_table.count_by("dapp", "channel")
+    our_domain_leaks_overlap = overlap_table.count_by("dapp", "channel")
+    our_total_leaks = our_table.count_by("channel")
+    our_total_leaks_overlap = overlap_table.count_by("channel")
+
+    our_leaky_gets_total = our_total_leaks.get("GET", 0)
+    our_leaky_posts_total = our_total_leaks.get("POST", 0)
+    our_leaky_websockets_total = our_total_leaks.get("WebSocket", 0)
+    our_leaky_cookies_total = our_total_leaks.get("Cookies", 0)
+
+    our_leaky_gets_total_overlap = our_total_leaks_overlap.get("GET", 0)
+    our_leaky_posts_total_overlap = our_total_leaks_overlap.get("POST", 0)
+    our_leaky_websockets_total_overlap = our_total_leaks_overlap.get("WebSocket", 0)
+    our_leaky_cookies_total_overlap = our_total_leaks_overlap.get("Cookies", 0)
+
+    total_post_websocket_cookies_leaks = our_leaky_posts_total + our_leaky_websockets_total + our_leaky_cookies_total
+
+    our_cookie_leaks = dict()
+    cookie_table = our_table.select(channel="Cookies")
+    for (domain, _, third_party, _, encoding), leak in zip(cookie_table.records(), cookie_table.payloads()):
+        if not domain in our_cookie_leaks:
+            our_cookie_leaks[domain] = list()
+        our_cookie_leaks[domain].append((third_party, (leak, encoding)))
 
     for domain in sorted_domains:
-        whats_in_your_wallet_third_parties_mapping[domain] = list()
-        whats_in_your_wallet_leaks= 0
-
         if domain in other_leaks:
-            for third_party in other_leaks[domain]["GET"]:
-                whats_in_your_wallet_third_parties.add(third_party)
-                whats_in_your_wallet_total_leaks += len(other_leaks[domain]["GET"][third_party])
-                whats_in_your_wallet_leaks+= len(other_leaks[domain]["GET"][third_party])
-                whats_in_your_wallet_third_parties_mapping[domain].append(third_party)
+            whats_in_your_wallet_leaks = whats_in_your_wallet_domain_leaks.get(domain, 0)
         else:
-            whats_in_your_wallet_leaks= "0"
-
-        our_leaks_number_get_third_parties, our_leaks_number_get_third_parties_overlap = 0, 0
-        our_leaks_number_post_third_parties, our_leaks_number_post_third_parties_overlap = 0, 0
-        our_leaks_number_websocket_third_parties, our_leaks_number_websocket_third_parties_overlap = 0, 0
-        our_leaks_number_cookie_third_parties, our_leaks_number_cookie_third_parties_overlap = 0, 0
-
-        if domain in our_leaks:
-            our_leaky_websites += 1
-            if "GET" in our_leaks[domain]:
-                for third_party in our_leaks[domain]["GET"]:
-                    if not third_party in our_leaky_third_parties:
-                        our_leaky_third_parties[third_party] = dict()
-                        our_leaky_third_parties[third_party]["GET"] = list()
-                        our_leaky_third_parties[third_party]["POST"] = list()
-                        our_leaky_third_parties[third_party]["WebSocket"] = list()
-                        our_leaky_third_parties[third_party]["Cookies"] = list()
-                    if not domain in our_leaky_third_parties[third_party]:
-                        our_leaky_third_parties[third_party]["GET"].append(domain)
-                    our_leaks_number_get_third_parties += len(our_leaks[domain]["GET"][third_party])
-                    our_leaky_gets_total += len(our_leaks[domain]["GET"][third_party])
-                    if third_party in whats_in_your_wallet_third_parties_mapping[domain]:
-                        our_leaks_number_get_third_parties_overlap += len(our_leaks[domain]["GET"][third_party])
-                        our_leaky_gets_total_overlap += len(our_leaks[domain]["GET"][third_party])
-            if "POST" in our_leaks[domain]:
-                for third_party in our_leaks[domain]["POST"]:
-                    if not third_party in our_leaky_third_parties:
-                        our_leaky_third_parties[third_party] = dict()
-                        our_leaky_third_parties[third_party]["GET"] = list()
-                        our_leaky_third_parties[third_party]["POST"] = list()
-                        our_leaky_third_parties[third_party]["WebSocket"] = list()
-                        our_leaky_third_parties[third_party]["Cookies"] = list()
-                    if not domain in our_leaky_third_parties[third_party]:
-                        our_leaky_third_parties[third_party]["POST"].append(domain)
-                    our_leaks_number_post_third_parties += len(our_leaks[domain]["POST"][third_party])
-                    our_leaky_posts_total += len(our_leaks[domain]["POST"][third_party])
-                    total_post_websocket_cookies_leaks += len(our_leaks[domain]["POST"][third_party])
-                    if third_party in whats_in_your_wallet_third_parties_mapping[domain]:
-                        our_leaks_number_post_third_parties_overlap += len(our_leaks[domain]["POST"][third_party])
-                        our_leaky_posts_total_overlap += len(our_leaks[domain]["POST"][third_party])
-            if "WebSocket" in our_leaks[domain]:
-                for third_party in our_leaks[domain]["WebSocket"]:
-                    if not third_party in our_leaky_third_parties:
-                        our_leaky_third_parties[third_party] = dict()
-                        our_leaky_third_parties[third_party]["GET"] = list()
-                        our_leaky_third_parties[third_party]["POST"] = list()
-                        our_leaky_third_parties[third_party]["WebSocket"] = list()
-                        our_leaky_third_parties[third_party]["Cookies"] = list()
-                    if not domain in our_leaky_third_parties[third_party]:
-                        our_leaky_third_parties[third_party]["WebSocket"].append(domain)
-                    our_leaks_number_websocket_third_parties += len(our_leaks[domain]["WebSocket"][third_party])
-                    our_leaky_websockets_total += len(our_leaks[domain]["WebSocket"][third_party])
-                    total_post_websocket_cookies_leaks += len(our_leaks[domain]["WebSocket"][third_party])
-                    if third_party in whats_in_your_wallet_third_parties_mapping[domain]:
-                        our_leaks_number_websocket_third_parties_overlap += len(our_leaks[domain]["WebSocket"][third_party])
-                        our_leaky_websockets_total_overlap += len(our_leaks[domain]["WebSocket"][third_party])
-            if "Cookies" in our_leaks[domain]:
-                for third_party in our_leaks[domain]["Cookies"]:
-                    if not third_party in our_leaky_third_parties:
-                        our_leaky_third_parties[third_party] = dict()
-                        our_leaky_third_parties[third_party]["GET"] = list()
-                        our_leaky_third_parties[third_party]["POST"] = list()
-                        our_leaky_third_parties[third_party]["WebSocket"] = list()
-                        our_leaky_third_parties[third_party]["Cookies"] = list()
-                    if not domain in our_leaky_third_parties[third_party]:
-                        our_leaky_third_parties[third_party]["Cookies"].append(domain)
-                    for leak in our_leaks[domain]["Cookies"][third_party]:
-                        print(third_party, leak)
-                    our_leaks_number_cookie_third_parties += len(our_leaks[domain]["Cookies"][third_party])
-                    our_leaky_cookies_total += len(our_leaks[domain]["Cookies"][third_party])
-                    total_post_websocket_cookies_leaks += len(our_leaks[domain]["Cookies"][third_party])
-                    if third_party in whats_in_your_wallet_third_parties_mapping[domain]:
-                        our_leaks_number_cookie_third_parties_overlap += len(our_leaks[domain]["Cookies"][third_party])
-                        our_leaky_cookies_total_overlap += len(our_leaks[domain]["Cookies"][third_party])
-
-        our_leaks_number_get_third_parties_overlap = "("+str(our_leaks_number_get_third_parties_overlap)+")"
-        our_leaks_number_post_third_parties_overlap = "("+str(our_leaks_number_post_third_parties_overlap)+")"
-        our_leaks_number_websocket_third_parties_overlap = "("+str(our_leaks_number_websocket_third_parties_overlap)+")"
-        our_leaks_number_cookie_third_parties_overlap = "("+str(our_leaks_number_cookie_third_parties_overlap)+")"
-
-        print(str("\\textbf{"+domain+"}").ljust(26), "&", whats_in_your_wallet_leaks, " & ", our_leaks_number_get_third_parties, our_leaks_number_get_third_parties_overlap, " & ", our_leaks_number_post_third_parties, our_leaks_number_post_third_parties_overlap, " & ", our_leaks_number_websocket_third_parties, our_leaks_number_websocket_third_parties_overlap, " & ", our_leaks_number_cookie_third_parties, our_leaks_number_cookie_third_parties_overlap, "\\\\")
+            whats_in_your_wallet_leaks = "0"
+
+        if AnalysisLog.is_tracing():
+            for third_party, (leak, encoding) in our_cookie_leaks.get(domain, []):
+                leak = PAYLOADS.get(leak)
+                AnalysisLog.trace("Cookie leak of %s to %s: %s", domain, third_party, leak, event="cookie_leak", origin=domain, third_party=third_party, cookie=leak, encoding=encoding)
+
+        row = list()
+        for channel in LeakTable.CHANNELS:
+            row.append(our_domain_leaks.get((domain, channel), 0))
+            row.append("("+str(our_domain_leaks_overlap.get((domain, channel), 0))+")")
+
+        print(str("\\textbf{"+domain+"}").ljust(26), "&", whats_in_your_wallet_leaks, " & ", row[0], row[1], " & ", row[2], row[3], " & ", row[4], row[5], " & ", row[6], row[7], "\\\\")
 
     print("\\midrule")
     print(str("\\textbf{Total}").ljust(26), "&", whats_in_your_wallet_total_leaks, " & ", our_leaky_gets_total, "("+str(our_leaky_gets_total_overlap)+")", " & ", our_leaky_posts_total, "("+str(our_leaky_posts_total_overlap)+")", " & ", our_leaky_websockets_total, "("+str(our_leaky_websockets_total_overlap)+")", " & ", our_leaky_cookies_total, "("+str(our_leaky_cookies_total_overlap)+")", "\\\\")
@@ -484,15 +306,56 @@ def compare_leaks(other_leaks, our_leaks):
     print("\\bottomrule")"""
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: {} <DIRECTORY_WITH_LATEST_CRAWLS> <DIRECTORY_WITH_WHATS_IN_YOUR_WALLET_CRAWLS>".format(sys.argv[0]), file=sys.stderr)
-        sys.exit(1)
-    our_leaks = parse_directory(sys.argv[1], ETH_ADDR)
-    whats_in_your_wallet_leaks = parse_directory(sys.argv[2], ETH_ADDR_WHATS_IN_YOUR_WALLET)
-
-    # create_connectivity_graph()
+    parser = argparse.ArgumentParser(description="Compare our wallet address leaks with the ones of Winter et al.")
+    parser.add_argument("latest", metavar="DIRECTORY_WITH_LATEST_CRAWLS", nargs="?")
+    parser.add_argument("whats_in_your_wallet", metavar="DIRECTORY_WITH_WHATS_IN_YOUR_WALLET_CRAWLS", nargs="?")
+    parser.add_argument("--leaks", metavar="FILE", help="Write the leaks of both crawls to FILE (.csv, .jsonl or .npz).")
+    parser.add_argument("--payload-store", metavar="FILE", help="Keep the distinct leak payloads in a SQLite file instead of in memory.")
+    parser.add_argument("-w", "--watch", action="store_true", help="Keep watching the directory of the latest crawl and analyse crawl files as they are written.")
+    parser.add_argument("--idle-timeout", metavar="SECONDS", type=float, help="With --watch, stop once no crawl file has arrived for SECONDS.")
+    parser.add_argument("-s", "--shard", type=Sharding.parse_shard, metavar="I/N", help="Only analyse shard I of N (0-based) and write its leaks to winter_et_al_results.shard-I-of-N.json.")
+    parser.add_argument("--merge", nargs="+", metavar="FILE", help="Merge the leaks written by the shards instead of analysing the crawls.")
+    AnalysisLog.add_arguments(parser, debug=DEBUG)
+    args = parser.parse_args()
+    if not args.merge and (args.latest is None or args.whats_in_your_wallet is None):
+        parser.error("the crawl directories are required unless --merge is given")
+    AnalysisLog.setup_from_arguments(args)
+
+    sink = ResultSink.open_sink(args.leaks) if args.leaks else None
+    PAYLOADS = PayloadStore.PayloadStore(args.payload_store)
+    graph = DependencyGraph.DependencyGraph()
+    if args.merge:
+        shards = Sharding.load_partials(args.merge)
+        log("Merging the leaks of %s shards", len(shards), event="merge", shards=len(shards))
+        our_leaks = PayloadStore.compact_leaks(Sharding.merge_leaks(shards, "latest"), PAYLOADS)
+        whats_in_your_wallet_leaks = PayloadStore.compact_leaks(Sharding.merge_leaks(shards, "whats_in_your_wallet"), PAYLOADS)
+    elif args.watch:
+        # Compare against the finished crawl of Winter et al. while the latest crawl is still running.
+        whats_in_your_wallet_leaks = parse_directory(args.whats_in_your_wallet, ETH_ADDR_WHATS_IN_YOUR_WALLET, sink, "whats_in_your_wallet", shard=args.shard)
+        update = lambda our_leaks: compare_leaks(whats_in_your_wallet_leaks, our_leaks)
+        our_leaks = parse_directory(args.latest, ETH_ADDR, sink, "latest", graph, True, args.idle_timeout, update, args.shard)
+    else:
+        our_leaks = parse_directory(args.latest, ETH_ADDR, sink, "latest", graph, shard=args.shard)
+        whats_in_your_wallet_leaks = parse_directory(args.whats_in_your_wallet, ETH_ADDR_WHATS_IN_YOUR_WALLET, sink, "whats_in_your_wallet", shard=args.shard)
+    if sink:
+        sink.close()
+
+    if args.shard and not args.merge:
+        # The comparison is only printed once the shards are merged.
+        shard_file = "winter_et_al_results"+args.shard.suffix()+".json"
+        Checkpoint.write_json_atomically(shard_file, {
+            "shard": str(args.shard),
+            "latest": PayloadStore.expand_leaks(our_leaks, PAYLOADS),
+            "whats_in_your_wallet": PayloadStore.expand_leaks(whats_in_your_wallet_leaks, PAYLOADS)
+        })
+        log("Wrote the leaks of shard %s to %s", args.shard, shard_file, event="shard", shard=str(args.shard), file=shard_file)
+        PAYLOADS.close()
+        sys.exit(0)
+
+    # create_connectivity_graph(graph)
     #print_leaks(total_latest_sites, latest_leaks, post_leaks, whats_in_your_wallet_leaks)
 
     compare_leaks(whats_in_your_wallet_leaks, our_leaks)
+    PAYLOADS.close()
 
-    #print_sourced_script_popularity()
+    #print_sourced_script_popularity(graph)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import logging
+import multiprocessing.util
+import AnalysisLog
+
+def count_finalizers():
+    return len([finalizer for finalizer in multiprocessing.util._finalizer_registry.values() if finalizer._callback is AnalysisLog.shutdown])
+
+def test_setup_registers_one_finalizer():
+    AnalysisLog.setup()
+    registered = count_finalizers()
+    for _ in range(3):
+        AnalysisLog.setup()
+    assert count_finalizers() == registered == 1
+
+def test_is_tracing_follows_level():
+    AnalysisLog.setup(logging.DEBUG)
+    assert AnalysisLog.is_tracing()
+    AnalysisLog.setup(logging.INFO)
+    assert not AnalysisLog.is_tracing()
+
+def test_event_stream(tmp_path):
+    events_file = tmp_path / "events.jsonl"
+    AnalysisLog.setup(logging.INFO, str(events_file))
+    AnalysisLog.log("Found %s leaks", 2, event="leaks", leaks=2)
+    AnalysisLog.trace("Not written")
+    AnalysisLog.shutdown()
+    events = [json.loads(line) for line in events_file.read_text().splitlines()]
+    assert [event["event"] for event in events] == ["leaks"]
+
+def test_rate_limit_per_template(capsys):
+    AnalysisLog.setup(logging.INFO)
+    for i in range(200):
+        AnalysisLog.log("Parsing file: %s", "site"+str(i)+".json", event="file")
+    AnalysisLog.log("Done")
+    AnalysisLog.shutdown()
+    lines = capsys.readouterr().err.splitlines()
+    assert len([line for line in lines if "Parsing file" in line]) == AnalysisLog.RATE_LIMIT
+    assert lines[-1].endswith("Done")
+
+def test_rate_limit_drops_expired_windows():
+    limit = AnalysisLog.RateLimitFilter(limit=1, interval=0.05)
+    def record(template):
+        record = logging.LogRecord(AnalysisLog.LOGGER_NAME, logging.INFO, __file__, 0, template, None, None)
+        record.template = template
+        return record
+    for i in range(100):
+        assert limit.filter(record("Template "+str(i)+": %s"))
+    assert not limit.filter(record("Template 0: %s"))
+    time.sleep(0.1)
+    assert limit.filter(record("New: %s"))
+    # Only the window with a suppressed record to report is kept.
+    assert sorted(limit.windows) == ["New: %s", "Template 0: %s"]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+import time
+import pytest
+import CategoryRunner
+
+def analyse(job, progress):
+    if job["name"] == "broken":
+        raise ValueError("broken crawl")
+    # Finish after the broken category has failed.
+    time.sleep(0.5)
+    progress(job["name"]+".json", 1, 0.5)
+    return {"category": job["category"]}
+
+def make_jobs(names, directory):
+    return [{"category": name.title(), "name": name, "directory": str(directory)} for name in names]
+
+def test_results_of_all_jobs(tmp_path):
+    runner = CategoryRunner.CategoryRunner(make_jobs(["defi", "games"], tmp_path), analyse, workers=2)
+    assert runner.run() == {"defi": {"category": "Defi"}, "games": {"category": "Games"}}
+
+def test_failed_job_keeps_other_results(tmp_path):
+    finished = dict()
+    def on_result(job, result):
+        finished[job["name"]] = result
+    runner = CategoryRunner.CategoryRunner(make_jobs(["broken", "defi", "games"], tmp_path), analyse, workers=3, on_result=on_result)
+    with pytest.raises(RuntimeError, match="Broken") as error:
+        runner.run()
+    assert isinstance(error.value.__cause__, ValueError)
+    assert finished == {"defi": {"category": "Defi"}, "games": {"category": "Games"}}
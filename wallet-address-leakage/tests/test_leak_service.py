@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import random
+import subprocess
+import pytest
+
+# The leak detector needs pysha3, which does not build on every Python version.
+pytest.importorskip("sha3")
+
+import LeakService
+import LeakPipeline
+import PayloadStore
+import SyntheticCrawl
+
+from conftest import ANALYSIS_FOLDER
+
+LIVE_SCRIPT = os.path.join(ANALYSIS_FOLDER, "detect-leaks-live.py")
+ETH_ADDR = SyntheticCrawl.ETH_ADDR
+
+def generate_sites(sites=5, requests=120, leak_rate=0.2, seed=0):
+    rng = random.Random(seed)
+    return [SyntheticCrawl.SiteGenerator(rng, index, ETH_ADDR, requests, leak_rate).generate() for index in range(sites)]
+
+def test_live_verdicts_match_batch_leaks():
+    for json_data in generate_sites():
+        sink = LeakService.VerdictSink()
+        page = LeakPipeline.LeakPipeline("dapps", LeakPipeline.site_page(ETH_ADDR)).run(json_data, PayloadStore.PayloadStore(), sink)
+        assert sink.verdicts
+
+        service = LeakService.LeakService(ETH_ADDR)
+        verdicts = list()
+        assert service.handle({"event": "site", "url": json_data["url"]}) == []
+        for message in [dict(req, event="request") for req in json_data["requests"]]+[{"event": "cookies", "cookies": json_data["cookies"]}]:
+            for reply in service.handle(message):
+                verdicts.extend(reply["leaks"])
+        summary = service.handle({"event": "end"})[0]
+
+        assert verdicts == sink.verdicts
+        assert summary["leaks"] == len(sink.verdicts)
+        assert summary["third_parties"] == sorted(page.third_parties)
+
+def test_stdio_session():
+    address = ETH_ADDR.lower()
+    messages = [
+        {"event": "request", "id": "0", "url": "https://collect.pixel-metrics.com/b"},
+        {"event": "site", "url": "https://app.dapp.org/", "address": "0x"+ETH_ADDR},
+        {"event": "request", "id": "1", "url": "https://collect.pixel-metrics.com/b?uid=0x"+address, "requestContext": ["https://app.dapp.org/"]},
+        {"event": "request", "id": "2", "url": "https://app.dapp.org/static/main.js", "requestContext": ["https://app.dapp.org/"]},
+        {"event": "response", "id": "1", "responseHeaders": {"set-cookie": "_id="+address+"; Path=/"}},
+        {"event": "response", "id": "2", "responseHeaders": {"set-cookie": "_id="+address+"; Path=/"}},
+        {"event": "cookies", "cookies": [{"name": "_uid", "value": address, "domain": ".pixel-metrics.com"}, {"name": "_uid", "value": address, "domain": ".dapp.org"}]},
+        {"event": "scroll"},
+        {"event": "end"},
+        {"event": "cookies", "cookies": []},
+    ]
+    lines = [json.dumps(message) for message in messages]
+    lines.insert(3, "{not json")
+    lines.insert(4, "")
+    process = subprocess.run([sys.executable, LIVE_SCRIPT, "--stop-after", "3", "--log-level", "warning"], input="\n".join(lines)+"\n",
+                             cwd=ANALYSIS_FOLDER, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=120)
+    assert process.returncode == 0, process.stderr
+    replies = [json.loads(line) for line in process.stdout.splitlines()]
+    tracker_url = messages[2]["url"]
+    assert [reply["event"] for reply in replies] == ["error", "verdict", "error", "verdict", "verdict", "error", "summary", "error"]
+    assert replies[0]["message"] == "Expected a 'site' message before 'request'."
+    assert replies[1]["id"] == "1"
+    assert replies[1]["leaks"] == [{"channel": "GET", "third_party": "pixel-metrics.com", "url": tracker_url, "encoding": "urlencode"}]
+    assert replies[1]["stop"] is False
+    assert replies[2]["message"].startswith("JSONDecodeError(")
+    # The cookie set in the response is attributed to the request it answers.
+    assert replies[3]["leaks"] == [{"channel": "Cookies", "third_party": "pixel-metrics.com", "url": tracker_url, "encoding": ""}]
+    assert replies[3]["stop"] is False
+    assert replies[4]["leaks"] == [{"channel": "Cookies", "third_party": ".pixel-metrics.com", "url": "", "encoding": ""}]
+    assert replies[4]["stop"] is True
+    assert all([reply["origin"] == "dapp.org" and reply["leaky"] for reply in replies[1:2]+replies[3:5]])
+    assert replies[5]["message"] == "Unknown event: scroll"
+    summary = replies[6]
+    assert summary.pop("seconds") >= 0
+    assert summary == {"event": "summary", "url": "https://app.dapp.org/", "origin": "dapp.org", "requests": 2, "leaks": 3, "leaky": True, "third_parties": ["pixel-metrics.com"]}
+    assert replies[7]["message"] == "Expected a 'site' message before 'cookies'."
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+import LeakTable
+
+def make_table():
+    table = LeakTable.LeakTable()
+    table.append("a.org", "defi", "tracker.com", "GET", "")
+    table.append("b.org", "defi", "cdn.com", "POST", "base64")
+    return table
+
+def test_take_does_not_share_labels():
+    table = make_table()
+    taken = table.select(channel="GET")
+    taken.append("c.org", "games", "other.com", "Cookies", "sha256")
+    assert table.labels("dapp") == ["a.org", "b.org"]
+    assert table.labels("channel") == ["GET", "POST"]
+    assert not table.mask(dapp="c.org").any()
+    assert list(taken.records()) == [("a.org", "defi", "tracker.com", "GET", ""),
+                                     ("c.org", "games", "other.com", "Cookies", "sha256")]
+
+def test_take_keeps_counts():
+    table = make_table()
+    assert table.exclude(channel="GET").count_by("third_party") == {"cdn.com": 1}
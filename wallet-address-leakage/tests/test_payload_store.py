@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+import json
+import PayloadStore
+
+def make_leaks(payloads):
+    leaks = dict()
+    PayloadStore.add_leak(leaks, "https://dapp.example", "url", "tracker.example", payloads, "https://tracker.example/?a=0xabc", "hex")
+    PayloadStore.add_leak(leaks, "https://dapp.example", "url", None, payloads, "data:text/plain,0xabc", "hex")
+    PayloadStore.add_leak(leaks, "https://dapp.example", "cookie", None, payloads, "id=0xabc", "base64")
+    return leaks
+
+def test_json_round_trip_keeps_none_domain(tmp_path):
+    payloads = PayloadStore.PayloadStore()
+    leaks = make_leaks(payloads)
+    loaded = json.loads(json.dumps(PayloadStore.expand_leaks(leaks, payloads)))
+    compacted = PayloadStore.compact_leaks(loaded, PayloadStore.PayloadStore(str(tmp_path / "payloads.db")))
+    assert compacted == leaks
+    assert "null" not in compacted["https://dapp.example"]["url"]
+
+def test_round_trip_merges_with_new_leaks():
+    payloads = PayloadStore.PayloadStore()
+    leaks = PayloadStore.compact_leaks(json.loads(json.dumps(PayloadStore.expand_leaks(make_leaks(payloads), payloads))), payloads)
+    PayloadStore.add_leak(leaks, "https://dapp.example", "url", None, payloads, "blob:0xabc", "hex")
+    expanded = PayloadStore.expand_leaks(leaks, payloads)
+    assert list(expanded["https://dapp.example"]["url"]) == ["tracker.example", None]
+    assert expanded["https://dapp.example"]["url"][None] == [("data:text/plain,0xabc", "hex"), ("blob:0xabc", "hex")]
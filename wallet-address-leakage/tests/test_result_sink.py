@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+import ResultSink
+
+FIELDS = ["page", "third_party", "payload"]
+
+def make_records(start, stop):
+    return [("page"+str(i % 7), "tracker"+str(i % 3), None if i % 5 == 0 else "päyload"+str(i)) for i in range(start, stop)]
+
+def as_dicts(records):
+    return [{field: "" if value is None else value for field, value in zip(FIELDS, record)} for record in records]
+
+@pytest.mark.parametrize("extension", ["csv", "jsonl", "npz"])
+def test_resume_drops_records_after_checkpoint(tmp_path, extension):
+    file_name = str(tmp_path / ("leaks."+extension))
+    sink = ResultSink.open_sink(file_name, FIELDS, batch_size=4)
+    sink.write_many(make_records(0, 10))
+    position = sink.checkpoint()
+    sink.write_many(make_records(10, 13))
+    sink.flush()
+    # Crash: the sink is reopened from the checkpoint without being closed.
+    sink.file.close()
+    with ResultSink.open_sink(file_name, FIELDS, batch_size=4, resume=position) as sink:
+        sink.write_many(make_records(10, 20))
+    records = ResultSink.load_records(file_name)
+    if extension == "npz":
+        assert records == as_dicts(make_records(0, 20))
+        assert not os.path.exists(file_name+".chunks")
+    else:
+        assert [record["payload"] or "" for record in records] == [record["payload"] for record in as_dicts(make_records(0, 20))]
+
+def test_columnar_resume_after_close(tmp_path):
+    file_name = str(tmp_path / "leaks.npz")
+    sink = ResultSink.ColumnarSink(file_name, FIELDS, batch_size=3)
+    sink.write_many(make_records(0, 5))
+    position = sink.checkpoint()
+    sink.write_many(make_records(5, 8))
+    sink.close()
+    with ResultSink.ColumnarSink(file_name, FIELDS, resume=position) as sink:
+        sink.write_many(make_records(5, 9))
+    assert ResultSink.load_records(file_name) == as_dicts(make_records(0, 9))
+
+def test_columnar_checkpoint_appends_chunks(tmp_path):
+    file_name = str(tmp_path / "leaks.npz")
+    with ResultSink.ColumnarSink(file_name, FIELDS) as sink:
+        sizes = list()
+        for i in range(3):
+            sink.write_many(make_records(i * 100, (i + 1) * 100))
+            sink.checkpoint()
+            sizes.append(os.path.getsize(file_name+".chunks"))
+        # Only the new codes and labels are written at every checkpoint.
+        assert sizes[2] - sizes[1] == pytest.approx(sizes[1] - sizes[0], rel=0.1)
+        assert not os.path.exists(file_name)
+    codes, labels = ResultSink.load_columns(file_name)["third_party"]
+    assert labels == ["tracker0", "tracker1", "tracker2"]
+    assert len(codes) == 300
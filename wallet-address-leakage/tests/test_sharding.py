@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""
+ Runs the analyses once on a single node and once split into shards, each
+ shard in a process of its own as on separate machines, and checks that the
+ merged results equal those of the single run.
+"""
+
+import os
+import csv
+import sys
+import json
+import subprocess
+import pytest
+
+# The leak detector needs pysha3, which does not build on every Python version.
+pytest.importorskip("sha3")
+
+import SyntheticCrawl
+import Sharding
+
+from conftest import ANALYSIS_FOLDER
+
+SHARDS = 3
+
+DAPPS_SCRIPT = os.path.join(ANALYSIS_FOLDER, "find-leaks-and-scripts-dapps.py")
+WINTER_SCRIPT = os.path.join(ANALYSIS_FOLDER, "find-leaks-and-scripts-winter-et-al.py")
+WHATS_IN_YOUR_WALLET_ADDR = "FDb672F061E5718eF0A56Db332e08616e9055548"
+
+def get_work_directory(root, name):
+    """Return the working directory of a run; its crawl store goes to ../results as in the repository."""
+    os.makedirs(os.path.join(root, name, "results"))
+    os.makedirs(os.path.join(root, name, "work"))
+    return os.path.join(root, name, "work")
+
+def start(script, args, cwd):
+    return subprocess.Popen([sys.executable, script, *args, "--log-level", "warning"], cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+def wait(process):
+    stdout, stderr = process.communicate(timeout=600)
+    assert process.returncode == 0, stderr
+    return stdout
+
+def run_sharded(root, script, args, shard_file):
+    """Run all shards at the same time and return their working directories and partial result files."""
+    directories = [get_work_directory(root, "shard-"+str(i)) for i in range(SHARDS)]
+    processes = [start(script, args+["--shard", str(i)+"/"+str(SHARDS)], directory) for i, directory in enumerate(directories)]
+    for process in processes:
+        wait(process)
+    partials = [os.path.join(directory, shard_file+Sharding.Shard(i, SHARDS).suffix()+".json") for i, directory in enumerate(directories)]
+    return directories, partials
+
+def read_rows(file_name):
+    with open(file_name, "r", encoding="utf-8", newline="") as f:
+        return list(csv.reader(f))[1:]
+
+def add_data_url_leaks(directory, eth_address, every=5):
+    """Add a request to a data: URL, which has no third-party domain, with the address to every few sites."""
+    for i, name in enumerate(sorted(os.listdir(directory))):
+        if i % every == 0:
+            file_name = os.path.join(directory, name)
+            with open(file_name, "r") as f:
+                json_data = json.load(f)
+            json_data["requests"].append({
+                "requestContext": [json_data["url"]],
+                "id": str(len(json_data["requests"])),
+                "url": "data:text/plain,0x"+eth_address.lower(),
+                "type": "XHR",
+                "method": "GET",
+                "headers": {"referer": json_data["url"]}
+            })
+            with open(file_name, "w") as f:
+                json.dump(json_data, f)
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    root = tmp_path_factory.mktemp("corpus")
+    directories = dict()
+    for seed, name in enumerate(["defi", "games", "latest"]):
+        directories[name] = str(root / name)
+        SyntheticCrawl.write_corpus(directories[name], sites=24, requests=40, leak_rate=0.1, seed=seed)
+        add_data_url_leaks(directories[name], SyntheticCrawl.ETH_ADDR)
+    directories["whats_in_your_wallet"] = str(root / "whats_in_your_wallet")
+    SyntheticCrawl.write_corpus(directories["whats_in_your_wallet"], sites=24, requests=40, leak_rate=0.1, seed=3, eth_address=WHATS_IN_YOUR_WALLET_ADDR)
+    add_data_url_leaks(directories["whats_in_your_wallet"], WHATS_IN_YOUR_WALLET_ADDR)
+    return directories
+
+def test_sites_spread_over_shards(corpus):
+    names = os.listdir(corpus["defi"])
+    shards = [Sharding.Shard(i, SHARDS) for i in range(SHARDS)]
+    assert sorted([name for shard in shards for name in names if name in shard]) == sorted(names)
+    assert all([any([name in shard for name in names]) for shard in shards])
+
+def test_dapps_merge_equals_single_run(corpus, tmp_path):
+    manifest = str(tmp_path / "manifest.json")
+    with open(manifest, "w") as f:
+        json.dump([{"category": "DeFi", "name": "defi", "directory": corpus["defi"]},
+                   {"category": "Games", "name": "games", "directory": corpus["games"]}], f)
+    args = ["--manifest", manifest, "--workers", "2"]
+
+    single = get_work_directory(tmp_path, "single")
+    single_output = wait(start(DAPPS_SCRIPT, args, single))
+    shards, partials = run_sharded(tmp_path, DAPPS_SCRIPT, args, "dapps_results")
+    merged = get_work_directory(tmp_path, "merged")
+    merged_output = wait(start(DAPPS_SCRIPT, ["--merge", *partials], merged))
+
+    with open(os.path.join(single, "dapps_results.json"), "r") as f:
+        single_results = json.load(f)
+    with open(os.path.join(merged, "dapps_results.json"), "r") as f:
+        merged_results = json.load(f)
+    assert merged_results == single_results
+    assert json.dumps(merged_results) == json.dumps(single_results)
+    assert merged_output == single_output
+    assert single_results["DeFi"]["get_leaks"] > 0
+    assert None in single_results["DeFi"]["third_parties"]
+
+    for name in ["defi", "games"]:
+        single_rows = read_rows(os.path.join(single, "dapps_"+name+"_leaks.csv"))
+        shard_rows = list()
+        for i, directory in enumerate(shards):
+            shard_rows.extend(read_rows(os.path.join(directory, "dapps_"+name+"_leaks"+Sharding.Shard(i, SHARDS).suffix()+".csv")))
+        assert len(single_rows) > 0
+        assert sorted(shard_rows) == sorted(single_rows)
+
+def test_winter_merge_equals_single_run(corpus, tmp_path):
+    args = [corpus["latest"], corpus["whats_in_your_wallet"], "--leaks", "leaks.csv"]
+
+    single = get_work_directory(tmp_path, "single")
+    single_output = wait(start(WINTER_SCRIPT, args, single))
+    shards, partials = run_sharded(tmp_path, WINTER_SCRIPT, args, "winter_et_al_results")
+    merged = get_work_directory(tmp_path, "merged")
+    merged_output = wait(start(WINTER_SCRIPT, ["--merge", *partials], merged))
+
+    assert "\\textbf{Total}" in single_output
+    assert merged_output == single_output
+
+    shard_rows = list()
+    for directory in shards:
+        shard_rows.extend(read_rows(os.path.join(directory, "leaks.csv")))
+    single_rows = read_rows(os.path.join(single, "leaks.csv"))
+    assert len(single_rows) > 0
+    assert sorted(shard_rows) == sorted(single_rows)